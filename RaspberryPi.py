@@ -1,21 +1,29 @@
+import argparse
+import os
 import socket
 import time
 import threading
-import RPi.GPIO as GPIO
 from datetime import datetime
-from collections import deque, defaultdict  # Added missing import
-import numpy as np
+from collections import deque
+from queue import Empty
 
-import matplotlib
-matplotlib.use('TkAgg')  # Must be before importing plt
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from queue import Queue
-import tkinter as tk
+import numpy as np
 
-# GPIO Setup
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
+from backends import HIGH, LOW, SystemClock, create_display, create_gpio
+from binlog import binary_filename
+from controller import ResetController
+from dashboard import DashboardServer
+from detector import AnomalyDetector
+from ingest import IngestEngine
+from leds import LedBlinker
+from logwriter import LogWriter
+from metrics import MetricsServer, Registry, SamplingProfiler
+from procstats import process_cpu_time, rss_bytes, thread_cpu_times
+from protocol import Reading, ReadingOrder, parse_datagram, parse_frame, MalformedFrame
+from rollup import RollupEngine
+from state import (DEFAULT_TTL, Activate, Reset, SwarmState, master_duration,
+                   master_durations)
+from store import DEFAULT_WINDOW, DeviceStore
 
 # LED Pins
 RED_LED = 27
@@ -23,265 +31,273 @@ GREEN_LED = 23
 YELLOW_LED = 22
 WHITE_LED = 24
 RESET_BUTTON = 15
-
-# Setup pins
-for pin in [RED_LED, GREEN_LED, YELLOW_LED, WHITE_LED]:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, GPIO.LOW)
-
-GPIO.setup(RESET_BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+# Master LEDs in assignment order; the last one doubles as the reset indicator
+LED_PINS = (RED_LED, GREEN_LED, YELLOW_LED)
 
 # Network settings
 UDP_PORT = 2910
 BROADCAST_IP = '192.168.1.255'
 
+# Seconds between plot refreshes
+GUI_REFRESH_INTERVAL = 1.0
+
+# Most readings the receive thread takes off the queue for one detector pass
+DETECT_BATCH = 1024
+# How long the alert LED lights for an outlier or a light change
+ALERT_SECONDS = 0.5
+
 class GraphData:
-    def __init__(self):
+    """What the plots show, read from SwarmState snapshots.
+
+    refresh() pins the latest snapshot, so every call made while drawing
+    one frame sees the same masters, durations and colors.
+    """
+
+    def __init__(self, store, state, clock=None, history_seconds=DEFAULT_WINDOW):
         print("Initializing GraphData...")
-        self.start_time = time.time()
-        self.timestamps = deque(maxlen=30)
-        self.readings = deque(maxlen=30)
-        self.colors = deque(maxlen=30)
-        self.master_times = defaultdict(float)
-        self.master_start_times = {}
-        self.current_master = None
+        self.clock = clock or SystemClock()
+        self.store = store
+        self.state = state
+        self.history_seconds = history_seconds
+        self.snapshot = state.snapshot
         self.master_colors = {}
-        self.last_update = time.time()
+        self._next_color = 0
+        # Recent state.Departure events, shown for a while on the plot
+        self.departures = deque(maxlen=5)
+        # Recent detector.Anomaly events and the devices stuck at a rail
+        self.anomalies = deque(maxlen=50)
+        self.stuck = ()
         
         # Add color setup
         self.color_list = ['red', 'blue', 'green', 'purple', 'orange', 'yellow']
-        self.next_color_idx = 0
-        
-        # Create figure with two subplots
-        self.fig, (self.ax1, self.ax2) = plt.subplots(2, 1, figsize=(6, 4))
-        self.fig.canvas.manager.set_window_title('LightSwarm Monitor')
-        
-        # Enable faster rendering
-        self.fig.canvas.toolbar.set_message = lambda x: None
-        self.fig.set_tight_layout(True)
-        
-        self.setup_plots()
-        manager = plt.get_current_fig_manager()
-        manager.window.wm_geometry("+0+0")
-        
-        # Initialize plots
-        self.ax1.plot([], [])
-        self.ax2.bar([], [])
-        
-        plt.ion()
-        plt.show(block=False)
-        plt.pause(0.1)
-
-    def reset(self):
-        """Thread-safe reset of graph data"""
-        # Clear data
-        self.timestamps.clear()
-        self.readings.clear()
-        self.colors.clear()
-        self.master_times.clear()
-        self.master_start_times.clear()
-        self.current_master = None
-        self.master_colors.clear()
-        self.next_color_idx = 0
-        self.start_time = time.time()
-        
-        try:
-            # Clear plots
-            self.ax1.cla()
-            self.ax2.cla()
-            
-            # Reset to initial state
-            self.setup_plots()
-            
-            # Draw empty plots
-            self.ax1.plot([], [])
-            self.ax2.bar([], [])
-            
-            # Update
-            self.fig.canvas.draw_idle()
-        except Exception as e:
-            print(f"Error in reset: {e}")
-
-    def setup_plots(self):
-        """Set up the basic plot parameters"""
-        try:
-            # Configure photocell plot
-            self.ax1.set_title('Photocell Readings (Last 30s)', fontsize=8)
-            self.ax1.set_xlabel('Time (s)', fontsize=8)
-            self.ax1.set_ylabel('Reading', fontsize=8)
-            self.ax1.tick_params(labelsize=6)
-            self.ax1.grid(True)
-            self.ax1.set_ylim(0, 1023)
-            self.ax1.set_xlim(0, 30)
-            
-            # Configure master times plot
-            self.ax2.set_title('Master Device Times', fontsize=8)
-            self.ax2.set_xlabel('Device IP', fontsize=8)
-            self.ax2.set_ylabel('Time as Master (s)', fontsize=8)
-            self.ax2.tick_params(labelsize=6)
-            self.ax2.grid(True)
-            self.ax2.set_ylim(0, 10)
-            
-            self.fig.tight_layout()
-        except Exception as e:
-            print(f"Error in setup_plots: {e}")
 
-    def update_plots(self):
-        try:
-            # Clear existing plots
-            self.ax1.cla()
-            self.ax2.cla()
-            
-            # Reestablish basic plot parameters
-            self.setup_plots()
-            
-            # If we have data, plot it
-            if self.timestamps:
-                times = np.array(list(self.timestamps)) - min(self.timestamps)
-                readings = np.array(list(self.readings))
-                
-                # Plot readings
-                for i in range(len(times)-1):
-                    self.ax1.plot(times[i:i+2], readings[i:i+2], 
-                                color=list(self.colors)[i], linewidth=2)
-                
-                # Plot bar chart if we have master data
-                if self.master_times:
-                    current_time = time.time()
-                    master_data = self.master_times.copy()
-                    
-                    if self.current_master and self.current_master in self.master_start_times:
-                        ongoing_duration = current_time - self.master_start_times[self.current_master]
-                        master_data[self.current_master] = master_data.get(self.current_master, 0) + ongoing_duration
-                    
-                    ips = list(master_data.keys())
-                    times = list(master_data.values())
-                    bars = self.ax2.bar(range(len(ips)), times)
-                    
-                    for idx, (bar, ip) in enumerate(zip(bars, ips)):
-                        bar.set_color(self.master_colors[ip])
-                        self.ax2.text(idx, bar.get_height(), f'{bar.get_height():.1f}s',
-                                    ha='center', va='bottom', fontsize=6)
-                    
-                    self.ax2.set_xticks(range(len(ips)))
-                    self.ax2.set_xticklabels(ips, rotation=45, ha='right')
-                
-                # Add legend if we have masters
-                if self.master_colors:
-                    legend_elements = [plt.Line2D([0], [0], color=color, label=f'Master {ip}')
-                                     for ip, color in self.master_colors.items()]
-                    self.ax1.legend(handles=legend_elements, loc='upper right', fontsize=6)
-            
-            # Update the display
-            self.fig.canvas.draw_idle()
-            self.fig.canvas.flush_events()
-            
-        except Exception as e:
-            print(f"Error updating plots: {e}")
+    def refresh(self):
+        """Pin the current snapshot for the next frame"""
+        snapshot = self.state.snapshot
+        if snapshot is not self.snapshot:
+            if snapshot.session_start != self.snapshot.session_start:
+                self._next_color = 0
+            self.snapshot = snapshot
+            # One color per device, in the order they first became master; a
+            # device keeps its color when others depart
+            colors = {}
+            for device_id in snapshot.master_totals:
+                color = self.master_colors.get(device_id)
+                if color is None:
+                    color = self.color_list[self._next_color % len(self.color_list)]
+                    self._next_color += 1
+                colors[device_id] = color
+            self.master_colors = colors
 
-    def get_master_color(self, master_ip):
-        if master_ip not in self.master_colors:
-            self.master_colors[master_ip] = self.color_list[self.next_color_idx % len(self.color_list)]
-            self.next_color_idx += 1
-        return self.master_colors[master_ip]
+    def get_master_durations(self, current_time):
+        """Total master time per device, including the current master's ongoing run"""
+        return master_durations(self.snapshot, current_time)
 
-    def update_data(self, timestamp, reading, master_ip):
-        current_time = time.time()
-        
-        # Update master timing if master changed or for first master
-        if master_ip != self.current_master:
-            # Handle previous master's time if there was one
-            if self.current_master:
-                duration = current_time - self.master_start_times[self.current_master]
-                self.master_times[self.current_master] += duration
-                print(f"Master changed from {self.current_master} to {master_ip}")
-            
-            # Always set start time for new/current master
-            self.master_start_times[master_ip] = current_time
-            self.current_master = master_ip
-            
-            # Initialize master_times entry if it doesn't exist
-            if master_ip not in self.master_times:
-                self.master_times[master_ip] = 0.0
-        
-        # Always store the new reading
-        self.timestamps.append(current_time)
-        self.readings.append(reading)
-        self.colors.append(self.get_master_color(master_ip))
+    def label(self, device_id):
+        """IP address shown for a device"""
+        info = self.snapshot.devices.get(device_id) or self.snapshot.departed.get(device_id)
+        return info.addr if info is not None else str(device_id)
 
+    def trace(self, current_time):
+        """Master readings over the history window as (times, readings, colors)"""
+        times, readings, device_ids = self.store.master_trace(current_time, self.history_seconds)
+        unique_ids, inverse = np.unique(device_ids, return_inverse=True)
+        palette = [self.master_colors.get(int(d), 'gray') for d in unique_ids]
+        colors = [palette[i] for i in inverse]
+        return times, readings, colors
 
-                
-    def on_key_press(self, event):
-        if event.key == 'q':
-            print("\nClosing application...")
-            plt.close('all')
-            if hasattr(self, 'lightswarm'):
-                self.lightswarm.running = False
-                self.lightswarm.cleanup()
-            
 class LightSwarm:
-    def __init__(self):
-        # Initialize tkinter root first
-        self.root = tk.Tk()
-        self.root.withdraw()  # Hide the main window
+    def __init__(self, gpio=None, display=None, clock=None,
+                 refresh_interval=GUI_REFRESH_INTERVAL,
+                 port=UDP_PORT, broadcast_ip=BROADCAST_IP, command_port=None,
+                 log_dir='.', log_writer=None, log_formats=('text',), listen=True,
+                 device_ttl=DEFAULT_TTL, metrics_port=None, profile=False,
+                 dashboard_port=None, dashboard_host='127.0.0.1', db_path=None,
+                 led_pins=LED_PINS, reset_pin=RESET_BUTTON, log_prefix='lightswarm',
+                 history_seconds=DEFAULT_WINDOW):
+        self.clock = clock or SystemClock()
+        self.port = port
+        # RESET/ACTIVATE go to the ESPs' port, which is ours unless overridden
+        self.command_addr = (broadcast_ip, command_port or port)
+        self.log_dir = log_dir
+        self.log_prefix = log_prefix
         
-        # Initialize matplotlib in main thread
-        plt.ion()  # Turn on interactive mode
+        # Hardware setup; other swarms on this host may own other pins
+        self.gpio = gpio or create_gpio()
+        self.led_pins = tuple(led_pins)
+        self.indicator_pin = self.led_pins[-1] if self.led_pins else None
+        # Reset generations: sent by send_reset, applied by apply_reset and
+        # ended by finish_reset. A reset applied after its generation ended
+        # (a backlogged queue and a quick ACTIVATE) leaves the indicator off
+        self._indicator_lock = threading.Lock()
+        self._reset_generation = 0
+        self._applied_generation = 0
+        self._finished_generation = 0
+        # The white LED flags anomalies; only the default pin set has one
+        self.alert_pin = WHITE_LED if self.led_pins == LED_PINS else None
+        self.output_pins = self.led_pins + ((self.alert_pin,) if self.alert_pin is not None else ())
+        for pin in self.output_pins:
+            self.gpio.setup_output(pin)
+        if reset_pin is not None:
+            self.gpio.setup_input(reset_pin)
         
-        # Socket setup
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.sock.bind(('', UDP_PORT))
+        # Display backend is created first so Tk owns the main thread
+        self.display = display or create_display('tk', self.clock)
+        
+        # Socket setup (skipped when messages are fed in directly, e.g. replay)
+        self.sock = None
+        self.ingest = None
+        if listen:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self.sock.bind(('', port))
+            self.ingest = IngestEngine(self.sock, clock=self.clock.time)
+        # Time order for messages fed in directly (the ingest thread has its own)
+        self.order = ReadingOrder()
         
-        self.current_master = None
         self.running = True
-        self.system_active = True
+        self.refresh_interval = refresh_interval
+        
+        # Devices, LED assignments and master tracking; only the thread that
+        # consumes the ingest queue changes it, everyone else reads snapshots
+        self.state = SwarmState(led_pins=self.led_pins,
+                                start=self.clock.time(), ttl=device_ttl)
+        
+        # Per-device readings from every LIGHT and MASTER packet
+        self.store = DeviceStore(window=history_seconds)
+        # Long-range history: 1s/1min/1h buckets of readings and master time
+        self.rollups = RollupEngine()
+        # Light changes, outliers and stuck sensors, per device
+        self.detector = AnomalyDetector()
         
-        # Initialize graph data after Tkinter root
-        self.graph_data = GraphData()
+        # Initialize graph data and attach the display to it
+        self.graph_data = GraphData(self.store, self.state, self.clock, history_seconds)
         self.graph_data.lightswarm = self
+        self.display.start(self)
         
+        # Browser viewers draw the same plots from streamed samples
+        self.dashboard = None
+        if dashboard_port is not None:
+            self.dashboard = DashboardServer(dashboard_port, dashboard_host, self.clock.time,
+                                             self.graph_data.history_seconds,
+                                             history=self.rollups.series).start()
+            print(f"Dashboard on http://{dashboard_host}:{self.dashboard.port}/")
+        
+        self.log_writer = log_writer or LogWriter(formats=log_formats, db_path=db_path)
         self.current_logfile = self.create_new_logfile()
         
-        # Device tracking
-        self.device_data = {}
-        self.device_led_assignments = {}
-        self.available_leds = [RED_LED, GREEN_LED, YELLOW_LED]
+        # Master LED blinking runs on clock timers
+        self.leds = LedBlinker(self.gpio, self.clock)
+        
+        # Button presses arrive as GPIO edge callbacks
+        self.controller = None
+        if reset_pin is not None:
+            self.controller = ResetController(self, self.gpio, reset_pin, self.clock)
+            self.controller.start()
+        
+        # Hot-path timings and counters, optionally served over HTTP
+        self.metrics = Registry()
+        self.setup_metrics()
+        self.metrics_server = None
+        if metrics_port is not None:
+            profiler = SamplingProfiler()
+            self.metrics_server = MetricsServer(self.metrics, metrics_port,
+                                                profiler=profiler).start()
+            print(f"Metrics on http://127.0.0.1:{self.metrics_server.port}/metrics")
+            if profile:
+                profiler.start()
         
         # Start threads
-        threading.Thread(target=self.receive_data, daemon=True).start()
-        threading.Thread(target=self.handle_button, daemon=True).start()
-        threading.Thread(target=self.update_leds, daemon=True).start()
+        if self.ingest is not None:
+            self.ingest.start()
+            threading.Thread(target=self.receive_data, name='receive', daemon=True).start()
+
 
+    def setup_metrics(self):
+        m = self.metrics
+        self.handle_seconds = m.histogram('lightswarm_handle_seconds',
+                                          'Time to handle one reading on the receive thread')
+        self.queue_wait_seconds = m.histogram('lightswarm_queue_wait_seconds',
+                                              'Time from ingest to handling, per reading')
+        self.frame_seconds = m.histogram('lightswarm_frame_seconds',
+                                         'Time spent in update_plots per refresh')
+        self.detect_seconds = m.histogram('lightswarm_detect_seconds',
+                                          'Time to run the anomaly detector over one batch')
+        self.master_changes = m.counter('lightswarm_master_changes_total',
+                                        'Master elections seen')
+        if self.ingest is not None:
+            stats = self.ingest.stats
+            m.counter_func('lightswarm_datagrams_total', 'Datagrams received',
+                           lambda: stats.received)
+            m.counter_func('lightswarm_readings_total', 'Readings queued for handling',
+                           lambda: stats.readings)
+            m.counter_func('lightswarm_dropped_total', 'Readings dropped on a full queue',
+                           lambda: stats.dropped)
+            m.counter_func('lightswarm_malformed_total', 'Datagrams that failed to parse',
+                           lambda: stats.malformed)
+            m.counter_func('lightswarm_parse_seconds_total', 'Time spent parsing datagrams',
+                           lambda: stats.parse_seconds)
+            m.gauge('lightswarm_ingest_queue_depth', 'Readings waiting for the receive thread',
+                    self.ingest.queue.qsize)
+        m.register(self.log_writer.write_seconds)
+        m.gauge('lightswarm_log_queue_depth', 'Log items waiting for the writer thread',
+                self.log_writer.pending)
+        m.gauge('lightswarm_devices', 'Live devices', lambda: len(self.state.snapshot.devices))
+        m.gauge('lightswarm_reading', 'Readings of every device over the history window',
+                self.reading_stats, label='stat')
+        m.gauge('lightswarm_memory_bytes', 'Memory held by the reading store and rollups',
+                lambda: {'store': self.store.memory_bytes(),
+                         'rollups': self.rollups.memory_bytes()}, label='part')
+        m.counter_func('lightswarm_anomalies_total', 'Anomalies detected, by kind',
+                       lambda: dict(self.detector.counts), label='kind')
+        m.gauge('lightswarm_stuck_devices', 'Devices whose sensor is stuck at a rail',
+                lambda: len(self.graph_data.stuck))
+        m.gauge('lightswarm_led_jitter_seconds', 'Lateness of recent LED toggles',
+                lambda: {k: v for k, v in self.leds.jitter_stats().items() if k != 'toggles'},
+                label='stat')
+        m.counter_func('lightswarm_led_toggles_total', 'LED toggles', lambda: self.leds.toggles)
+        m.gauge('lightswarm_render_frame_seconds', 'Frame times reported by the renderer',
+                lambda: {k: v for k, v in self.display.frame_stats().items() if k != 'frames'},
+                label='stat')
+        m.counter_func('lightswarm_render_frames_total', 'Frames drawn by the renderer',
+                       lambda: self.display.frame_stats()['frames'])
+        if self.dashboard is not None:
+            hub = self.dashboard.hub
+            m.gauge('lightswarm_dashboard_clients', 'Connected dashboard viewers',
+                    lambda: hub.clients)
+            m.register(hub.sent)
+            m.register(hub.skipped)
+        m.counter_func('lightswarm_thread_cpu_seconds_total', 'CPU time per thread',
+                       thread_cpu_times, label='thread')
+        m.counter_func('process_cpu_seconds_total', 'CPU time of the whole process',
+                       process_cpu_time)
+        m.gauge('process_resident_memory_bytes', 'Resident set size', rss_bytes)
+
+    def reading_stats(self):
+        """Swarm-wide min/max/mean/percentiles over the store's window"""
+        stats = self.store.window_stats(self.clock.time())['all']
+        if not stats['count']:
+            return {}
+        p5, p50, p95 = stats['percentiles'].tolist()
+        return {'count': stats['count'], 'min': stats['min'], 'max': stats['max'],
+                'mean': stats['mean'], 'p5': p5, 'p50': p50, 'p95': p95}
 
     def update_gui(self):
-        """Main GUI update function"""
-        last_update = time.time()
-        update_interval = 1.0  # 1 second
+        """Main loop: sample the master and redraw at a fixed interval"""
+        last_update = self.clock.time()
+        update_interval = self.refresh_interval
 
         while self.running:
             try:
-                current_time = time.time()
+                current_time = self.clock.time()
                 
                 # Update GUI at fixed interval
                 if current_time - last_update >= update_interval:
-                    if self.system_active:
-                        # Get current reading if available
-                        if self.current_master and self.current_master in self.device_data:
-                            reading = self.device_data[self.current_master]['reading']
-                            ip_addr = self.device_data[self.current_master]['addr']
-                            
-                            # Update data and plots
-                            self.graph_data.update_data(current_time, reading, ip_addr)
-                        
-                        # Always update plots
-                        self.graph_data.update_plots()
-                        
+                    self.tick(current_time)
                     last_update = current_time
                 
                 # Keep GUI responsive
-                self.root.update()
-                plt.pause(0.01)  # Add small pause for matplotlib
+                self.display.pump()
                 
             except Exception as e:
                 if 'main thread' not in str(e):
@@ -289,146 +305,320 @@ class LightSwarm:
             
             if not self.running:
                 break
+
+    def tick(self, current_time):
+        """One refresh: redraw from the latest snapshot"""
+        if self.state.snapshot.active:
+            if self.graph_data.stuck and self.alert_pin is not None:
+                # Alert LED stays lit while any sensor is stuck
+                self.leds.pulse(self.alert_pin, self.refresh_interval * 1.5)
+            self.graph_data.refresh()
+            self.update_plots()
+            if self.dashboard is not None:
+                self.dashboard.hub.publish(self.graph_data, current_time)
             
+    def update_plots(self):
+        started = time.perf_counter()
+        try:
+            self.display.render()
+        except Exception as e:
+            print(f"Error updating plots: {e}")
+        self.frame_seconds.observe(time.perf_counter() - started)
+
     def receive_data(self):
+        """Consume readings and control events from the ingest queue.
+
+        This thread owns self.state: every change to it happens here.
+        """
+        queue = self.ingest.queue
         while self.running:
             try:
-                data, addr = self.sock.recvfrom(1024)
-                message = data.decode('utf-8')
-                if message.startswith('MASTER:'):
-                        print(f"Received: {message} from {addr}")
-                self.handle_message(message, addr)
+                event = queue.get(timeout=0.5)
+            except Empty:
+                # Quiet network: devices still have to time out
+                self.expire_devices(self.clock.time())
+                continue
+            # Take the readings already queued behind it, up to the next
+            # control event, so the detector sees them as one batch
+            batch = []
+            while isinstance(event, Reading):
+                batch.append(event)
+                if len(batch) >= DETECT_BATCH:
+                    event = None
+                    break
+                try:
+                    event = queue.get_nowait()
+                except Empty:
+                    event = None
+            for record in batch:
+                try:
+                    started = time.perf_counter()
+                    self.queue_wait_seconds.observe(max(0.0, self.clock.time() - record.timestamp))
+                    self.handle_record(record)
+                    self.handle_seconds.observe(time.perf_counter() - started)
+                except Exception as e:
+                    print(f"Error receiving data: {e}")
+            try:
+                if batch:
+                    self.detect(batch)
+                if event is not None:
+                    self.handle_control(event)
             except Exception as e:
                 print(f"Error receiving data: {e}")
 
+    def post(self, event):
+        """Queue a control event behind the readings received before it"""
+        if self.ingest is not None:
+            self.ingest.queue.put(event)
+        else:
+            # Messages are fed in directly (replay): the caller owns the state
+            self.handle_control(event)
+
     def handle_message(self, message, addr):
-            if not self.system_active:
+        """Parse a single text message and handle it like an ingested packet"""
+        try:
+            record = parse_frame(message.encode('ascii'), addr[0], self.clock.time())
+        except (MalformedFrame, UnicodeEncodeError) as e:
+            print(f"Error handling message: {e}")
+            return
+        if record is not None:
+            records = self.order.order((record,))
+            self.handle_record(records[0])
+            self.detect(records)
+
+    def handle_datagram(self, data, addr):
+        """Parse a raw datagram, text or binary, and handle every reading in it"""
+        try:
+            records = parse_datagram(data, len(data), addr[0], self.clock.time())
+        except MalformedFrame as e:
+            print(f"Error handling datagram: {e}")
+            return
+        records = self.order.order(records)
+        for record in records:
+            self.handle_record(record)
+        self.detect(records)
+
+    def handle_record(self, record):
+            if not self.state.snapshot.active:
+                return
+            self.expire_devices(record.timestamp)
+            
+            # Every node's reading goes into the store, master or not
+            is_master = record.kind == 'MASTER'
+            self.store.add(record.device_id, record.reading, record.timestamp, is_master)
+            self.rollups.add(record.device_id, record.reading, record.timestamp, is_master)
+            change = self.state.apply_reading(record)
+            if not is_master:
+                # Only the binary log and the database keep non-master readings
+                if self.log_writer.all_readings:
+                    self.log_writer.write_record(record.timestamp, record.device_id, record.addr,
+                                                 record.reading, 0.0, False)
                 return
                 
-            if message.startswith('MASTER:'):
-                try:
-                    _, device_id, reading = message.split(':')
-                    device_id = int(device_id)
-                    reading = int(reading)
-                    
-                    # Update device data first
-                    self.device_data[device_id] = {
-                        'reading': reading,
-                        'last_seen': time.time(),
-                        'addr': addr[0]
-                    }
-                    
-                    # Assign LED if needed
-                    if device_id not in self.device_led_assignments and self.available_leds:
-                        self.device_led_assignments[device_id] = self.available_leds.pop(0)
-                        print(f"Assigned LED {self.device_led_assignments[device_id]} to Device {device_id}")
-                    
-                    # Handle master change more gracefully
-                    if self.current_master is None or self.current_master != device_id:
-                        # Log the master change
-                        old_master = self.current_master
-                        self.current_master = device_id
-                        print(f"Master changed from {old_master} to {device_id}")
-                    
-                    # Log data after master update
-                    self.log_data(device_id, reading)
-                    
-                    print(f"Master Device {device_id}: Reading = {reading}")
-                except Exception as e:
-                    print(f"Error handling master message: {e}")
+            try:
+                # Feed the plots (a no-op unless they render out of process)
+                self.display.add_sample(record.timestamp, record.reading,
+                                        record.device_id, record.addr)
+                if self.dashboard is not None:
+                    self.dashboard.hub.add_sample(record.timestamp, record.reading,
+                                                  record.device_id, record.addr)
+                
+                if change is not None:
+                    self.master_changes.inc()
+                    self.log_writer.write_master_change(change.timestamp, change.new, record.addr)
+                    print(f"Master changed from {change.old} to {change.new}")
+                
+                # Retime the master's LED for the new reading straight away
+                self.update_leds()
+                
+                # Log data after master update
+                self.log_data(record)
+            except Exception as e:
+                print(f"Error handling master message: {e}")
+
+    def detect(self, records):
+        """Run the anomaly detector over readings already handled (state owner thread)"""
+        if not records or not self.state.snapshot.active:
+            return
+        started = time.perf_counter()
+        anomalies = self.detector.observe(records)
+        self.detect_seconds.observe(time.perf_counter() - started)
+        for anomaly in anomalies:
+            self.handle_anomaly(anomaly)
+
+    def handle_anomaly(self, anomaly):
+        """Report a detector event on the log, the plots and the alert LED"""
+        info = self.state.snapshot.devices.get(anomaly.device_id)
+        device = f"Device {anomaly.device_id} ({info.addr if info is not None else 'unknown'})"
+        stamp = datetime.fromtimestamp(anomaly.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        if anomaly.kind == 'outlier':
+            message = (f"{device} outlier reading {anomaly.reading} at {stamp} "
+                       f"(mean {anomaly.mean:.0f}, z {anomaly.score:+.1f})")
+        elif anomaly.kind == 'change':
+            message = f"{device} light changed at {stamp}: {anomaly.mean:.0f} -> {anomaly.reading}"
+        elif anomaly.kind == 'stuck':
+            message = (f"{device} stuck at {anomaly.reading} for {anomaly.score:.0f} readings, "
+                       f"at {stamp}")
+        else:
+            message = f"{device} recovered at {stamp}, reading {anomaly.reading}"
+        if anomaly.kind != 'outlier':
+            print(message)
+        self.log_writer.write_text(f"=== {message} ===\n")
+
+        self.graph_data.anomalies.append(anomaly)
+        if anomaly.kind in ('stuck', 'recovered'):
+            self.graph_data.stuck = tuple(self.detector.stuck_ids())
+        if self.alert_pin is not None:
+            self.leds.pulse(self.alert_pin, ALERT_SECONDS)
+
+    def expire_devices(self, now):
+        """Evict devices that have gone silent (state owner thread)"""
+        for departure in self.state.expire(now):
+            self.handle_departure(departure)
+
+    def handle_departure(self, departure):
+        silent = departure.timestamp - departure.last_seen
+        print(f"Device {departure.device_id} ({departure.addr}) departed, "
+              f"silent for {silent:.1f}s")
+        if departure.was_master:
+            self.log_writer.write_master_change(departure.last_seen, None, None)
+        if departure.led is not None:
+            self.leds.stop(departure.led)
+            print(f"Released LED {departure.led} from Device {departure.device_id}")
+        self.store.remove(departure.device_id)
+        self.rollups.release(departure.device_id, departure.timestamp)
+        self.detector.remove(departure.device_id)
+        self.graph_data.stuck = tuple(self.detector.stuck_ids())
+        self.graph_data.departures.append(departure)
+        self.display.remove_device(departure.device_id)
+        
+        stamp = datetime.fromtimestamp(departure.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        last_seen = datetime.fromtimestamp(departure.last_seen).strftime('%Y-%m-%d %H:%M:%S')
+        self.log_writer.write_text(f"=== Device {departure.device_id} ({departure.addr}) departed "
+                                   f"at {stamp}, last seen {last_seen} ===\n")
+
+    def handle_control(self, event):
+        if isinstance(event, Reset):
+            self.apply_reset(event.timestamp)
+        elif isinstance(event, Activate):
+            self.apply_activate(event.timestamp)
+
+    def send_command(self, command):
+        """Broadcast RESET/ACTIVATE to the ESPs; returns when it went out"""
+        if self.sock is None:
+            return None
+        try:
+            self.sock.sendto(command, self.command_addr)
+        except OSError as e:
+            print(f"Error sending {command.decode()}: {e}")
+            return None
+        return time.perf_counter()
+
     def send_reset(self):
+        """Broadcast RESET and queue the reset; the yellow LED stays on until
+        finish_reset(). Returns when the broadcast went out."""
         print("\nRESET initiated...")
         
-        # First, turn off ALL LEDs
-        for led in [RED_LED, GREEN_LED, YELLOW_LED, WHITE_LED]:
-            GPIO.output(led, GPIO.LOW)
-        
-        # Send reset command to all ESPs first
-        self.sock.sendto(b'RESET', (BROADCAST_IP, UDP_PORT))
+        # Broadcast first so the ESPs hear it as soon as possible
+        sent_at = self.send_command(b'RESET')
         print("Reset command sent to ESPs")
+        with self._indicator_lock:
+            self._reset_generation += 1
+        self.post(Reset(self.clock.time()))
+        return sent_at
+
+    def apply_reset(self, timestamp):
+        """Stop tracking and start a new log file (state owner thread)"""
+        final = self.state.reset(timestamp)
         
-        # Save current log file with summary
-        if hasattr(self, 'current_logfile'):
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            with open(self.current_logfile, 'a') as f:
-                f.write(f"\n=== Reset Summary at {timestamp} ===\n")
-                f.write("Masters this session:\n")
-                
-                current_time = time.time()
-                master_times = self.graph_data.master_times.copy()
-                if self.graph_data.current_master:
-                    duration = current_time - self.graph_data.master_start_times[self.graph_data.current_master]
-                    master_times[self.graph_data.current_master] += duration
-                
-                for ip, duration in master_times.items():
-                    f.write(f"IP: {ip}, Total Time: {duration:.2f} seconds\n")
-                f.write("====================================\n\n")
+        # Turn off ALL LEDs, then the indicator (yellow) on until the controller's timer ends the reset
+        self.leds.stop_all()
+        for led in self.output_pins:
+            self.gpio.output(led, LOW)
+        with self._indicator_lock:
+            self._applied_generation += 1
+            if self.indicator_pin is not None and self._applied_generation > self._finished_generation:
+                self.gpio.output(self.indicator_pin, HIGH)
         
-        # Turn on Yellow LED for exactly 3 seconds
-        GPIO.output(YELLOW_LED, GPIO.HIGH)
-        time.sleep(3)
-        GPIO.output(YELLOW_LED, GPIO.LOW)
+        self.log_writer.write_master_change(timestamp, None, None)
         
-        # Reset all device tracking
-        self.device_data.clear()
-        self.device_led_assignments.clear()
-        self.available_leds = [RED_LED, GREEN_LED, YELLOW_LED]
-        self.current_master = None
+        # Save current log file with summary (written by the log writer thread)
+        if hasattr(self, 'current_logfile'):
+            stamp = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+            summary = [f"\n=== Reset Summary at {stamp} ===\n",
+                       "Masters this session:\n"]
+            
+            for device_id, duration in master_durations(final, timestamp).items():
+                info = final.devices.get(device_id) or final.departed.get(device_id)
+                ip = info.addr if info is not None else 'unknown'
+                summary.append(f"IP: {ip}, Device: {device_id}, Total Time: {duration:.2f} seconds\n")
+            if final.folded[0]:
+                summary.append(f"Earlier departed masters: {final.folded[0]}, "
+                               f"Total Time: {final.folded[1]:.2f} seconds\n")
+            
+            # Cross-session history from the rollups
+            summary.append("Masters in the last hour:\n")
+            last_hour = self.rollups.master_time(timestamp - 3600, timestamp)
+            for device_id, duration in sorted(last_hour.items()):
+                summary.append(f"Device: {device_id}, Time: {duration:.2f} seconds\n")
+            summary.append("====================================\n\n")
+            self.log_writer.write_text(''.join(summary))
         
         # Create new log file
         self.current_logfile = self.create_new_logfile()
         print(f"Created new log file: {self.current_logfile}")
         
-        # Reset graph data using thread-safe method
-        self.graph_data.reset()
-        
-        # Set system to inactive
-        self.system_active = False
-        print("System is in reset state. Press button again to activate")
+        # Clear the plots' data
+        self.rollups.end_master(timestamp)
+        self.store.clear()
+        self.detector.clear()
+        self.graph_data.anomalies.clear()
+        self.graph_data.stuck = ()
+        self.display.reset()
+        if self.dashboard is not None:
+            self.dashboard.hub.reset()
+
+    def finish_reset(self):
+        """End of the reset indicator period, including resets not applied yet"""
+        with self._indicator_lock:
+            self._finished_generation = self._reset_generation
+            if self.indicator_pin is not None:
+                self.gpio.output(self.indicator_pin, LOW)
 
     def send_activate(self):
+        """Broadcast ACTIVATE and queue the activation; returns when the
+        broadcast went out"""
         print("Sending ACTIVATE command to all ESPs")
-        
-        # Clear any stale data to start fresh
-        self.device_data.clear()
-        self.device_led_assignments.clear()
-        self.available_leds = [RED_LED, GREEN_LED, YELLOW_LED]
-        self.current_master = None
-        
-        # Reset graph data using thread-safe method
-        self.graph_data.reset()
-        
-        # Activate system
-        self.system_active = True
-        self.sock.sendto(b'ACTIVATE', (BROADCAST_IP, UDP_PORT))
+        sent_at = self.send_command(b'ACTIVATE')
+        self.post(Activate(self.clock.time()))
+        return sent_at
+
+    def apply_activate(self, timestamp):
+        """Start fresh from zero (state owner thread)"""
+        self.state.activate(timestamp)
+        self.log_writer.write_master_change(timestamp, None, None)
+        self.leds.stop_all()
+        self.rollups.end_master(timestamp)
+        self.store.clear()
+        self.detector.clear()
+        self.graph_data.anomalies.clear()
+        self.graph_data.stuck = ()
+        self.display.reset()
+        if self.dashboard is not None:
+            self.dashboard.hub.reset()
         print("System reactivated - Starting fresh from zero")
 
     def update_leds(self):
-        while self.running:
-            try:
-                if not self.system_active:
-                    # When inactive, ensure ALL LEDs are off
-                    for led in [RED_LED, GREEN_LED, YELLOW_LED, WHITE_LED]:
-                        GPIO.output(led, GPIO.LOW)
-                    time.sleep(0.1)
-                    continue
-                
-                # System is active - normal LED operation
-                if self.current_master and self.current_master in self.device_led_assignments:
-                    led_pin = self.device_led_assignments[self.current_master]
-                    if self.current_master in self.device_data:
-                        reading = self.device_data[self.current_master]['reading']
-                        flash_delay = self.calculate_flash_delay(reading)
-                        GPIO.output(led_pin, GPIO.HIGH)
-                        time.sleep(flash_delay)
-                        GPIO.output(led_pin, GPIO.LOW)
-                        time.sleep(flash_delay)
-                
-                time.sleep(0.1)
-                
-            except Exception as e:
-                print(f"Error in update_leds: {e}")
-
+        """Blink the current master's LED at a rate set by its reading"""
+        try:
+            snap = self.state.snapshot
+            info = snap.devices.get(snap.master)
+            if info is None or info.led is None:
+                self.leds.show_only(None, None)
+                return
+            self.leds.show_only(info.led, self.calculate_flash_delay(snap.master_reading))
+        except Exception as e:
+            print(f"Error in update_leds: {e}")
 
     def calculate_flash_delay(self, reading):
         return max(0.1, 1.0 - (reading / 1023.0 * 0.9))
@@ -436,53 +626,34 @@ class LightSwarm:
 
     def create_new_logfile(self):
         # Create filename with current date and time
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'lightswarm_{timestamp}.log'
+        timestamp = self.clock.now().strftime('%Y%m%d_%H%M%S')
+        base = os.path.join(self.log_dir, f'{self.log_prefix}_{timestamp}')
+        filename = f'{base}.log'
+        # Never overwrite an earlier session: a replay of the same recording
+        # into this directory, or two resets within one second
+        suffix = 1
+        while (os.path.exists(filename) or os.path.exists(binary_filename(filename))
+               or filename == getattr(self, 'current_logfile', None)):
+            filename = f'{base}_{suffix}.log'
+            suffix += 1
         
-        # Initialize the new log file with header
-        with open(filename, 'w') as f:
-            f.write(f"=== New Session Started at {timestamp} ===\n")
-            f.write("Format: timestamp, device_id, ip_address, reading, master_duration\n")
-            f.write("===========================================\n\n")
+        # The writer thread switches to the new file after flushing the old one
+        header = (f"=== New Session Started at {timestamp} ===\n"
+                  "Format: timestamp, device_id, ip_address, reading, master_duration\n"
+                  "===========================================\n\n")
+        self.log_writer.rotate(filename, header)
         
         print(f"Created new log file: {filename}")
         return filename
 
-    def handle_button(self):
-        last_press_time = 0
-        debounce_time = 0.5  # 500ms debounce time
-        
-        while self.running:
-            current_state = GPIO.input(RESET_BUTTON)
-            current_time = time.time()
-            
-            if current_state == GPIO.HIGH and (current_time - last_press_time) > debounce_time:
-                last_press_time = current_time
-                
-                if self.system_active:
-                    print("\nReset button pressed - Resetting system")
-                    self.send_reset()  # This handles all reset functionality
-                else:
-                    print("\nReset button pressed - Activating system")
-                    self.send_activate()
-            
-            time.sleep(0.1)  # Small delay to prevent CPU overuse
-
-    def log_data(self, device_id, reading):
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    def log_data(self, record):
             try:
-                ip_addr = self.device_data[device_id]['addr']
-                master_duration = 0
-                
-                # Calculate master duration
-                if ip_addr in self.graph_data.master_times:
-                    master_duration = self.graph_data.master_times[ip_addr]
-                    if ip_addr == self.graph_data.current_master:
-                        master_duration += time.time() - self.graph_data.master_start_times[ip_addr]
+                # Master time up to this reading, from the state just updated
+                duration = master_duration(self.state.snapshot, record.device_id, record.timestamp)
                 
-                # Write to log file
-                with open(self.current_logfile, 'a') as f:
-                    f.write(f"{timestamp}, {device_id}, {ip_addr}, {reading}, {master_duration:.2f}\n")
+                # Queue for the background writer
+                self.log_writer.write_record(record.timestamp, record.device_id, record.addr,
+                                             record.reading, duration)
                 
             except Exception as e:
                 print(f"Error logging data: {e}")
@@ -492,17 +663,90 @@ class LightSwarm:
     def cleanup(self):
         print("\nCleaning up...")
         self.running = False
-        for led in [RED_LED, GREEN_LED, YELLOW_LED, WHITE_LED]:
-            GPIO.output(led, GPIO.LOW)
-        GPIO.cleanup()
-        self.sock.close()
-        plt.close('all')
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.dashboard is not None:
+            self.dashboard.stop()
+        presses = {'presses': 0}
+        if self.controller is not None:
+            self.controller.stop()
+            presses = self.controller.latency_stats()
+        if presses['presses']:
+            print(f"Button: {presses['presses']} presses, press->broadcast mean "
+                  f"{presses['mean'] * 1000:.2f} ms, max {presses['max'] * 1000:.2f} ms")
+        self.leds.stop_all()
+        jitter = self.leds.jitter_stats()
+        if jitter['toggles']:
+            print(f"LEDs: {jitter['toggles']} toggles, jitter mean {jitter['mean'] * 1000:.2f} ms, "
+                  f"p99 {jitter['p99'] * 1000:.2f} ms, max {jitter['max'] * 1000:.2f} ms")
+        if self.ingest is not None:
+            self.ingest.stop()
+            print(f"Ingest: {self.ingest.stats}")
+        self.log_writer.close()
+        frames = self.display.frame_stats()
+        print(f"Render: {frames['frames']} frames, mean {frames['mean'] * 1000:.1f} ms, "
+              f"max {frames['max'] * 1000:.1f} ms")
+        for led in self.output_pins:
+            self.gpio.output(led, LOW)
+        self.gpio.cleanup()
+        if self.sock is not None:
+            self.sock.close()
+        self.display.close()
         print("Cleanup complete")
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='LightSwarm monitor')
+    parser.add_argument('--headless', action='store_true',
+                        help='run ingest, master tracking and logging without a window')
+    parser.add_argument('--render-process', action='store_true',
+                        help='draw the plots in a separate process fed through shared memory')
+    parser.add_argument('--gpio', choices=['auto', 'rpi', 'sim'], default='auto',
+                        help='GPIO backend (auto uses RPi.GPIO when available)')
+    parser.add_argument('--refresh', type=float, default=GUI_REFRESH_INTERVAL,
+                        help='seconds between plot refreshes')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL,
+                        help='seconds without a packet before a device is dropped (0 = never)')
+    parser.add_argument('--history', type=float, default=DEFAULT_WINDOW, metavar='SECONDS',
+                        help='seconds of readings kept per device and shown in the plots')
+    parser.add_argument('--log-format', choices=['text', 'binary', 'both'], default='text',
+                        help='session log format (binary also records LIGHT readings)')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics on 127.0.0.1:PORT')
+    parser.add_argument('--profile', action='store_true',
+                        help='start the sampling profiler at launch (needs --metrics-port)')
+    parser.add_argument('--db', metavar='PATH',
+                        help='also record readings and master changes in this SQLite database')
+    parser.add_argument('--dashboard', type=int, metavar='PORT',
+                        help='serve a browser dashboard on PORT')
+    parser.add_argument('--dashboard-host', default='127.0.0.1',
+                        help='address the dashboard listens on; it has no authentication, '
+                             'so use 0.0.0.0 only on a trusted network')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    swarm = None
     try:
-        swarm = LightSwarm()
-        print("\nLightSwarm started with graphing. Press Ctrl+C to exit.")
+        clock = SystemClock()
+        if args.headless:
+            display = 'none'
+        else:
+            display = 'process' if args.render_process else 'tk'
+        swarm = LightSwarm(gpio=create_gpio(args.gpio),
+                           display=create_display(display, clock),
+                           clock=clock,
+                           refresh_interval=args.refresh,
+                           device_ttl=args.ttl,
+                           history_seconds=args.history,
+                           metrics_port=args.metrics_port,
+                           profile=args.profile,
+                           dashboard_port=args.dashboard,
+                           dashboard_host=args.dashboard_host,
+                           db_path=args.db,
+                           log_formats=('text', 'binary') if args.log_format == 'both'
+                           else (args.log_format,))
+        mode = "headless" if args.headless else "with graphing"
+        print(f"\nLightSwarm started {mode}. Press Ctrl+C to exit.")
         print("Reset button on GPIO 15")
         print("Press button once to reset, again to activate")
         print("Waiting for ESP devices...")
@@ -512,10 +756,12 @@ def main():
             
     except KeyboardInterrupt:
         print("\nShutdown requested...")
-        swarm.cleanup()
+        if swarm:
+            swarm.cleanup()
     except Exception as e:
         print(f"\nUnexpected error: {e}")
-        swarm.cleanup()
+        if swarm:
+            swarm.cleanup()
 
 if __name__ == "__main__":
         main()
@@ -0,0 +1,421 @@
+"""Pluggable GPIO, display and clock backends for the LightSwarm monitor.
+
+Nothing in this module imports RPi.GPIO, matplotlib or tkinter at import
+time; each backend pulls in its dependencies only when it is created, so a
+headless monitor never loads the GUI stack.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime
+
+from scheduler import Scheduler
+
+HIGH = 1
+LOW = 0
+
+
+# ---------------------------------------------------------------- GPIO
+
+class RPiGPIO:
+    """Real GPIO pins through RPi.GPIO (BCM numbering)"""
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+    def setup_output(self, pin):
+        self.GPIO.setup(pin, self.GPIO.OUT)
+        self.GPIO.output(pin, self.GPIO.LOW)
+
+    def setup_input(self, pin):
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_DOWN)
+
+    def output(self, pin, value):
+        self.GPIO.output(pin, self.GPIO.HIGH if value else self.GPIO.LOW)
+
+    def input(self, pin):
+        return HIGH if self.GPIO.input(pin) else LOW
+
+    def add_event_detect(self, pin, callback, bouncetime=200):
+        """Call callback(pin) from RPi.GPIO's event thread on each rising edge"""
+        self.GPIO.add_event_detect(pin, self.GPIO.RISING, callback=callback,
+                                   bouncetime=bouncetime)
+
+    def remove_event_detect(self, pin):
+        self.GPIO.remove_event_detect(pin)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+class SimulatedGPIO:
+    """In-memory pins for running without Raspberry Pi hardware"""
+
+    def __init__(self):
+        self.pins = {}
+        self.outputs = set()
+        self.callbacks = {}
+
+    def setup_output(self, pin):
+        self.outputs.add(pin)
+        self.pins[pin] = LOW
+
+    def setup_input(self, pin):
+        # Pull-down: reads LOW until pressed
+        self.pins[pin] = LOW
+
+    def output(self, pin, value):
+        self.pins[pin] = HIGH if value else LOW
+
+    def input(self, pin):
+        return self.pins.get(pin, LOW)
+
+    def add_event_detect(self, pin, callback, bouncetime=0):
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def press(self, pin):
+        """Simulate holding a button connected to an input pin.
+
+        A LOW -> HIGH transition calls the pin's event callback in the
+        calling thread, like RPi.GPIO's edge detection.
+        """
+        rising = self.pins.get(pin, LOW) == LOW
+        self.pins[pin] = HIGH
+        callback = self.callbacks.get(pin)
+        if rising and callback is not None:
+            callback(pin)
+
+    def release(self, pin):
+        self.pins[pin] = LOW
+
+    def cleanup(self):
+        self.callbacks.clear()
+        for pin in self.outputs:
+            self.pins[pin] = LOW
+
+
+def create_gpio(kind='auto'):
+    """Return a GPIO backend: 'rpi', 'sim', or 'auto' (rpi when available)"""
+    if kind == 'sim':
+        return SimulatedGPIO()
+    if kind == 'rpi':
+        return RPiGPIO()
+    try:
+        return RPiGPIO()
+    except (ImportError, RuntimeError) as e:
+        print(f"RPi.GPIO unavailable ({e}), using simulated GPIO")
+        return SimulatedGPIO()
+
+
+# ---------------------------------------------------------------- Display
+
+class TkDisplay:
+    """Matplotlib window on the TkAgg backend, drawn from the main thread"""
+
+    def __init__(self):
+        import matplotlib
+        matplotlib.use('TkAgg')  # Must be before importing plt
+        import matplotlib.pyplot as plt
+        import tkinter as tk
+        self.plt = plt
+
+        # Initialize tkinter root first
+        self.root = tk.Tk()
+        self.root.withdraw()  # Hide the main window
+
+        # Initialize matplotlib in main thread
+        plt.ion()  # Turn on interactive mode
+        self.renderer = None
+
+    def start(self, swarm):
+        from renderer import PlotRenderer
+        self.swarm = swarm
+        self.renderer = PlotRenderer(swarm.graph_data)
+        self.renderer.canvas.mpl_connect('key_press_event', self.on_key_press)
+        manager = self.plt.get_current_fig_manager()
+        manager.window.wm_geometry("+0+0")
+
+        self.plt.show(block=False)
+        self.plt.pause(0.1)
+
+    def add_sample(self, timestamp, reading, device_id, addr):
+        # The renderer reads samples straight from the DeviceStore
+        pass
+
+    def remove_device(self, device_id):
+        pass
+
+    def render(self):
+        self.renderer.render()
+
+    def reset(self):
+        self.renderer.reset()
+
+    def pump(self):
+        # Keep GUI responsive
+        self.root.update()
+        self.plt.pause(0.01)  # Add small pause for matplotlib
+
+    def frame_stats(self):
+        return self.renderer.frame_stats()
+
+    def on_key_press(self, event):
+        if event.key == 'q':
+            print("\nClosing application...")
+            self.swarm.cleanup()
+
+    def close(self):
+        self.plt.close('all')
+
+
+class AggDisplay:
+    """Off-screen rendering with the Agg backend (benchmarks, no X server)"""
+
+    def __init__(self, render_cost=0.0):
+        import matplotlib
+        matplotlib.use('Agg')
+        self.render_cost = render_cost
+        self.renderer = None
+
+    def start(self, swarm):
+        from renderer import PlotRenderer
+        self.renderer = PlotRenderer(swarm.graph_data, render_cost=self.render_cost)
+
+    def add_sample(self, timestamp, reading, device_id, addr):
+        pass
+
+    def remove_device(self, device_id):
+        pass
+
+    def render(self):
+        self.renderer.render()
+
+    def reset(self):
+        self.renderer.reset()
+
+    def pump(self):
+        time.sleep(0.01)
+
+    def frame_stats(self):
+        return self.renderer.frame_stats()
+
+    def close(self):
+        import matplotlib.pyplot as plt
+        plt.close('all')
+
+
+class NullDisplay:
+    """No window at all: ingest, master tracking and logging only"""
+
+    def __init__(self, clock=None, pump_interval=0.05):
+        self.clock = clock or SystemClock()
+        self.pump_interval = pump_interval
+
+    def start(self, swarm):
+        pass
+
+    def add_sample(self, timestamp, reading, device_id, addr):
+        pass
+
+    def remove_device(self, device_id):
+        pass
+
+    def render(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def pump(self):
+        self.clock.sleep(self.pump_interval)
+
+    def frame_stats(self):
+        return {'frames': 0, 'last': 0.0, 'mean': 0.0, 'max': 0.0}
+
+    def close(self):
+        pass
+
+
+class ProcessDisplay:
+    """Plots drawn by a separate renderer process fed through shared memory.
+
+    MASTER samples and per-tick master totals are published into a
+    SharedPlotState (renderproc.py); publishing never blocks, so matplotlib
+    never competes with the receive, button and LED threads for the GIL and
+    a slow or crashed renderer cannot stall capture.
+    """
+
+    def __init__(self, clock=None, backend='TkAgg', render_cost=0.0, pump_interval=0.05):
+        from renderproc import SharedPlotState
+        self.clock = clock or SystemClock()
+        self.backend = backend
+        self.render_cost = render_cost
+        self.pump_interval = pump_interval
+        self.shared = SharedPlotState()
+        self.process = None
+        self.swarm = None
+        self._exit_reported = False
+
+    def start(self, swarm):
+        import multiprocessing
+        from renderproc import render_main
+        self.swarm = swarm
+        # spawn: the renderer must not inherit our threads, sockets or GPIO
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=render_main, name='renderer', daemon=True,
+            args=(self.shared.name, self.shared.capacity, self.backend,
+                  swarm.graph_data.history_seconds, self.render_cost))
+        self.process.start()
+
+    def add_sample(self, timestamp, reading, device_id, addr):
+        self.shared.append(timestamp, reading, device_id, addr)
+
+    def remove_device(self, device_id):
+        self.shared.remove(device_id)
+
+    def render(self):
+        graph_data = self.swarm.graph_data
+        snap = graph_data.snapshot
+        self.shared.publish(self.clock.time(), snap.master_totals, snap.master,
+                            snap.master_since, graph_data.history_seconds, graph_data.label)
+
+    def reset(self):
+        self.shared.reset()
+
+    def pump(self):
+        if self.shared.quit_requested():
+            print("\nClosing application...")
+            self.swarm.cleanup()
+            return
+        if not self.process.is_alive() and not self._exit_reported:
+            self._exit_reported = True
+            print(f"Renderer exited (code {self.process.exitcode}); capture continues")
+        self.clock.sleep(self.pump_interval)
+
+    def frame_stats(self):
+        if self.shared.control is None:
+            return {'frames': 0, 'last': 0.0, 'mean': 0.0, 'max': 0.0}
+        return self.shared.frame_stats()
+
+    def close(self):
+        if self.shared.control is None:
+            return
+        self.shared.mark_closed()
+        if self.process is not None:
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(timeout=1)
+        self.shared.close()
+
+
+def create_display(kind='tk', clock=None, render_cost=0.0):
+    """Return a display backend: 'tk', 'agg' (off-screen), 'none', or
+    'process' / 'process-agg' (tk / off-screen in a separate renderer process)"""
+    if kind == 'none':
+        return NullDisplay(clock)
+    if kind == 'agg':
+        return AggDisplay(render_cost)
+    if kind == 'process':
+        return ProcessDisplay(clock, 'TkAgg', render_cost)
+    if kind == 'process-agg':
+        return ProcessDisplay(clock, 'Agg', render_cost)
+    return TkDisplay()
+
+
+# ---------------------------------------------------------------- Clock
+
+class SystemClock:
+    """Wall-clock time; call_later timers share one scheduler thread"""
+
+    def __init__(self):
+        self.scheduler = Scheduler()
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def call_later(self, delay, callback):
+        """Run callback on the scheduler thread after delay seconds; returns
+        a handle with cancel()"""
+        return self.scheduler.call_later(delay, callback)
+
+    def stop(self):
+        self.scheduler.stop()
+
+
+class _VirtualTimer:
+    def __init__(self, callback):
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock:
+    """Clock that only moves when advanced, e.g. by a replay of a recording.
+
+    sleep() blocks until virtual time has moved far enough, so timed threads
+    (LED blinking, button handling) follow the replayed timeline.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._timers = []
+        self._timer_seq = 0
+
+    def time(self):
+        return self._now
+
+    def now(self):
+        return datetime.fromtimestamp(self._now)
+
+    def advance_to(self, timestamp):
+        """Move time forward, firing due call_later timers in order"""
+        while True:
+            with self._cond:
+                if self._timers and self._timers[0][0] <= timestamp:
+                    due, _, timer = heapq.heappop(self._timers)
+                else:
+                    due, timer = timestamp, None
+                if due > self._now:
+                    self._now = due
+                    self._cond.notify_all()
+            if timer is None:
+                return
+            if not timer.cancelled:
+                timer.callback()
+
+    def call_later(self, delay, callback):
+        """Run callback when virtual time reaches now + delay"""
+        timer = _VirtualTimer(callback)
+        with self._cond:
+            self._timer_seq += 1
+            heapq.heappush(self._timers, (self._now + delay, self._timer_seq, timer))
+        return timer
+
+    def sleep(self, seconds):
+        target = self._now + seconds
+        with self._cond:
+            self._cond.wait_for(lambda: self._now >= target or self._stopped)
+
+    def stop(self):
+        """Release every thread blocked in sleep()"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
@@ -0,0 +1,323 @@
+"""Compact binary session logs with memory-mapped range queries.
+
+File layout (little endian):
+
+    header   32 bytes   magic 'LSWBLOG\\0', version u16, record size u16,
+                        index interval u32, created f8, 8 reserved bytes
+    records  20 bytes   timestamp f8, device_id u4, ipv4 u4, reading u2,
+                        master u1, pad u1
+
+Every `index_every` records the writer closes a block and appends (newest
+timestamp so far, oldest timestamp in the block, first record number) to a
+sidecar `<file>.idx`. Records are in arrival order, which is not quite time
+order in logs written before readings were sorted on ingest, so a reader
+uses the running maximum to skip blocks that end before a range and the
+oldest-from-here-on minimum to skip those after it, and masks the rest.
+Version 1 files (index by first timestamp) are still read, without index.
+
+    python3 binlog.py to-binary lightswarm_20240118_123456.log session.lsb
+    python3 binlog.py to-text session.lsb session.log
+    python3 binlog.py query session.lsb --start "2024-01-18 12:35:00" --end "2024-01-18 12:40:00"
+"""
+import argparse
+import os
+import socket
+import struct
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+MAGIC = b'LSWBLOG\0'
+VERSION = 2
+HEADER = struct.Struct('<8sHHId8x')
+RECORD_DTYPE = np.dtype([
+    ('ts', '<f8'),
+    ('device_id', '<u4'),
+    ('ip', '<u4'),
+    ('reading', '<u2'),
+    ('master', 'u1'),
+    ('pad', 'u1'),
+])
+INDEX_DTYPE = np.dtype([('high', '<f8'), ('low', '<f8'), ('record', '<u8')])
+DEFAULT_INDEX_EVERY = 4096
+BINARY_SUFFIX = '.lsb'
+
+# Same timing rule as the rollups when master time has to be recomputed
+MAX_MASTER_GAP = 3.0
+
+TEXT_HEADER = ("=== New Session Started at {stamp} ===\n"
+               "Format: timestamp, device_id, ip_address, reading, master_duration\n"
+               "===========================================\n\n")
+
+
+def ip_to_int(ip_addr):
+    try:
+        return struct.unpack('!I', socket.inet_aton(ip_addr))[0]
+    except (OSError, TypeError):
+        return 0
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack('!I', int(value)))
+
+
+class BinaryLogWriter:
+    """Appends fixed-width records to a binary session log"""
+
+    def __init__(self, filename, index_every=DEFAULT_INDEX_EVERY, created=None):
+        self.filename = filename
+        self.index_every = index_every
+        self.count = 0
+        # Newest timestamp written so far and oldest in the open index block
+        self._high = float('-inf')
+        self._low = float('inf')
+        self._ip_cache = {}
+        self._file = open(filename, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize, index_every,
+                                     created if created is not None else time.time()))
+        self._index = open(filename + '.idx', 'wb')
+
+    def _ip(self, ip_addr):
+        value = self._ip_cache.get(ip_addr)
+        if value is None:
+            value = self._ip_cache[ip_addr] = ip_to_int(ip_addr)
+        return value
+
+    def write_records(self, records):
+        """Write (timestamp, device_id, ip, reading, is_master) tuples"""
+        if not len(records):
+            return
+        ip = self._ip
+        block = np.array([(ts, device_id, ip(addr), reading, 1 if is_master else 0, 0)
+                          for ts, device_id, addr, reading, is_master in records],
+                         dtype=RECORD_DTYPE)
+        self.write_array(block)
+
+    def write_array(self, block):
+        """Write an array that already has RECORD_DTYPE"""
+        self._file.write(block.tobytes())
+        ts = block['ts']
+        every = self.index_every
+        offset = 0
+        entries = []
+        while offset < len(ts):
+            # Up to the end of the open index block
+            part = ts[offset:offset + every - self.count % every]
+            self._high = max(self._high, float(part.max()))
+            self._low = min(self._low, float(part.min()))
+            self.count += len(part)
+            offset += len(part)
+            if self.count % every == 0:
+                entries.append((self._high, self._low, self.count - every))
+                self._low = float('inf')
+        if entries:
+            self._index.write(np.array(entries, dtype=INDEX_DTYPE).tobytes())
+
+    def flush(self):
+        self._file.flush()
+        self._index.flush()
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+
+class BinaryLog:
+    """Memory-mapped reader for a binary session log"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, version, record_size, self.index_every, self.created = \
+                HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a LightSwarm binary log")
+        if version not in (1, VERSION) or record_size != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{filename}: unsupported version {version}/{record_size}")
+
+        # A record still being written at the tail is ignored
+        n_records = (os.path.getsize(filename) - HEADER.size) // record_size
+        if n_records:
+            self.records = np.memmap(filename, dtype=RECORD_DTYPE, mode='r',
+                                     offset=HEADER.size, shape=(n_records,))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+
+        index_path = filename + '.idx'
+        if version == VERSION and os.path.exists(index_path):
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+            index = index[index['record'] + self.index_every <= n_records]
+        else:
+            index = np.empty(0, dtype=INDEX_DTYPE)
+        self.index = index
+        # Oldest timestamp in each indexed block or any later record; the
+        # unindexed tail counts as one more block
+        indexed = len(index) * self.index_every
+        tail = self.records['ts'][indexed:]
+        lows = np.append(index['low'], tail.min() if len(tail) else np.inf)
+        self._low_after = np.minimum.accumulate(lows[::-1])[::-1]
+
+    def __len__(self):
+        return len(self.records)
+
+    def _span(self, start, end):
+        """Record numbers [lo, hi) that hold every record with start <= ts < end"""
+        lo, hi = 0, len(self.records)
+        every = self.index_every
+        if start is not None and len(self.index):
+            # Blocks before the first whose running maximum reaches start
+            # hold nothing that new
+            lo = int(np.searchsorted(self.index['high'], start, side='left')) * every
+        if end is not None:
+            # From the first block whose records, and all after, are >= end
+            block = int(np.searchsorted(self._low_after, end, side='left'))
+            if block <= len(self.index):
+                hi = block * every
+        return lo, max(lo, hi)
+
+    def query(self, start=None, end=None, device_id=None, master_only=False):
+        """Records with start <= ts < end as a dict of NumPy arrays"""
+        lo, hi = self._span(start, end)
+        block = self.records[lo:hi]
+        mask = None
+        if start is not None or end is not None:
+            ts = block['ts']
+            if start is not None:
+                mask = ts >= start
+            if end is not None:
+                mask = ts < end if mask is None else mask & (ts < end)
+        if device_id is not None:
+            device = block['device_id'] == device_id
+            mask = device if mask is None else mask & device
+        if master_only:
+            master = block['master'] != 0
+            mask = master if mask is None else mask & master
+        if mask is not None:
+            block = block[mask]
+        return {
+            'ts': np.array(block['ts']),
+            'device_id': np.array(block['device_id']),
+            'ip': np.array(block['ip']),
+            'reading': np.array(block['reading']),
+            'master': np.array(block['master']).astype(bool),
+        }
+
+    def close(self):
+        # The mapping is released once no array refers to it
+        self.records = np.empty(0, dtype=RECORD_DTYPE)
+
+
+def binary_filename(text_filename):
+    return os.path.splitext(text_filename)[0] + BINARY_SUFFIX
+
+
+def parse_text_line(line):
+    """(timestamp, device_id, ip, reading) from a reading line, or None"""
+    parts = line.strip().split(', ')
+    if len(parts) != 5:
+        return None
+    try:
+        ts = datetime.strptime(parts[0], '%Y-%m-%d %H:%M:%S').timestamp()
+        return ts, int(parts[1]), parts[2], int(parts[3])
+    except ValueError:
+        return None
+
+
+def text_to_binary(text_path, binary_path, index_every=DEFAULT_INDEX_EVERY):
+    """Convert a text session log; every text line is a MASTER reading"""
+    writer = None
+    batch = []
+    with open(text_path) as f:
+        for line in f:
+            parsed = parse_text_line(line)
+            if parsed is None:
+                continue
+            if writer is None:
+                writer = BinaryLogWriter(binary_path, index_every, created=parsed[0])
+            batch.append(parsed + (True,))
+            if len(batch) >= 10000:
+                writer.write_records(batch)
+                batch = []
+    if writer is None:
+        writer = BinaryLogWriter(binary_path, index_every)
+    writer.write_records(batch)
+    writer.close()
+    return writer.count
+
+
+def binary_to_text(binary_path, text_path):
+    """Write the MASTER records of a binary log in the text format.
+
+    master_duration is not stored in binary logs; it is recomputed per IP
+    from the gaps between consecutive MASTER records.
+    """
+    log = BinaryLog(binary_path)
+    data = log.query(master_only=True)
+    stamp = datetime.fromtimestamp(log.created).strftime('%Y%m%d_%H%M%S')
+    totals = {}
+    prev_ip = prev_ts = None
+    with open(text_path, 'w') as f:
+        f.write(TEXT_HEADER.format(stamp=stamp))
+        for ts, device_id, ip_value, reading in zip(data['ts'].tolist(), data['device_id'].tolist(),
+                                                    data['ip'].tolist(), data['reading'].tolist()):
+            ip_addr = int_to_ip(ip_value)
+            if prev_ip is not None:
+                totals[prev_ip] = totals.get(prev_ip, 0.0) + min(ts - prev_ts, MAX_MASTER_GAP)
+            totals.setdefault(ip_addr, 0.0)
+            prev_ip, prev_ts = ip_addr, ts
+            f.write(f"{datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')}, {device_id}, "
+                    f"{ip_addr}, {reading}, {totals[ip_addr]:.2f}\n")
+    count = len(data['ts'])
+    log.close()
+    return count
+
+
+def _parse_time(text):
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.strptime(text, '%Y-%m-%d %H:%M:%S').timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='LightSwarm binary session logs')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('to-binary', help='convert a text log')
+    p.add_argument('source')
+    p.add_argument('dest')
+    p = sub.add_parser('to-text', help='convert a binary log')
+    p.add_argument('source')
+    p.add_argument('dest')
+    p = sub.add_parser('query', help='summarize a time range')
+    p.add_argument('source')
+    p.add_argument('--start', help="epoch seconds or 'YYYY-mm-dd HH:MM:SS'")
+    p.add_argument('--end')
+    p.add_argument('--device', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'to-binary':
+        print(f"Wrote {text_to_binary(args.source, args.dest)} records to {args.dest}")
+    elif args.command == 'to-text':
+        print(f"Wrote {binary_to_text(args.source, args.dest)} records to {args.dest}")
+    else:
+        log = BinaryLog(args.source)
+        start = time.perf_counter()
+        data = log.query(_parse_time(args.start), _parse_time(args.end), args.device)
+        elapsed = time.perf_counter() - start
+        print(f"{len(data['ts'])} of {len(log)} records in {elapsed * 1000:.2f} ms")
+        for device_id in np.unique(data['device_id']):
+            mask = data['device_id'] == device_id
+            readings = data['reading'][mask]
+            print(f"Device {device_id}: {mask.sum()} readings "
+                  f"({int(data['master'][mask].sum())} as master), "
+                  f"min {readings.min()}, max {readings.max()}, mean {readings.mean():.1f}")
+        log.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
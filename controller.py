@@ -0,0 +1,127 @@
+"""Edge-triggered reset button and the reset/activate state machine"""
+import threading
+import time
+from collections import deque
+
+ACTIVE = 'active'
+RESETTING = 'resetting'   # RESET sent, yellow LED on
+INACTIVE = 'inactive'     # waiting for a press to activate
+
+DEFAULT_DEBOUNCE = 0.5
+RESET_INDICATOR_SECONDS = 3.0
+
+
+class ResetController:
+    """Turns reset button presses into RESET/ACTIVATE without sleeping.
+
+    A press while active broadcasts RESET straight away and starts a timer
+    that switches the yellow LED off after RESET_INDICATOR_SECONDS. A press
+    while resetting or inactive broadcasts ACTIVATE straight away; a press
+    during the yellow phase ends it early instead of being lost. The time
+    from the edge to the broadcast leaving the socket is recorded for every
+    press.
+    """
+
+    def __init__(self, swarm, gpio, pin, clock, debounce=DEFAULT_DEBOUNCE,
+                 indicator_seconds=RESET_INDICATOR_SECONDS):
+        self.swarm = swarm
+        self.gpio = gpio
+        self.pin = pin
+        self.clock = clock
+        self.debounce = debounce
+        self.indicator_seconds = indicator_seconds
+        self.state = ACTIVE
+        self.presses = 0
+        self.bounces = 0
+        self.latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._timer = None
+        self._last_edge = None
+
+    def start(self):
+        self.gpio.add_event_detect(self.pin, self.on_edge,
+                                   bouncetime=int(self.debounce * 1000))
+
+    def stop(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        try:
+            self.gpio.remove_event_detect(self.pin)
+        except Exception as e:
+            print(f"Error removing button callback: {e}")
+
+    def on_edge(self, pin=None):
+        """GPIO callback for a rising edge on the button pin"""
+        pressed_at = time.perf_counter()
+        # Debounce on the monitor's clock, which is virtual during replay
+        edge = self.clock.time()
+        with self._lock:
+            # RPi.GPIO debounces too; this also covers the simulated pins
+            if self._last_edge is not None and edge - self._last_edge < self.debounce:
+                self.bounces += 1
+                return
+            self._last_edge = edge
+            self.presses += 1
+            if self.state == ACTIVE:
+                # Only decides what the next press does: apply_reset lights the
+                # yellow indicator and finish_reset switches it off
+                self.state = RESETTING
+                resetting = True
+            else:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                resetting = False
+                was_resetting = self.state == RESETTING
+                self.state = ACTIVE
+        # The broadcast and the hand-off to the state owner happen outside the
+        # lock: posting can wait on a full receive queue, and the indicator
+        # timer must not wait behind it
+        try:
+            if resetting:
+                print("\nReset button pressed - Resetting system")
+                self._reset(pressed_at)
+            else:
+                print("\nReset button pressed - Activating system")
+                self._activate(pressed_at, was_resetting)
+        except Exception as e:
+            print(f"Error handling button press: {e}")
+
+    def _record(self, pressed_at, sent_at):
+        if sent_at is not None:
+            self.latencies.append(sent_at - pressed_at)
+
+    def _reset(self, pressed_at):
+        self._record(pressed_at, self.swarm.send_reset())
+        with self._lock:
+            # Unless a press already activated the swarm again
+            if self.state == RESETTING and self._timer is None:
+                self._timer = self.clock.call_later(self.indicator_seconds, self._reset_done)
+
+    def _reset_done(self):
+        with self._lock:
+            if self.state != RESETTING:
+                return
+            self._timer = None
+            self.state = INACTIVE
+        self.swarm.finish_reset()
+        print("System is in reset state. Press button again to activate")
+
+    def _activate(self, pressed_at, was_resetting):
+        self._record(pressed_at, self.swarm.send_activate())
+        if was_resetting:
+            self.swarm.finish_reset()
+
+    def latency_stats(self):
+        """Press-to-broadcast latency over the recent presses, in seconds"""
+        if not self.latencies:
+            return {'presses': self.presses, 'last': 0.0, 'mean': 0.0, 'max': 0.0}
+        latencies = list(self.latencies)
+        return {
+            'presses': self.presses,
+            'last': latencies[-1],
+            'mean': sum(latencies) / len(latencies),
+            'max': max(latencies),
+        }
@@ -0,0 +1,375 @@
+"""Browser dashboard: live swarm data streamed to any number of viewers over SSE.
+
+The Pi only serializes numbers; each browser draws the reading trace and
+the master-time bars itself, so the monitor can run --headless while
+several operators watch:
+
+    python3 RaspberryPi.py --headless --dashboard 8080 --dashboard-host 0.0.0.0
+    open http://<pi>:8080/
+
+There is no authentication, so the server listens on 127.0.0.1 unless
+given another host.
+
+Ingest never waits for a viewer. The receive thread appends MASTER samples
+to a fixed ring with a sequence number and nothing else - no lock, no
+per-client work. Each viewer has its own thread that wakes every
+frame_interval, takes the samples past its own cursor plus the latest
+master totals, and sends them as one event, so however fast packets arrive
+a viewer gets at most one message per frame (per-client coalescing). A
+viewer too slow to keep up is lapped by the ring and skips the samples it
+missed instead of queueing them; one that stops reading is dropped when
+its send times out.
+
+With a history source (the monitor passes RollupEngine.series), the page
+also charts one device's last hour from the rollups, fetched from
+/history?device=<id>&seconds=<n> every few seconds rather than streamed.
+"""
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from metrics import Counter
+
+DEFAULT_RING_CAPACITY = 8192
+DEFAULT_FRAME_INTERVAL = 0.1
+DEFAULT_SEND_TIMEOUT = 10.0
+KEEPALIVE_SECONDS = 15.0
+DEFAULT_HISTORY_QUERY = 3600.0
+MAX_HISTORY_QUERY = 30 * 86400.0
+
+
+class DashboardHub:
+    """Samples and master totals shared by every viewer.
+
+    add_sample and reset are called from the receive thread, publish from
+    the main loop; viewers only read.
+    """
+
+    def __init__(self, history_seconds=30, capacity=DEFAULT_RING_CAPACITY):
+        self.history_seconds = history_seconds
+        self.capacity = capacity
+        self.ring = [None] * capacity
+        self.seq = 0
+        self.start_seq = 0
+        self.generation = 0
+        # JSON of the latest master totals, replaced whole by publish()
+        self.state = None
+        self.state_version = 0
+        self.clients = 0
+        self._clients_lock = threading.Lock()
+        self.skipped = Counter('lightswarm_dashboard_skipped_total',
+                               'Samples slow viewers skipped to catch up')
+        self.sent = Counter('lightswarm_dashboard_events_total', 'Events sent to viewers')
+
+    # ------------------------------------------------------------ writers
+
+    def add_sample(self, timestamp, reading, device_id, addr):
+        seq = self.seq
+        self.ring[seq % self.capacity] = (seq, timestamp, reading, device_id)
+        self.seq = seq + 1
+
+    def reset(self):
+        # Viewers start over from the samples after this point
+        self.start_seq = self.seq
+        self.generation += 1
+        self.state = None
+        self.state_version += 1
+
+    def publish(self, graph_data, now):
+        """Latest master totals, colors and labels from GraphData's pinned snapshot,
+        plus the detector events within the history window"""
+        snap = graph_data.snapshot
+        durations = graph_data.get_master_durations(now)
+        start = now - self.history_seconds
+        self.state = json.dumps({
+            'now': now,
+            'history': self.history_seconds,
+            'master': snap.master,
+            'totals': [[device_id, graph_data.label(device_id), round(seconds, 2),
+                        graph_data.master_colors.get(device_id, 'gray')]
+                       for device_id, seconds in durations.items()],
+            'anomalies': [[a.timestamp, a.reading, a.kind, graph_data.label(a.device_id)]
+                          for a in list(graph_data.anomalies) if a.timestamp >= start],
+            'stuck': [graph_data.label(device_id) for device_id in graph_data.stuck],
+        })
+        self.state_version += 1
+
+    # ------------------------------------------------------------ readers
+
+    def connected(self, delta):
+        with self._clients_lock:
+            self.clients += delta
+
+    def samples_since(self, cursor):
+        """(samples, new cursor, skipped) for samples past cursor, oldest first"""
+        end = self.seq
+        start = max(cursor, end - self.capacity + 1)
+        samples = []
+        for seq in range(start, end):
+            item = self.ring[seq % self.capacity]
+            # The writer may have lapped this slot since end was read
+            if item is not None and item[0] == seq:
+                samples.append(item[1:])
+        return samples, end, start - cursor
+
+    def recent(self, now):
+        """Cursor and the samples within the history window, for a new viewer"""
+        samples, cursor, _ = self.samples_since(self.start_seq)
+        cutoff = now - self.history_seconds
+        return [s for s in samples if s[0] >= cutoff], cursor
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'LightSwarmDashboard'
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path == '/':
+            self._reply(200, PAGE.encode('utf-8'), 'text/html; charset=utf-8')
+        elif path == '/events':
+            self._stream()
+        elif path == '/history' and self.server.history is not None:
+            self._history(parse_qs(query))
+        else:
+            self._reply(404, b'not found\n', 'text/plain')
+
+    def _history(self, query):
+        try:
+            device_id = int(query['device'][0])
+            seconds = float(query.get('seconds', [DEFAULT_HISTORY_QUERY])[0])
+        except (KeyError, ValueError):
+            self._reply(400, b'usage: /history?device=<id>&seconds=<n>\n', 'text/plain')
+            return
+        seconds = min(max(seconds, 1.0), MAX_HISTORY_QUERY)
+        now = self.server.clock()
+        series = self.server.history(device_id, now - seconds, now)
+        body = {'device': device_id, 'now': now, 'seconds': seconds,
+                'resolution': series['resolution']}
+        for key in ('start', 'min', 'max', 'mean', 'count', 'master_seconds'):
+            # Buckets with master time but no readings have no mean
+            body[key] = [None if isinstance(v, float) and math.isnan(v) else v
+                         for v in series[key].tolist()]
+        self._reply(200, json.dumps(body).encode('utf-8'), 'application/json')
+
+    def _reply(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send(self, event, data):
+        self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode('utf-8'))
+        self.wfile.flush()
+        self.server.hub.sent.inc()
+
+    def _stream(self):
+        server = self.server
+        hub = server.hub
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        # A viewer that stops reading fills its socket buffer; give up on it
+        self.connection.settimeout(server.send_timeout)
+        hub.connected(1)
+        try:
+            generation = None
+            version = None
+            cursor = 0
+            last_sent = 0.0
+            while server.running:
+                if generation != hub.generation:
+                    # First frame, or the session was reset: start over
+                    generation = hub.generation
+                    samples, cursor = hub.recent(server.clock())
+                    self._send('reset', json.dumps({'samples': samples}))
+                    version = None
+                    last_sent = time.monotonic()
+                samples, cursor, skipped = hub.samples_since(cursor)
+                if skipped:
+                    hub.skipped.inc(skipped)
+                state = hub.state
+                changed = hub.state_version != version
+                if samples or (changed and state is not None):
+                    version = hub.state_version
+                    self._send('update', '{"samples": %s, "state": %s}'
+                               % (json.dumps(samples), state if changed and state else 'null'))
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent > KEEPALIVE_SECONDS:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    last_sent = time.monotonic()
+                time.sleep(server.frame_interval)
+        except (OSError, ValueError):
+            # Viewer went away or timed out
+            pass
+        finally:
+            hub.connected(-1)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DashboardServer:
+    """HTTP server for the dashboard page, its /events stream and /history.
+
+    history(device_id, start, end), if given, returns the rollup series of
+    one device in the format of RollupEngine.series.
+    """
+
+    def __init__(self, port, host='127.0.0.1', clock=None, history_seconds=30,
+                 frame_interval=DEFAULT_FRAME_INTERVAL, send_timeout=DEFAULT_SEND_TIMEOUT,
+                 history=None):
+        self.hub = DashboardHub(history_seconds)
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.hub = self.hub
+        self.httpd.clock = clock or time.time
+        self.httpd.frame_interval = frame_interval
+        self.httpd.send_timeout = send_timeout
+        self.httpd.history = history
+        self.httpd.running = True
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='dashboard',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.running = False
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join(timeout=1)
+            self._thread = None
+        self.httpd.server_close()
+
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>LightSwarm</title>
+<style>
+body { font-family: sans-serif; margin: 12px; }
+canvas { display: block; border: 1px solid #ccc; margin-bottom: 12px; }
+#status { color: #666; }
+#stuck { color: #c00; font-size: 14px; }
+</style></head>
+<body>
+<h3>LightSwarm <span id="status">connecting...</span> <span id="stuck"></span></h3>
+<canvas id="trace" width="900" height="300"></canvas>
+<canvas id="bars" width="900" height="300"></canvas>
+<canvas id="longrange" width="900" height="200"></canvas>
+<script>
+let samples = [], state = null, offset = 0, history = null, picked = null;
+const trace = document.getElementById('trace'), bars = document.getElementById('bars');
+const longrange = document.getElementById('longrange');
+const status = document.getElementById('status'), stuck = document.getElementById('stuck');
+
+function colorOf(id) {
+  if (state) for (const t of state.totals) if (t[0] === id) return t[3];
+  return 'gray';
+}
+
+function axes(ctx, w, h, title) {
+  ctx.clearRect(0, 0, w, h);
+  ctx.strokeStyle = '#000'; ctx.strokeRect(50, 20, w - 60, h - 50);
+  ctx.fillStyle = '#000'; ctx.font = '14px sans-serif'; ctx.fillText(title, 50, 14);
+}
+
+function drawTrace() {
+  const ctx = trace.getContext('2d'), w = trace.width, h = trace.height;
+  axes(ctx, w, h, 'Light readings (master)');
+  const history = state ? state.history : 30;
+  const now = Date.now() / 1000 - offset, x0 = 50, pw = w - 60, y0 = h - 30, ph = h - 50;
+  samples = samples.filter(s => s[0] >= now - history);
+  ctx.font = '11px sans-serif';
+  for (let v = 0; v <= 1024; v += 256) {
+    const y = y0 - v / 1024 * ph; ctx.fillText(v, 10, y + 4);
+  }
+  for (const [ts, reading, id] of samples) {
+    ctx.fillStyle = colorOf(id);
+    ctx.fillRect(x0 + (ts - now + history) / history * pw - 1.5, y0 - reading / 1024 * ph - 1.5, 3, 3);
+  }
+  // Outliers and light changes, on any device
+  ctx.strokeStyle = '#000'; ctx.fillStyle = '#000';
+  for (const [ts, reading, kind, label] of state ? state.anomalies : []) {
+    if (kind !== 'outlier' && kind !== 'change' || ts < now - history) continue;
+    const x = x0 + (ts - now + history) / history * pw, y = y0 - reading / 1024 * ph;
+    ctx.beginPath(); ctx.moveTo(x - 4, y - 4); ctx.lineTo(x + 4, y + 4);
+    ctx.moveTo(x + 4, y - 4); ctx.lineTo(x - 4, y + 4); ctx.stroke();
+    ctx.fillText(label, x + 5, y - 5);
+  }
+}
+
+function drawBars() {
+  const ctx = bars.getContext('2d'), w = bars.width, h = bars.height;
+  axes(ctx, w, h, 'Master time (s)');
+  if (!state || !state.totals.length) return;
+  const totals = state.totals, max = Math.max(1, ...totals.map(t => t[2]));
+  const x0 = 50, pw = w - 60, y0 = h - 30, ph = h - 50, bw = pw / totals.length;
+  ctx.font = '11px sans-serif';
+  totals.forEach(([id, label, seconds, color], i) => {
+    const bh = seconds / max * ph, x = x0 + i * bw + bw * 0.1;
+    ctx.fillStyle = color; ctx.fillRect(x, y0 - bh, bw * 0.8, bh);
+    ctx.fillStyle = id === state.master ? '#c00' : '#000';
+    ctx.fillText(label, x, y0 + 14); ctx.fillText(seconds.toFixed(1), x, y0 - bh - 4);
+  });
+}
+
+// Last hour of one device from the rollups: min..max per bucket and the mean
+function drawHistory() {
+  const ctx = longrange.getContext('2d'), w = longrange.width, h = longrange.height;
+  const id = picked !== null ? picked : state && state.master;
+  let title = 'Last hour (click a bar to pick a device)';
+  if (state) for (const t of state.totals) if (t[0] === id) title = 'Last hour: ' + t[1];
+  axes(ctx, w, h, title);
+  if (!history || history.device !== id) return;
+  const x0 = 50, pw = w - 60, y0 = h - 30, ph = h - 50, span = history.seconds;
+  const left = history.now - span, bw = Math.max(1, history.resolution / span * pw);
+  ctx.fillStyle = colorOf(id);
+  history.start.forEach((start, i) => {
+    if (!history.count[i]) return;
+    const x = x0 + (start - left) / span * pw;
+    const top = y0 - history.max[i] / 1024 * ph, bottom = y0 - history.min[i] / 1024 * ph;
+    ctx.globalAlpha = 0.3; ctx.fillRect(x, top, bw, Math.max(1, bottom - top));
+    ctx.globalAlpha = 1; ctx.fillRect(x, y0 - history.mean[i] / 1024 * ph - 1, bw, 2);
+  });
+}
+
+function fetchHistory() {
+  const id = picked !== null ? picked : state && state.master;
+  if (id === null || id === undefined) return;
+  fetch('history?device=' + id + '&seconds=3600').then(r => r.ok ? r.json() : null)
+    .then(h => { if (h) history = h; }).catch(() => {});
+}
+
+bars.addEventListener('click', e => {
+  if (!state || !state.totals.length) return;
+  const i = Math.floor((e.offsetX - 50) / ((bars.width - 60) / state.totals.length));
+  if (i >= 0 && i < state.totals.length) { picked = state.totals[i][0]; fetchHistory(); }
+});
+setInterval(fetchHistory, 5000);
+
+const events = new EventSource('events');
+events.addEventListener('reset', e => {
+  samples = JSON.parse(e.data).samples; state = null; status.textContent = 'live';
+  stuck.textContent = '';
+});
+events.addEventListener('update', e => {
+  const msg = JSON.parse(e.data);
+  for (const s of msg.samples) samples.push(s);
+  if (msg.state) {
+    state = msg.state; offset = Date.now() / 1000 - state.now;
+    stuck.textContent = state.stuck.length ? 'stuck: ' + state.stuck.join(', ') : '';
+  }
+});
+events.onerror = () => { status.textContent = 'reconnecting...'; };
+(function frame() { drawTrace(); drawBars(); drawHistory(); requestAnimationFrame(frame); })();
+</script>
+</body></html>
+"""
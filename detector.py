@@ -0,0 +1,289 @@
+"""Streaming per-device anomaly and light-change detection.
+
+Every reading updates a few numbers per device and nothing else, so the
+cost per reading is constant however long a device has been sending:
+
+    mean, var   exponentially weighted mean and variance of the readings
+                (EWMA/EWMVar); z = (reading - mean) / max(std, min_std)
+    pos, neg    two-sided CUSUM of z, clipped to +-outlier_z so one spike
+                cannot trip it; crossing cusum_h is a change point.
+                Outliers are left out of mean and var, so a step in the
+                light level cannot widen the band that should catch it
+    last, run   how many times in a row the same reading arrived; a run of
+                stuck_count at a rail value (0 or 1023) is a dead sensor
+
+Events are Anomaly records:
+
+    outlier     one reading more than outlier_z deviations from the mean
+    change      the light level shifted; the mean restarts at the new level
+    stuck       the sensor has been pinned at a rail for stuck_count readings
+    recovered   a stuck sensor sent a different reading again
+
+State lives in one row per device of preallocated NumPy arrays, like
+DeviceStore. observe() runs short runs of readings one by one and longer
+ones through observe_arrays(), which updates every device in the batch
+with a handful of vector operations; a device that appears several times
+in one batch is stepped once per round, in arrival order.
+"""
+import math
+from collections import namedtuple
+
+import numpy as np
+
+DEFAULT_ALPHA = 0.1          # EWMA weight of the newest reading (~10-reading memory)
+DEFAULT_MIN_STD = 3.0        # floor for the deviation, in reading units
+DEFAULT_OUTLIER_Z = 8.0
+DEFAULT_CUSUM_K = 1.5        # slack per reading, in deviations
+DEFAULT_CUSUM_H = 10.0       # alarm threshold, in deviations
+DEFAULT_WARMUP = 20          # readings before a device can raise outliers or changes
+DEFAULT_STUCK_COUNT = 50
+DEFAULT_RAILS = (0, 1023)
+# Runs shorter than this are cheaper one reading at a time than vectorized
+VECTOR_THRESHOLD = 32
+INITIAL_DEVICES = 8
+
+Anomaly = namedtuple('Anomaly', ['timestamp', 'device_id', 'kind', 'reading', 'mean', 'score'])
+
+KINDS = ('outlier', 'change', 'stuck', 'recovered')
+
+# Per-device state: name, dtype, value of an unused row
+_FIELDS = (
+    ('n', np.int64, 0),
+    ('mean', np.float64, 0.0),
+    ('var', np.float64, 0.0),
+    ('pos', np.float64, 0.0),
+    ('neg', np.float64, 0.0),
+    ('last', np.float64, -1.0),
+    ('run', np.int64, 0),
+    ('stuck', bool, False),
+    ('device_ids', np.int64, -1),
+)
+
+
+def _occurrence_rank(rows):
+    """For each entry, how many earlier entries have the same row"""
+    order = np.argsort(rows, kind='stable')
+    ordered = rows[order]
+    index = np.arange(len(rows))
+    starts = np.empty(len(rows), dtype=bool)
+    starts[0] = True
+    np.not_equal(ordered[1:], ordered[:-1], out=starts[1:])
+    first = np.maximum.accumulate(np.where(starts, index, 0))
+    rank = np.empty(len(rows), dtype=np.int64)
+    rank[order] = index - first
+    return rank
+
+
+class AnomalyDetector:
+    """O(1) state per device; observe() returns the anomalies the readings raised.
+
+    Only one thread may call observe/remove/clear (the monitor's receive
+    thread, which owns the swarm state); stuck_ids() may be read from others.
+    """
+
+    def __init__(self, alpha=DEFAULT_ALPHA, min_std=DEFAULT_MIN_STD,
+                 outlier_z=DEFAULT_OUTLIER_Z, cusum_k=DEFAULT_CUSUM_K, cusum_h=DEFAULT_CUSUM_H,
+                 warmup=DEFAULT_WARMUP, stuck_count=DEFAULT_STUCK_COUNT, rails=DEFAULT_RAILS,
+                 vector_threshold=VECTOR_THRESHOLD, initial_devices=INITIAL_DEVICES):
+        self.alpha = alpha
+        self.min_std = min_std
+        self.outlier_z = outlier_z
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.warmup = warmup
+        self.stuck_count = stuck_count
+        self.rails = tuple(float(r) for r in rails)
+        self.vector_threshold = vector_threshold
+        self.rows = {}           # device_id -> row index
+        self.counts = dict.fromkeys(KINDS, 0)
+        self._allocate(initial_devices)
+
+    def _allocate(self, n_rows):
+        for name, dtype, empty in _FIELDS:
+            setattr(self, name, np.full(n_rows, empty, dtype=dtype))
+        self._free_rows = list(range(n_rows - 1, -1, -1))
+
+    def _grow(self):
+        old_rows = len(self.n)
+        new_rows = old_rows * 2
+        for name, dtype, empty in _FIELDS:
+            grown = np.full(new_rows, empty, dtype=dtype)
+            grown[:old_rows] = getattr(self, name)
+            setattr(self, name, grown)
+        self._free_rows = list(range(new_rows - 1, old_rows - 1, -1))
+
+    def _row_for(self, device_id):
+        row = self.rows.get(device_id)
+        if row is None:
+            if not self._free_rows:
+                self._grow()
+            row = self._free_rows.pop()
+            self.device_ids[row] = device_id
+            self.rows[device_id] = row
+        return row
+
+    def _clear_row(self, row):
+        for name, dtype, empty in _FIELDS:
+            getattr(self, name)[row] = empty
+
+    def remove(self, device_id):
+        """Forget a departed device and free its row"""
+        row = self.rows.pop(device_id, None)
+        if row is not None:
+            self._clear_row(row)
+            self._free_rows.append(row)
+
+    def clear(self):
+        """Forget every device (new session)"""
+        self.rows.clear()
+        self._allocate(len(self.n))
+
+    def stuck_ids(self):
+        """Devices currently pinned at a rail"""
+        # The arrays may be replaced by _grow between these two reads
+        stuck, device_ids = self.stuck, self.device_ids
+        rows = min(len(stuck), len(device_ids))
+        return device_ids[:rows][stuck[:rows]].tolist()
+
+    # ------------------------------------------------------------ observe
+
+    def observe(self, records):
+        """Readings (anything with timestamp, device_id, reading) -> anomalies, in order"""
+        if len(records) < self.vector_threshold:
+            found = []
+            step = self._step_one
+            for record in records:
+                step(record.timestamp, record.device_id, record.reading, found)
+            return found
+        return self.observe_arrays([r.device_id for r in records],
+                                   [r.reading for r in records],
+                                   [r.timestamp for r in records])
+
+    def _emit(self, found, timestamp, device_id, kind, reading, mean, score):
+        self.counts[kind] += 1
+        found.append(Anomaly(timestamp, device_id, kind, reading, mean, score))
+
+    def _step_one(self, timestamp, device_id, reading, found):
+        """One reading, one device; the scalar twin of _step_rows"""
+        row = self._row_for(device_id)
+        x = float(reading)
+        run = self.run.item(row) + 1 if x == self.last.item(row) else 1
+        self.last[row] = x
+        self.run[row] = run
+        n = self.n.item(row)
+        mean = self.mean.item(row)
+
+        if self.stuck.item(row):
+            if run == 1:
+                self.stuck[row] = False
+                self._emit(found, timestamp, device_id, 'recovered', reading, mean, 0.0)
+                self.mean[row] = x
+                self.pos[row] = self.neg[row] = 0.0
+                self.n[row] = 1
+            return
+        if run == self.stuck_count and x in self.rails:
+            self.stuck[row] = True
+            self._emit(found, timestamp, device_id, 'stuck', reading, mean, float(run))
+            return
+        if n == 0:
+            self.mean[row] = x
+            self.n[row] = 1
+            return
+
+        var = self.var.item(row)
+        delta = x - mean
+        z = delta / max(math.sqrt(var), self.min_std)
+        if n >= self.warmup:
+            outlier_z = self.outlier_z
+            clipped = min(max(z, -outlier_z), outlier_z)
+            pos = max(0.0, self.pos.item(row) + clipped - self.cusum_k)
+            neg = max(0.0, self.neg.item(row) - clipped - self.cusum_k)
+            if pos > self.cusum_h or neg > self.cusum_h:
+                self._emit(found, timestamp, device_id, 'change', reading, mean,
+                           pos if pos > self.cusum_h else -neg)
+                self.mean[row] = x
+                self.pos[row] = self.neg[row] = 0.0
+                self.n[row] = 1
+                return
+            self.pos[row] = pos
+            self.neg[row] = neg
+            if abs(z) > outlier_z:
+                # Kept out of the mean and variance; if the level really
+                # moved, the CUSUM reports it within a few readings
+                self._emit(found, timestamp, device_id, 'outlier', reading, mean, z)
+                return
+        self.mean[row] = mean + self.alpha * delta
+        self.var[row] = (1.0 - self.alpha) * (var + self.alpha * delta * delta)
+        self.n[row] = n + 1
+
+    def observe_arrays(self, device_ids, readings, timestamps):
+        """Vectorized path over parallel sequences; anomalies in input order"""
+        rows = np.fromiter(map(self._row_for, device_ids), dtype=np.int64, count=len(device_ids))
+        if not len(rows):
+            return []
+        x = np.asarray(readings, dtype=np.float64)
+        found = []
+        rank = _occurrence_rank(rows)
+        rounds = int(rank.max()) + 1
+        if rounds == 1:
+            self._step_rows(np.arange(len(rows)), rows, x, found)
+        else:
+            for r in range(rounds):
+                index = np.flatnonzero(rank == r)
+                self._step_rows(index, rows[index], x[index], found)
+            found.sort()
+        anomalies = []
+        for i, kind, mean, score in found:
+            self.counts[kind] += 1
+            anomalies.append(Anomaly(timestamps[i], device_ids[i], kind, readings[i], mean, score))
+        return anomalies
+
+    def _step_rows(self, index, rows, x, found):
+        """One reading for each of a set of distinct rows"""
+        run = np.where(x == self.last[rows], self.run[rows] + 1, 1)
+        self.last[rows] = x
+        self.run[rows] = run
+        n = self.n[rows]
+        mean = self.mean[rows]
+        var = self.var[rows]
+        stuck = self.stuck[rows]
+
+        recovered = stuck & (run == 1)
+        newly_stuck = ~stuck & (run == self.stuck_count) & np.isin(x, self.rails)
+        seed = ~stuck & ~newly_stuck & (n == 0)
+        live = ~stuck & ~newly_stuck & ~seed
+
+        delta = x - mean
+        z = delta / np.maximum(np.sqrt(var), self.min_std)
+        warm = live & (n >= self.warmup)
+        clipped = np.clip(z, -self.outlier_z, self.outlier_z)
+        pos = np.where(warm, np.maximum(0.0, self.pos[rows] + clipped - self.cusum_k),
+                       self.pos[rows])
+        neg = np.where(warm, np.maximum(0.0, self.neg[rows] - clipped - self.cusum_k),
+                       self.neg[rows])
+        change = warm & ((pos > self.cusum_h) | (neg > self.cusum_h))
+        outlier = warm & ~change & (np.abs(z) > self.outlier_z)
+        update = live & ~change & ~outlier
+        restart = recovered | change | seed
+
+        events = np.flatnonzero(recovered | newly_stuck | change | outlier)
+        for j in events.tolist():
+            if recovered[j]:
+                found.append((int(index[j]), 'recovered', float(mean[j]), 0.0))
+            elif newly_stuck[j]:
+                found.append((int(index[j]), 'stuck', float(mean[j]), float(run[j])))
+            elif change[j]:
+                score = pos[j] if pos[j] > self.cusum_h else -neg[j]
+                found.append((int(index[j]), 'change', float(mean[j]), float(score)))
+            else:
+                found.append((int(index[j]), 'outlier', float(mean[j]), float(z[j])))
+
+        alpha = self.alpha
+        self.mean[rows] = np.where(update, mean + alpha * delta, np.where(restart, x, mean))
+        self.var[rows] = np.where(update, (1.0 - alpha) * (var + alpha * delta * delta), var)
+        pos[restart] = 0.0
+        neg[restart] = 0.0
+        self.pos[rows] = pos
+        self.neg[rows] = neg
+        self.n[rows] = np.where(update, n + 1, np.where(restart, 1, n))
+        self.stuck[rows] = (stuck & ~recovered) | newly_stuck
@@ -0,0 +1,134 @@
+"""Blinking LED channels driven by clock timers instead of sleeping threads"""
+import threading
+from collections import deque
+
+from backends import HIGH, LOW
+
+
+class _Channel:
+    __slots__ = ('pin', 'half_period', 'lit', 'since', 'due', 'timer')
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.half_period = None
+        self.lit = False
+        self.since = 0.0
+        self.due = 0.0
+        self.timer = None
+
+
+class LedBlinker:
+    """Blinks any number of LEDs, each on for half_period then off for half_period.
+
+    Every toggle is a one-shot clock.call_later timer (the clock's scheduler
+    thread on a SystemClock), so no thread sleeps and channels are
+    independent. Changing a channel's rate retimes the phase in progress
+    straight away rather than after the current blink. How late each toggle
+    ran is kept for jitter_stats().
+
+    pulse() lights a pin once for a while instead; pulses are not channels,
+    so show_only() leaves them alone.
+    """
+
+    def __init__(self, gpio, clock):
+        self.gpio = gpio
+        self.clock = clock
+        self.channels = {}
+        self.pulses = {}         # pin -> (token, timer) of the pulse in progress
+        self.jitter = deque(maxlen=1000)
+        self.toggles = 0
+        self._lock = threading.Lock()
+
+    def blink(self, pin, half_period):
+        """Start blinking pin, or change its rate"""
+        with self._lock:
+            channel = self.channels.get(pin)
+            if channel is None:
+                channel = self.channels[pin] = _Channel(pin)
+            if channel.half_period == half_period:
+                return
+            channel.half_period = half_period
+            now = self.clock.time()
+            if channel.timer is None:
+                # New channel: light up now
+                channel.lit = True
+                channel.since = now
+                self.gpio.output(pin, HIGH)
+            else:
+                channel.timer.cancel()
+            self._schedule(channel, max(now, channel.since + half_period))
+
+    def pulse(self, pin, seconds):
+        """Light pin for seconds, extending a pulse already in progress"""
+        with self._lock:
+            current = self.pulses.get(pin)
+            if current is None:
+                self.gpio.output(pin, HIGH)
+            else:
+                current[1].cancel()
+            token = object()
+            timer = self.clock.call_later(seconds, lambda: self._end_pulse(pin, token))
+            self.pulses[pin] = (token, timer)
+
+    def _end_pulse(self, pin, token):
+        with self._lock:
+            current = self.pulses.get(pin)
+            if current is None or current[0] is not token:
+                return
+            del self.pulses[pin]
+            self.gpio.output(pin, LOW)
+
+    def stop(self, pin):
+        """Stop blinking or pulsing pin and switch it off"""
+        with self._lock:
+            channel = self.channels.pop(pin, None)
+            pulse = self.pulses.pop(pin, None)
+            if channel is None and pulse is None:
+                return
+            if channel is not None and channel.timer is not None:
+                channel.timer.cancel()
+            if pulse is not None:
+                pulse[1].cancel()
+            self.gpio.output(pin, LOW)
+
+    def show_only(self, pin, half_period):
+        """Blink pin and stop every other channel (pin may be None)"""
+        for other in [p for p in self.channels if p != pin]:
+            self.stop(other)
+        if pin is not None:
+            self.blink(pin, half_period)
+
+    def stop_all(self):
+        for pin in list(self.channels) + list(self.pulses):
+            self.stop(pin)
+
+    def _schedule(self, channel, due):
+        channel.due = due
+        channel.timer = self.clock.call_later(due - self.clock.time(),
+                                              lambda: self._toggle(channel))
+
+    def _toggle(self, channel):
+        with self._lock:
+            if self.channels.get(channel.pin) is not channel:
+                return
+            now = self.clock.time()
+            self.jitter.append(now - channel.due)
+            self.toggles += 1
+            channel.lit = not channel.lit
+            channel.since = channel.due
+            self.gpio.output(channel.pin, HIGH if channel.lit else LOW)
+            # Next toggle is relative to when this one was due, so lateness
+            # does not accumulate into drift
+            self._schedule(channel, max(now, channel.due + channel.half_period))
+
+    def jitter_stats(self):
+        """Toggles so far, and lateness over the recent ones relative to schedule, in seconds"""
+        if not self.jitter:
+            return {'toggles': self.toggles, 'mean': 0.0, 'p99': 0.0, 'max': 0.0}
+        jitter = sorted(self.jitter)
+        return {
+            'toggles': self.toggles,
+            'mean': sum(jitter) / len(jitter),
+            'p99': jitter[min(len(jitter) - 1, int(0.99 * len(jitter)))],
+            'max': jitter[-1],
+        }
@@ -0,0 +1,256 @@
+"""Buffered background writer for LightSwarm session logs"""
+import threading
+import time
+from datetime import datetime
+
+from binlog import BinaryLogWriter, binary_filename
+from metrics import Histogram
+from sessiondb import SessionDB
+
+DEFAULT_FLUSH_SIZE = 500       # lines
+DEFAULT_FLUSH_INTERVAL = 1.0   # seconds
+
+# Queue item kinds
+_RECORD = 0
+_TEXT = 1
+_ROTATE = 2
+_MASTER = 3
+
+
+class LogWriter:
+    """Writes session log lines from a dedicated thread.
+
+    Callers only append to an in-memory list; the writer thread formats the
+    lines and writes them to the open log file in batches, flushing when
+    flush_size lines are pending or flush_interval seconds have passed.
+    Rotation is queued like any other write, so every line lands in the file
+    that was current when it was logged.
+
+    formats selects the sinks: 'text' keeps the existing line format (MASTER
+    readings and reset summaries), 'binary' writes every reading to a
+    fixed-width .lsb file next to it (see binlog.py). With db_path every
+    reading and master change also goes into that SQLite database (see
+    sessiondb.py), one transaction per batch; each log file is a session.
+
+    If on_write is given it is called from the writer thread after each
+    batch hits the file, with the list of record tuples in that batch.
+    How long each batch took to write is kept in write_seconds.
+    """
+
+    def __init__(self, flush_size=DEFAULT_FLUSH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, on_write=None,
+                 formats=('text',), db_path=None):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.on_write = on_write
+        self.text_enabled = 'text' in formats
+        self.binary_enabled = 'binary' in formats
+        self.db_path = db_path
+        # Non-master readings are only worth queueing for these sinks
+        self.all_readings = self.binary_enabled or db_path is not None
+        self.filename = None
+        self.lines_written = 0
+        self.write_seconds = Histogram('lightswarm_log_write_seconds',
+                                       'Time to write and flush one batch of log lines')
+
+        self._pending = []
+        self._cond = threading.Condition()
+        self._queued = 0
+        self._done = 0
+        self._closing = False
+        self._urgent = False
+        self._file = None
+        self._binary = None
+        self._db = None
+        self._ts_second = None
+        self._ts_text = ''
+
+        self._thread = threading.Thread(target=self.run, name='logwriter', daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        with self._cond:
+            if self._closing:
+                return
+            self._pending.append(item)
+            self._queued += 1
+            if item[0] == _ROTATE:
+                self._urgent = True
+                self._cond.notify_all()
+            elif len(self._pending) == 1 or len(self._pending) >= self.flush_size:
+                # Wake the writer to start its flush timer, or to write a full batch
+                self._cond.notify_all()
+
+    def write_record(self, timestamp, device_id, ip_addr, reading, master_duration,
+                     is_master=True):
+        """Queue one reading; only MASTER readings go to the text log"""
+        self._put((_RECORD, (timestamp, device_id, ip_addr, reading, master_duration, is_master)))
+
+    def write_text(self, text):
+        """Queue free-form text (e.g. a reset summary) for the current file"""
+        self._put((_TEXT, text))
+
+    def write_master_change(self, timestamp, device_id, ip_addr):
+        """Queue a master change (device_id None: no master) for the database"""
+        if self.db_path is not None:
+            self._put((_MASTER, (timestamp, device_id, ip_addr)))
+
+    def rotate(self, filename, header=''):
+        """Switch to a new log file once everything queued so far is written"""
+        self._put((_ROTATE, (filename, header)))
+
+    def pending(self):
+        """Items queued but not yet written"""
+        return len(self._pending)
+
+    def flush(self, timeout=None):
+        """Block until everything queued before this call is on disk"""
+        with self._cond:
+            target = self._queued
+            self._urgent = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._done >= target, timeout)
+
+    def close(self, timeout=5.0):
+        """Write out everything still queued and close the current file"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def run(self):
+        if self.db_path is not None:
+            # SQLite connections belong to the thread that opens them
+            try:
+                self._db = SessionDB(self.db_path)
+            except Exception as e:
+                print(f"Error opening session database {self.db_path}: {e}")
+        while True:
+            with self._cond:
+                # Wait for a full batch, the flush interval (measured from the
+                # oldest pending line), or an explicit flush/rotate/close
+                deadline = None
+                while (not self._closing and not self._urgent
+                       and len(self._pending) < self.flush_size):
+                    if not self._pending:
+                        deadline = None
+                        self._cond.wait()
+                        continue
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending
+                self._pending = []
+                self._urgent = False
+                closing = self._closing
+
+            if batch:
+                started = time.perf_counter()
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    print(f"Error writing log: {e}")
+                self.write_seconds.observe(time.perf_counter() - started)
+                with self._cond:
+                    self._done += len(batch)
+                    self._cond.notify_all()
+
+            if closing and not batch:
+                break
+
+        self._close_files()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _format_timestamp(self, timestamp):
+        # strftime only runs once per wall-clock second
+        second = int(timestamp)
+        if second != self._ts_second:
+            self._ts_second = second
+            self._ts_text = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+        return self._ts_text
+
+    def _write_batch(self, batch):
+        lines = []
+        records = []
+        changes = []
+        for kind, payload in batch:
+            if kind == _RECORD:
+                records.append(payload)
+                timestamp, device_id, ip_addr, reading, master_duration, is_master = payload
+                if self.text_enabled and is_master:
+                    lines.append(f"{self._format_timestamp(timestamp)}, {device_id}, "
+                                 f"{ip_addr}, {reading}, {master_duration:.2f}\n")
+            elif kind == _TEXT:
+                if self.text_enabled:
+                    lines.append(payload)
+            elif kind == _MASTER:
+                changes.append(payload)
+            else:
+                self._write_lines(lines)
+                self._write_binary(records)
+                self._write_db(records, changes)
+                lines = []
+                records_before_rotate = records
+                records = []
+                changes = []
+                self._open(*payload)
+                self._notify(records_before_rotate)
+        self._write_lines(lines)
+        self._write_binary(records)
+        self._write_db(records, changes)
+        if self._file is not None:
+            self._file.flush()
+        if self._binary is not None:
+            self._binary.flush()
+        self._notify(records)
+
+    def _notify(self, records):
+        if self.on_write is not None and records:
+            self.on_write(records)
+
+    def _write_lines(self, lines):
+        if not lines:
+            return
+        if self._file is None:
+            print(f"Dropping {len(lines)} log lines: no log file open")
+            return
+        self._file.writelines(lines)
+        self.lines_written += len(lines)
+
+    def _write_binary(self, records):
+        if self._binary is None or not records:
+            return
+        self._binary.write_records([(ts, device_id, ip_addr, reading, is_master)
+                                    for ts, device_id, ip_addr, reading, _, is_master in records])
+
+    def _write_db(self, records, changes):
+        if self._db is None or not (records or changes):
+            return
+        try:
+            self._db.write(records, changes)
+        except Exception as e:
+            print(f"Error writing session database: {e}")
+
+    def _close_files(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._binary is not None:
+            self._binary.close()
+            self._binary = None
+
+    def _open(self, filename, header):
+        self._close_files()
+        if self.text_enabled:
+            self._file = open(filename, 'w')
+            self._file.write(header)
+        if self.binary_enabled:
+            self._binary = BinaryLogWriter(binary_filename(filename))
+        if self._db is not None:
+            self._db.start_session(filename)
+        self.filename = filename
@@ -0,0 +1,358 @@
+"""Low-overhead counters and histograms for the monitor, served in Prometheus text format.
+
+Hot paths only touch plain attributes: Counter.inc and Histogram.observe
+are a bisect and a couple of additions, with no lock. Each instrument is
+meant to be updated from one thread (the GIL keeps the reads consistent
+enough for monitoring). Values that already live elsewhere, such as ingest
+counters or queue depths, are read by callbacks at scrape time instead of
+being copied on every packet.
+
+    registry = Registry()
+    handled = registry.histogram('lightswarm_handle_seconds', 'Time to handle one reading')
+    MetricsServer(registry, 9100, profiler=SamplingProfiler()).start()
+
+    curl localhost:9100/metrics
+    curl -X POST localhost:9100/profile/start; sleep 30; curl localhost:9100/profile
+"""
+import bisect
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from 50 us packet handling up to multi-second stalls
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Innermost frames that mean a thread is blocked, not working
+_WAIT_MODULES = ('threading.py', 'selectors.py', 'queue.py', 'socketserver.py')
+_WAIT_FUNCTIONS = {'wait', 'select', 'get', 'serve_forever', '_wait_for_tstate_lock'}
+
+
+def _format_value(value):
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(text):
+    return str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """Monotonic count; name should end in _total"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, '', self.value
+
+
+class Histogram:
+    """Distribution over fixed buckets, rendered cumulatively at scrape time"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield self.name + '_bucket', f'le="{_format_value(bound)}"', cumulative
+        yield self.name + '_bucket', 'le="+Inf"', cumulative + self.counts[-1]
+        yield self.name + '_sum', '', self.sum
+        yield self.name + '_count', '', self.count
+
+
+class Callback:
+    """Value read from func() at scrape time.
+
+    With label, func returns {label_value: value} and one sample is
+    rendered per entry.
+    """
+
+    def __init__(self, name, help_text, func, kind='gauge', label=None):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.kind = kind
+        self.label = label
+
+    def samples(self):
+        value = self.func()
+        if self.label is None:
+            yield self.name, '', value
+            return
+        for key, item in sorted(value.items()):
+            yield self.name, f'{self.label}="{_escape(key)}"', item
+
+
+class Registry:
+    """The set of instruments one /metrics scrape renders"""
+
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, func, label=None):
+        return self.register(Callback(name, help_text, func, 'gauge', label))
+
+    def counter_func(self, name, help_text, func, label=None):
+        return self.register(Callback(name, help_text, func, 'counter', label))
+
+    def collect(self):
+        """[(name, help, kind, [(sample name, labels, value)])], e.g. to send to another process"""
+        with self._lock:
+            metrics = list(self.metrics)
+        families = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"Error reading metric {metric.name}: {e}")
+                continue
+            families.append((metric.name, metric.help, metric.kind, samples))
+        return families
+
+    def render(self):
+        """All instruments in the Prometheus text exposition format"""
+        return render_families(self.collect())
+
+
+def merge_families(groups):
+    """Merge collected families from several registries, e.g. one per worker.
+
+    groups is a list of (families, {label: value}); the labels are added to
+    every sample of that group so the sources stay apart.
+    """
+    merged = {}
+    for families, labels in groups:
+        prefix = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        for name, help_text, kind, samples in families:
+            family = merged.get(name)
+            if family is None:
+                family = merged[name] = (name, help_text, kind, [])
+            for sample, sample_labels, value in samples:
+                family[3].append((sample, ','.join(l for l in (prefix, sample_labels) if l),
+                                  value))
+    return list(merged.values())
+
+
+def render_families(families):
+    """Prometheus text exposition format for collected families"""
+    lines = []
+    for name, help_text, kind, samples in families:
+        lines.append(f"# HELP {name} {_escape(help_text)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples:
+            labels = '{' + labels + '}' if labels else ''
+            lines.append(f"{sample}{labels} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval while running.
+
+    Only threads that are doing work are counted: a thread whose CPU clock
+    has not moved since the previous sample, or that is parked in a
+    condition wait or select(), is skipped, so the report shows where busy
+    time goes rather than where threads sleep. Stacks are tallied in the
+    folded format flamegraph.pl and speedscope read ("thread;outer;...;inner
+    count"). Nothing runs while the profiler is stopped.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self._stacks = _Tally()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return False
+            self._stacks.clear()
+            self.samples = 0
+            self.elapsed = 0.0
+            self.started_at = time.perf_counter()
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        with self._lock:
+            if not self._running:
+                return False
+            self._running = False
+            thread = self._thread
+            self._thread = None
+        thread.join(timeout=1)
+        self.elapsed = time.perf_counter() - self.started_at
+        return True
+
+    def _busy(self, ident, frame, clocks, last_cpu):
+        if (frame.f_code.co_filename.endswith(_WAIT_MODULES)
+                and frame.f_code.co_name in _WAIT_FUNCTIONS):
+            return False
+        if not hasattr(time, 'pthread_getcpuclockid'):
+            return True
+        try:
+            clock = clocks.get(ident)
+            if clock is None:
+                clock = clocks[ident] = time.pthread_getcpuclockid(ident)
+            cpu = time.clock_gettime(clock)
+        except OSError:
+            return False
+        busy = cpu != last_cpu.get(ident)
+        last_cpu[ident] = cpu
+        return busy
+
+    def _run(self):
+        me = threading.get_ident()
+        clocks = {}
+        last_cpu = {}
+        while self._running:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me or not self._busy(ident, frame, clocks, last_cpu):
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}"
+                                 f":{code.co_firstlineno})")
+                    frame = frame.f_back
+                calls.append(names.get(ident, str(ident)))
+                stacks.append(';'.join(reversed(calls)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def report(self, limit=None):
+        """Folded stacks, heaviest first, with a header comment"""
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+            samples = self.samples
+        elapsed = (time.perf_counter() - self.started_at if self._running
+                   else self.elapsed) if self.started_at is not None else 0.0
+        lines = [f"# {samples} samples over {elapsed:.1f} s every "
+                 f"{self.interval * 1000:.1f} ms ({'running' if self._running else 'stopped'})"]
+        lines.extend(f"{stack} {count}" for stack, count in stacks)
+        return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'LightSwarmMetrics'
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            self._reply(200, self.server.registry.render(),
+                        'text/plain; version=0.0.4; charset=utf-8')
+        elif path == '/profile' and self.server.profiler is not None:
+            self._reply(200, self.server.profiler.report())
+        else:
+            self._reply(404, 'not found\n')
+
+    def do_POST(self):
+        profiler = self.server.profiler
+        path = self.path.split('?', 1)[0]
+        if profiler is None or path not in ('/profile/start', '/profile/stop'):
+            self._reply(404, 'not found\n')
+        elif path == '/profile/start':
+            self._reply(200, 'started\n' if profiler.start() else 'already running\n')
+        else:
+            self._reply(200, 'stopped\n' if profiler.stop() else 'not running\n')
+
+    def _reply(self, status, body, content_type='text/plain; charset=utf-8'):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would otherwise flood stdout
+        pass
+
+
+class MetricsServer:
+    """Serves /metrics and, with a profiler, /profile on a background thread.
+
+    GET /metrics          Prometheus text format
+    GET /profile          folded stacks from the sampling profiler
+    POST /profile/start   start sampling (clears the previous profile)
+    POST /profile/stop    stop sampling
+    """
+
+    def __init__(self, registry, port, host='127.0.0.1', profiler=None):
+        self.registry = registry
+        self.profiler = profiler
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self.httpd.profiler = profiler
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='metrics',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join(timeout=1)
+            self._thread = None
+        self.httpd.server_close()
@@ -0,0 +1,46 @@
+"""Per-thread CPU and process memory readings (Linux /proc, with fallbacks)"""
+import os
+import resource
+import threading
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def thread_cpu_times():
+    """CPU seconds (user + system) per live Python thread, keyed by name"""
+    times = {}
+    for thread in threading.enumerate():
+        tid = getattr(thread, 'native_id', None)
+        if tid is None:
+            continue
+        try:
+            with open(f'/proc/self/task/{tid}/stat') as f:
+                # Fields after the parenthesised command name; utime/stime are 14/15
+                fields = f.read().rsplit(')', 1)[1].split()
+            times[thread.name] = times.get(thread.name, 0.0) + \
+                (int(fields[11]) + int(fields[12])) / _CLK_TCK
+        except (OSError, IndexError, ValueError):
+            continue
+    return times
+
+
+def process_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def rss_bytes():
+    """Current resident set size, or peak RSS where /proc is unavailable"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def cpu_delta(before, after):
+    """Per-thread CPU seconds spent between two thread_cpu_times() calls"""
+    return {name: after[name] - before.get(name, 0.0) for name in after}
@@ -0,0 +1,167 @@
+"""Frame parsing for the LightSwarm UDP protocol (see Swarm/Swarm.ino).
+
+Two datagram formats share the port. Text frames are one reading each:
+
+    MASTER:<device_id>:<reading>    LIGHT:<device_id>:<reading>
+
+Readings are analogRead() values, 0..MAX_READING; device IDs are the
+nodes' unsigned chip IDs. Frames with anything else are malformed.
+
+Binary frames (optional, little endian) carry a batch of readings from one
+node and start with a byte no text frame can start with:
+
+    header   8 bytes   magic 0xB5, version u8, count u8, reserved u8,
+                       device_id u32
+    entry    8 bytes   node millis u32, reading u16, flags u8 (bit 0:
+                       sent as master), pad u8        x count
+
+Entry times are node-local millis(); the Pi dates the newest entry at
+arrival and the others by their distance from it, so nodes need no clock.
+Backdated entries can fall before readings already taken from other nodes;
+ReadingOrder puts the combined stream back into time order.
+"""
+import struct
+from collections import namedtuple
+from operator import attrgetter
+
+# Message prefixes sent by the ESP8266 nodes
+MASTER_PREFIX = 'MASTER:'
+LIGHT_PREFIX = 'LIGHT:'
+
+# Commands broadcast by the Pi (they loop back to our own socket)
+CONTROL_MESSAGES = (b'RESET', b'ACTIVATE')
+
+# 10-bit ADC on the ESP8266
+MAX_READING = 1023
+
+# A parsed reading: kind is 'MASTER' or 'LIGHT', addr is the sender IP string
+Reading = namedtuple('Reading', ['kind', 'device_id', 'reading', 'addr', 'timestamp'])
+
+
+BINARY_MAGIC = 0xB5
+BINARY_VERSION = 1
+FRAME_HEADER = struct.Struct('<BBBBI')
+FRAME_ENTRY = struct.Struct('<IHBx')
+FLAG_MASTER = 0x01
+MAX_BATCH = 255
+
+_FRAME_STRUCTS = {}
+
+
+class MalformedFrame(ValueError):
+    """Raised when a datagram looks like a reading but cannot be parsed"""
+
+
+def parse_frame(data, addr, timestamp):
+    """Parse one raw datagram into a Reading.
+
+    Returns None for control frames (RESET/ACTIVATE) that are not readings,
+    raises MalformedFrame for anything else that cannot be parsed.
+    """
+    if data in CONTROL_MESSAGES:
+        return None
+    try:
+        kind, device_id, reading = data.decode('ascii').split(':')
+        if kind not in ('MASTER', 'LIGHT'):
+            raise ValueError(f"unknown frame type {kind!r}")
+        device_id, reading = int(device_id), int(reading)
+        if device_id < 0:
+            raise ValueError(f"negative device ID {device_id}")
+        if not 0 <= reading <= MAX_READING:
+            raise ValueError(f"reading {reading} outside 0..{MAX_READING}")
+        return Reading(kind, device_id, reading, addr, timestamp)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise MalformedFrame(f"{data[:32]!r} from {addr}: {e}") from None
+
+
+def _frame_struct(count):
+    """Struct for a whole frame of count readings, so one call unpacks it"""
+    frame = _FRAME_STRUCTS.get(count)
+    if frame is None:
+        frame = _FRAME_STRUCTS[count] = struct.Struct(
+            FRAME_HEADER.format + FRAME_ENTRY.format[1:] * count)
+    return frame
+
+
+def parse_binary_frame(buf, nbytes, addr, timestamp):
+    """Parse a binary frame held in buf[:nbytes] into a list of Readings.
+
+    buf may be a reused bytearray filled by recvfrom_into: the whole frame
+    is unpacked in place by one precompiled Struct, nothing is copied.
+    """
+    if nbytes < FRAME_HEADER.size:
+        raise MalformedFrame(f"short binary frame ({nbytes} bytes) from {addr}")
+    if buf[0] != BINARY_MAGIC:
+        raise MalformedFrame(f"bad magic 0x{buf[0]:02x} from {addr}")
+    if buf[1] != BINARY_VERSION:
+        raise MalformedFrame(f"unsupported binary frame version {buf[1]} from {addr}")
+    count = buf[2]
+    frame = _frame_struct(count)
+    if nbytes != frame.size:
+        raise MalformedFrame(f"binary frame from {addr} is {nbytes} bytes, "
+                             f"expected {frame.size} for {count} readings")
+    if not count:
+        return []
+
+    # header fields, then (millis, reading, flags) per entry
+    fields = frame.unpack_from(buf)
+    device_id = fields[4]
+    if max(fields[6::3]) > MAX_READING:
+        raise MalformedFrame(f"binary frame from {addr} has a reading above {MAX_READING}")
+    if count == 1:
+        return [Reading('MASTER' if fields[7] & FLAG_MASTER else 'LIGHT', device_id,
+                        fields[6], addr, timestamp)]
+    last_ms = fields[-3]
+    return [Reading('MASTER' if fields[i + 2] & FLAG_MASTER else 'LIGHT', device_id,
+                    fields[i + 1], addr,
+                    timestamp - ((last_ms - fields[i]) & 0xFFFFFFFF) / 1000.0)
+            for i in range(5, len(fields), 3)]
+
+
+def parse_datagram(buf, nbytes, addr, timestamp):
+    """Parse either frame format from buf[:nbytes]; returns a list of Readings"""
+    if nbytes and buf[0] == BINARY_MAGIC:
+        return parse_binary_frame(buf, nbytes, addr, timestamp)
+    record = parse_frame(bytes(buf[:nbytes]), addr, timestamp)
+    return [record] if record is not None else []
+
+
+class ReadingOrder:
+    """Merges parsed readings from successive datagrams into one time-ordered stream.
+
+    order() sorts one group of readings (typically everything read in one
+    pass over the socket) by timestamp, then lifts any reading that would
+    still date before the newest one already passed on up to that time. The
+    store, rollups and logs downstream can then rely on timestamps never
+    going backwards; a backdated entry keeps its spacing from its neighbours
+    only as far back as the previous group.
+    """
+
+    def __init__(self):
+        self.latest = float('-inf')
+
+    def order(self, records):
+        """records in timestamp order, none older than anything returned before"""
+        if not records:
+            return records
+        records = sorted(records, key=attrgetter('timestamp'))
+        latest = self.latest
+        if records[0].timestamp < latest:
+            records = [r if r.timestamp >= latest else r._replace(timestamp=latest)
+                       for r in records]
+        self.latest = records[-1].timestamp
+        return records
+
+
+def encode_binary_frame(device_id, entries):
+    """Build a binary frame from (node_millis, reading, is_master) entries"""
+    if len(entries) > MAX_BATCH:
+        raise ValueError(f"at most {MAX_BATCH} readings per frame")
+    frame = bytearray(FRAME_HEADER.size + len(entries) * FRAME_ENTRY.size)
+    FRAME_HEADER.pack_into(frame, 0, BINARY_MAGIC, BINARY_VERSION, len(entries), 0, device_id)
+    offset = FRAME_HEADER.size
+    for node_ms, reading, is_master in entries:
+        FRAME_ENTRY.pack_into(frame, offset, node_ms & 0xFFFFFFFF, reading,
+                              FLAG_MASTER if is_master else 0)
+        offset += FRAME_ENTRY.size
+    return bytes(frame)
@@ -0,0 +1,253 @@
+"""Incremental matplotlib renderer for the LightSwarm monitor window"""
+import time
+from collections import deque
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+
+# How long a departed device stays listed on the readings plot
+DEPARTURE_NOTICE_SECONDS = 10.0
+
+
+class PlotRenderer:
+    """Draws GraphData using persistent artists and blitting.
+
+    The reading trace is a single LineCollection and every master gets one
+    bar and one label that are reused across frames. All of them are
+    animated artists: a normal frame restores the cached background, redraws
+    just those artists and blits. A full redraw (which refreshes the cached
+    background) only happens when the axes themselves change - a new master
+    appears, the bar chart outgrows its y-limit, or the window is resized.
+
+    render_cost adds that many seconds of busy work to every frame, to
+    emulate a slow display when benchmarking.
+    """
+
+    def __init__(self, graph_data, render_cost=0.0):
+        self.graph_data = graph_data
+        self.render_cost = render_cost
+        self.history_seconds = graph_data.history_seconds
+        self.frame_times = deque(maxlen=100)
+        self.frames = 0
+
+        # Create figure with two subplots
+        self.fig, (self.ax1, self.ax2) = plt.subplots(2, 1, figsize=(6, 4))
+        self.canvas = self.fig.canvas
+        self.canvas.manager.set_window_title('LightSwarm Monitor')
+
+        # Enable faster rendering
+        if self.canvas.toolbar is not None:
+            self.canvas.toolbar.set_message = lambda x: None
+
+        self.trace = LineCollection([], linewidths=2, animated=True)
+        self.ax1.add_collection(self.trace)
+        self.notice = self.ax1.text(0.01, 0.97, '', transform=self.ax1.transAxes, fontsize=6,
+                                    va='top', color='gray', animated=True)
+        # Outliers and light changes from the detector, on any device
+        self.alerts = self.ax1.scatter([], [], marker='x', s=16, color='black', zorder=3,
+                                       animated=True)
+        self.bars = {}
+        self.labels = {}
+        self.bar_order = []
+        self.bar_ylim = 10
+        self._legend_size = 0
+
+        self.background = None
+        self._layout_dirty = True
+        self._needs_reset = False
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+        self.setup_plots()
+
+    def setup_plots(self):
+        """Set up the basic plot parameters"""
+        try:
+            # Configure photocell plot
+            self.ax1.set_title(f'Photocell Readings (Last {self.history_seconds}s)', fontsize=8)
+            self.ax1.set_xlabel('Time (s)', fontsize=8)
+            self.ax1.set_ylabel('Reading', fontsize=8)
+            self.ax1.tick_params(labelsize=6)
+            self.ax1.grid(True)
+            self.ax1.set_ylim(0, 1023)
+            self.ax1.set_xlim(0, self.history_seconds)
+
+            # Configure master times plot
+            self.ax2.set_title('Master Device Times', fontsize=8)
+            self.ax2.set_xlabel('Device IP', fontsize=8)
+            self.ax2.set_ylabel('Time as Master (s)', fontsize=8)
+            self.ax2.tick_params(labelsize=6)
+            self.ax2.grid(True)
+            self.ax2.set_ylim(0, self.bar_ylim)
+            self.ax2.set_xlim(-0.5, max(len(self.bar_order), 1) - 0.5)
+
+            self.fig.tight_layout()
+        except Exception as e:
+            print(f"Error in setup_plots: {e}")
+
+    def reset(self):
+        """Request a reset; the artists are rebuilt on the next render"""
+        self._needs_reset = True
+
+    def _on_draw(self, event):
+        # Any full draw (ours or a resize) invalidates the cached background
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _clear_artists(self):
+        for artist in list(self.bars.values()) + list(self.labels.values()):
+            artist.remove()
+        self.bars.clear()
+        self.labels.clear()
+        self.bar_order = []
+        self.bar_ylim = 10
+        self.trace.set_segments([])
+        self.notice.set_text('')
+        self.alerts.set_offsets(np.empty((0, 2)))
+        legend = self.ax1.get_legend()
+        if legend is not None:
+            legend.remove()
+        self._layout_dirty = True
+
+    def _add_master(self, key, color):
+        idx = len(self.bar_order)
+        bar = self.ax2.bar([idx], [0], color=color, animated=True)[0]
+        label = self.ax2.text(idx, 0, '', ha='center', va='bottom', fontsize=6, animated=True)
+        self.bars[key] = bar
+        self.labels[key] = label
+        self.bar_order.append(key)
+        self._layout_dirty = True
+
+    def _remove_master(self, key):
+        self.bars.pop(key).remove()
+        self.labels.pop(key).remove()
+        self.bar_order.remove(key)
+        # Close the gap
+        for idx, other in enumerate(self.bar_order):
+            bar = self.bars[other]
+            bar.set_x(idx - bar.get_width() / 2)
+            self.labels[other].set_x(idx)
+        self._layout_dirty = True
+
+    def _relayout(self):
+        """Update the static parts of the axes and redraw the background"""
+        self.ax2.set_xticks(range(len(self.bar_order)))
+        label = self.graph_data.label
+        self.ax2.set_xticklabels([label(key) for key in self.bar_order], rotation=45, ha='right')
+
+        master_colors = self.graph_data.master_colors
+        self._legend_size = len(master_colors)
+        legend = self.ax1.get_legend()
+        if legend is not None:
+            legend.remove()
+        if master_colors:
+            legend_elements = [Line2D([0], [0], color=color, label=f'Master {label(key)}')
+                               for key, color in master_colors.items()]
+            self.ax1.legend(handles=legend_elements, loc='upper right', fontsize=6)
+
+        self.setup_plots()
+        self._layout_dirty = False
+        # Triggers _on_draw, which caches the new background
+        self.canvas.draw()
+
+    def _update_artists(self):
+        graph_data = self.graph_data
+
+        # Reading trace: one segment per pair of consecutive master samples,
+        # scrolled so the right edge of the axis is "now"
+        now = graph_data.clock.time()
+        times, readings, colors = graph_data.trace(now)
+        if len(times) > 1:
+            points = np.column_stack((times - (now - self.history_seconds),
+                                      readings.astype(float)))
+            segments = np.stack((points[:-1], points[1:]), axis=1)
+            self.trace.set_segments(segments)
+            self.trace.set_color(colors[:-1])
+        else:
+            self.trace.set_segments([])
+
+        # Master time bars
+        master_data = graph_data.get_master_durations(now)
+        for key in [key for key in self.bar_order if key not in master_data]:
+            # Device departed
+            self._remove_master(key)
+        for key, duration in master_data.items():
+            if key not in self.bars:
+                self._add_master(key, graph_data.master_colors[key])
+            self.bars[key].set_height(duration)
+            label = self.labels[key]
+            label.set_y(duration)
+            label.set_text(f'{duration:.1f}s')
+
+        start = now - self.history_seconds
+        marks = [(a.timestamp - start, a.reading) for a in list(graph_data.anomalies)
+                 if a.kind in ('outlier', 'change') and a.timestamp >= start]
+        self.alerts.set_offsets(marks if marks else np.empty((0, 2)))
+
+        notices = []
+        departed = [d.addr for d in graph_data.departures
+                    if now - d.timestamp < DEPARTURE_NOTICE_SECONDS]
+        if departed:
+            notices.append(f"Departed: {', '.join(departed)}")
+        if graph_data.stuck:
+            notices.append(f"Stuck: {', '.join(graph_data.label(d) for d in graph_data.stuck)}")
+        self.notice.set_text('\n'.join(notices))
+
+        if len(graph_data.master_colors) != self._legend_size:
+            self._layout_dirty = True
+
+        if master_data:
+            highest = max(master_data.values())
+            if highest > self.bar_ylim * 0.9:
+                # Grow in steps so the background is only redrawn occasionally
+                while highest > self.bar_ylim * 0.9:
+                    self.bar_ylim *= 2
+                self._layout_dirty = True
+
+    def _draw_animated(self):
+        self.ax1.draw_artist(self.trace)
+        self.ax1.draw_artist(self.notice)
+        self.ax1.draw_artist(self.alerts)
+        for key in self.bar_order:
+            self.ax2.draw_artist(self.bars[key])
+            self.ax2.draw_artist(self.labels[key])
+
+    def render(self):
+        """Draw one frame and record how long it took"""
+        start = time.perf_counter()
+
+        if self._needs_reset:
+            self._needs_reset = False
+            self._clear_artists()
+
+        self._update_artists()
+
+        if self._layout_dirty or self.background is None:
+            self._relayout()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_animated()
+            self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+
+        if self.render_cost:
+            # Spin in Python rather than sleep: a slow draw holds the GIL
+            deadline = start + self.render_cost
+            while time.perf_counter() < deadline:
+                pass
+
+        self.frame_times.append(time.perf_counter() - start)
+        self.frames += 1
+
+    def frame_stats(self):
+        """Frames drawn so far, and render times over the recent ones in seconds"""
+        if not self.frame_times:
+            return {'frames': self.frames, 'last': 0.0, 'mean': 0.0, 'max': 0.0}
+        frames = list(self.frame_times)
+        return {
+            'frames': self.frames,
+            'last': frames[-1],
+            'mean': sum(frames) / len(frames),
+            'max': max(frames),
+        }
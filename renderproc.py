@@ -0,0 +1,335 @@
+"""Render the LightSwarm plots in a separate process fed through shared memory.
+
+The monitor process publishes into one shared-memory segment and never
+waits for the renderer:
+
+    control   int64[8]    seq, generation, tick, ring head, masters,
+                          current master slot, quit flag, closed flag
+    clock     float64[2]  monitor time at the last tick, history seconds
+    frames    float64[4]  frames, last, mean, max (written by the renderer)
+    ring      RING_DTYPE  MASTER samples (timestamp, reading, master slot)
+    masters   MASTER_DTYPE  per-device master totals (label, seconds, run start)
+
+There are MAX_MASTERS master slots. A departed master keeps its slot, and
+so its bar, until a new master needs one and none is free; the slot of the
+longest-departed master is then reused and its samples lose their color
+(slot -1, drawn gray).
+
+Writers bump `seq` to an odd value, write, and bump it back to even; the
+renderer copies what it needs and retries if `seq` moved (a seqlock), so
+neither side ever takes a lock the other could hold. A slow, hung or
+crashed renderer therefore cannot stall packet handling.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+from multiprocessing import shared_memory
+
+DEFAULT_RING_CAPACITY = 4096
+MAX_MASTERS = 64
+COLOR_LIST = ['red', 'blue', 'green', 'purple', 'orange', 'yellow']
+# Samples whose master no longer has a slot
+NO_SLOT_COLOR = 'gray'
+
+RING_DTYPE = np.dtype([('ts', '<f8'), ('reading', '<i2'), ('slot', '<i2'), ('pad', '<i4')])
+MASTER_DTYPE = np.dtype([('ip', 'S16'), ('seconds', '<f8'), ('start', '<f8')])
+
+# Indexes into the control array
+SEQ, GENERATION, TICK, HEAD, MASTERS, CURRENT, QUIT, CLOSED = range(8)
+
+
+class SharedPlotState:
+    """The shared segment, as NumPy views; created by the monitor, attached by the renderer"""
+
+    def __init__(self, name=None, capacity=DEFAULT_RING_CAPACITY, create=True):
+        self.capacity = capacity
+        sizes = [8 * 8, 2 * 8, 4 * 8, capacity * RING_DTYPE.itemsize,
+                 MAX_MASTERS * MASTER_DTYPE.itemsize]
+        if create:
+            self.shm = shared_memory.SharedMemory(create=True, size=sum(sizes))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.owner = create
+
+        offsets = np.cumsum([0] + sizes)
+        buf = self.shm.buf
+        self.control = np.ndarray(8, dtype=np.int64, buffer=buf, offset=offsets[0])
+        self.clock = np.ndarray(2, dtype=np.float64, buffer=buf, offset=offsets[1])
+        self.frames = np.ndarray(4, dtype=np.float64, buffer=buf, offset=offsets[2])
+        self.ring = np.ndarray(capacity, dtype=RING_DTYPE, buffer=buf, offset=offsets[3])
+        self.masters = np.ndarray(MAX_MASTERS, dtype=MASTER_DTYPE, buffer=buf, offset=offsets[4])
+        if create:
+            self.control[:] = 0
+            self.control[CURRENT] = -1
+
+        # Writer side: the receive thread appends samples while the main
+        # thread publishes ticks, so the two are serialized locally
+        self._write_lock = threading.Lock()
+        self._clear_slots()
+
+    # ------------------------------------------------------------ writer
+
+    def _begin(self):
+        self.control[SEQ] += 1
+
+    def _end(self):
+        self.control[SEQ] += 1
+
+    def _clear_slots(self):
+        self._slots = {}
+        self._free = list(range(MAX_MASTERS - 1, -1, -1))
+        # key -> slot of departed masters, longest departed first
+        self._departed = {}
+        # Departed masters whose slot was reused: no longer published
+        self._dropped = set()
+
+    def _slot(self, key, label):
+        """Slot of a master, taking a free or departed one for a new key; -1 if none"""
+        slot = self._slots.get(key)
+        if slot is None:
+            if key in self._dropped:
+                return -1
+            if self._free:
+                slot = self._free.pop()
+            elif self._departed:
+                slot = self._reclaim()
+            else:
+                return -1
+            self._slots[key] = slot
+            self.masters[slot] = (str(label).encode('ascii', 'replace')[:16], 0.0, np.nan)
+            self.control[MASTERS] = max(self.control[MASTERS], slot + 1)
+        return slot
+
+    def _reclaim(self):
+        key, slot = next(iter(self._departed.items()))
+        del self._departed[key]
+        del self._slots[key]
+        self._dropped.add(key)
+        ring_slots = self.ring['slot']
+        ring_slots[ring_slots == slot] = -1
+        return slot
+
+    def _returned(self, key):
+        # A live master is never reclaimed, and one that was gets a new slot
+        self._departed.pop(key, None)
+        self._dropped.discard(key)
+
+    def append(self, timestamp, reading, key, label):
+        """Add one MASTER sample to the ring"""
+        with self._write_lock:
+            self._begin()
+            self._returned(key)
+            slot = self._slot(key, label)
+            head = self.control[HEAD]
+            self.ring[head % self.capacity] = (timestamp, reading, slot, 0)
+            self.control[HEAD] = head + 1
+            self._end()
+
+    def publish(self, now, master_totals, current_master, current_start, history_seconds, label):
+        """Publish master totals and the monitor's time; wakes the renderer.
+
+        label(key) gives the text shown for a master the first time it is seen.
+        """
+        with self._write_lock:
+            self._begin()
+            if current_master is not None:
+                self._returned(current_master)
+            for key, seconds in master_totals.items():
+                slot = self._slot(key, label(key))
+                if slot >= 0:
+                    self.masters['seconds'][slot] = seconds
+            self.masters['start'][:] = np.nan
+            slot = -1
+            if current_master is not None:
+                slot = self._slot(current_master, label(current_master))
+                if slot >= 0:
+                    self.masters['start'][slot] = current_start
+            self.control[CURRENT] = slot
+            self.clock[0] = now
+            self.clock[1] = history_seconds
+            self.control[TICK] += 1
+            self._end()
+
+    def remove(self, key):
+        """A master departed: its slot may be reused once no free slot is left"""
+        with self._write_lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                self._departed.pop(key, None)
+                self._departed[key] = slot
+
+    def reset(self):
+        """Forget every sample and master; the renderer clears its artists"""
+        with self._write_lock:
+            self._begin()
+            self._clear_slots()
+            self.masters[:] = (b'', 0.0, np.nan)
+            self.control[MASTERS] = 0
+            self.control[CURRENT] = -1
+            self.control[HEAD] = 0
+            self.control[GENERATION] += 1
+            self._end()
+
+    # ------------------------------------------------------------ reader
+
+    def snapshot(self, retries=100):
+        """Consistent copy of the published state, or None if writers kept racing"""
+        control = self.control
+        for _ in range(retries):
+            seq = int(control[SEQ])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            snap = {
+                'generation': int(control[GENERATION]),
+                'tick': int(control[TICK]),
+                'head': int(control[HEAD]),
+                'current': int(control[CURRENT]),
+                'now': float(self.clock[0]),
+                'masters': self.masters[:int(control[MASTERS])].copy(),
+                'ring': self.ring.copy(),
+            }
+            if int(control[SEQ]) == seq:
+                return snap
+        return None
+
+    # ------------------------------------------------------------ flags
+
+    def request_quit(self):
+        self.control[QUIT] = 1
+
+    def quit_requested(self):
+        return bool(self.control[QUIT])
+
+    def mark_closed(self):
+        self.control[CLOSED] = 1
+
+    def closed(self):
+        return bool(self.control[CLOSED])
+
+    def frame_stats(self):
+        frames, last, mean, peak = self.frames.tolist()
+        return {'frames': int(frames), 'last': last, 'mean': mean, 'max': peak}
+
+    def close(self):
+        # Drop the views before the segment is unmapped
+        self.control = self.clock = self.frames = self.ring = self.masters = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class _SnapshotClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class SharedGraphView:
+    """GraphData look-alike over a snapshot, so PlotRenderer draws it unchanged.
+
+    Masters are keyed by their published label.
+    """
+
+    def __init__(self, history_seconds):
+        self.history_seconds = history_seconds
+        self.clock = _SnapshotClock()
+        self.master_colors = {}
+        # Departure notices and detector events are not published to the
+        # renderer process
+        self.departures = ()
+        self.anomalies = ()
+        self.stuck = ()
+        self._snap = None
+        self._ips = []
+
+    def update(self, snap):
+        self._snap = snap
+        self.clock.now = snap['now']
+        self._ips = [ip.decode('ascii', 'replace') for ip in snap['masters']['ip']]
+        self.master_colors = {ip: COLOR_LIST[i % len(COLOR_LIST)] for i, ip in enumerate(self._ips)}
+
+    def label(self, key):
+        return key
+
+    def get_master_durations(self, current_time):
+        snap = self._snap
+        if snap is None:
+            return {}
+        durations = dict(zip(self._ips, snap['masters']['seconds'].tolist()))
+        current = snap['current']
+        if 0 <= current < len(self._ips):
+            start = snap['masters']['start'][current]
+            if not np.isnan(start):
+                durations[self._ips[current]] += current_time - start
+        return durations
+
+    def trace(self, current_time):
+        snap = self._snap
+        if snap is None or snap['head'] == 0:
+            return np.empty(0), np.empty(0, dtype=np.int16), []
+        ring = snap['ring']
+        count = min(snap['head'], len(ring))
+        # Oldest first: the ring is full from head onwards once it has wrapped
+        ring = np.roll(ring, -(snap['head'] % len(ring)))[-count:]
+        ring = ring[ring['ts'] >= current_time - self.history_seconds]
+        ring = ring[np.argsort(ring['ts'], kind='stable')]
+        colors = [COLOR_LIST[slot % len(COLOR_LIST)] if slot >= 0 else NO_SLOT_COLOR
+                  for slot in ring['slot'].tolist()]
+        return ring['ts'], ring['reading'], colors
+
+
+def render_main(name, capacity, backend, history_seconds, render_cost=0.0, niceness=10):
+    """Renderer process entry point: draw whenever the monitor publishes a tick"""
+    try:
+        # Capture matters more than drawing when the CPU is contended
+        os.nice(niceness)
+    except OSError:
+        pass
+    import matplotlib
+    matplotlib.use(backend)
+    import matplotlib.pyplot as plt
+    from renderer import PlotRenderer
+
+    parent = os.getppid()
+    shared = SharedPlotState(name, capacity, create=False)
+    view = SharedGraphView(history_seconds)
+    renderer = PlotRenderer(view, render_cost=render_cost)
+    interactive = backend.lower() != 'agg'
+    if interactive:
+        def on_key_press(event):
+            if event.key == 'q':
+                shared.request_quit()
+        renderer.canvas.mpl_connect('key_press_event', on_key_press)
+        manager = plt.get_current_fig_manager()
+        manager.window.wm_geometry("+0+0")
+        plt.show(block=False)
+
+    generation = 0
+    last_tick = 0
+    try:
+        while not shared.closed() and os.getppid() == parent:
+            snap = shared.snapshot()
+            if snap is not None and snap['tick'] != last_tick:
+                if snap['generation'] != generation:
+                    generation = snap['generation']
+                    renderer.reset()
+                last_tick = snap['tick']
+                view.update(snap)
+                renderer.render()
+                stats = renderer.frame_stats()
+                shared.frames[:] = (stats['frames'], stats['last'], stats['mean'], stats['max'])
+            if interactive:
+                plt.pause(0.01)
+            else:
+                time.sleep(0.01)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        plt.close('all')
+        shared.close()
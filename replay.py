@@ -0,0 +1,292 @@
+"""Replay recorded sessions through the LightSwarm pipeline.
+
+Reads a text session log, a binary .lsb log or a libpcap capture and feeds
+every packet back through LightSwarm.handle_message (handle_datagram for
+binary batch frames in captures), with a VirtualClock
+standing in for time.time() so master durations, log timestamps and GUI
+refreshes (LightSwarm.tick) follow the recording exactly. RESET and ACTIVATE
+broadcasts in a capture are applied as the button would have: a reset starts
+a new log file and clears the plots, so the summary covers the masters since
+the last one. Logs record no control messages and replay as one session:
+
+    python3 replay.py lightswarm_20240118_123456.log --speed 10
+    python3 replay.py capture.pcap --speed 0 --display agg --json run.json
+
+--speed 1 is real time, N is N times faster and 0 runs as fast as possible.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from backends import SimulatedGPIO, VirtualClock, create_display
+from controller import RESET_INDICATOR_SECONDS
+from binlog import BinaryLog, MAGIC, int_to_ip, parse_text_line
+from protocol import BINARY_MAGIC
+from state import Activate, Reset, master_durations
+
+UDP_PORT = 2910
+
+
+def read_text_log(path):
+    """Yield (timestamp, message, ip) from a text session log (MASTER lines)"""
+    with open(path) as f:
+        for line in f:
+            parsed = parse_text_line(line)
+            if parsed is not None:
+                ts, device_id, ip_addr, reading = parsed
+                yield ts, f"MASTER:{device_id}:{reading}", ip_addr
+
+
+def read_binary_log(path):
+    """Yield (timestamp, message, ip) from a binary session log"""
+    log = BinaryLog(path)
+    data = log.query()
+    for ts, device_id, ip_value, reading, master in zip(
+            data['ts'].tolist(), data['device_id'].tolist(), data['ip'].tolist(),
+            data['reading'].tolist(), data['master'].tolist()):
+        kind = 'MASTER' if master else 'LIGHT'
+        yield ts, f"{kind}:{device_id}:{reading}", int_to_ip(ip_value)
+    log.close()
+
+
+# Link-layer header lengths and where the EtherType lives, per pcap linktype
+_LINKTYPES = {
+    1: (14, 12),     # Ethernet
+    113: (16, 14),   # Linux cooked capture (SLL)
+    276: (20, 0),    # Linux cooked capture v2 (SLL2)
+    101: (0, None),  # Raw IP
+    12: (0, None),   # Raw IP (OpenBSD numbering)
+}
+
+
+def read_pcap(path, port=UDP_PORT):
+    """Yield (timestamp, message, ip) for UDP datagrams to port in a pcap file"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            return
+        magic = header[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            endian = '>'
+        else:
+            raise ValueError(f"{path}: not a libpcap file (pcapng is not supported)")
+        ts_divisor = 1e9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e6
+        linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0FFFFFFF
+        if linktype not in _LINKTYPES:
+            raise ValueError(f"{path}: unsupported link type {linktype}")
+        link_len, ethertype_at = _LINKTYPES[linktype]
+        record_header = struct.Struct(endian + 'IIII')
+
+        while True:
+            rec = f.read(record_header.size)
+            if len(rec) < record_header.size:
+                break
+            ts_sec, ts_frac, incl_len, _ = record_header.unpack(rec)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                break
+
+            offset = link_len
+            if ethertype_at is not None:
+                ethertype = struct.unpack_from('!H', frame, ethertype_at)[0]
+                if linktype == 1 and ethertype == 0x8100:
+                    # 802.1Q VLAN tag
+                    ethertype = struct.unpack_from('!H', frame, 16)[0]
+                    offset += 4
+                if ethertype != 0x0800:
+                    continue
+            if len(frame) < offset + 28 or frame[offset] >> 4 != 4:
+                continue
+            ihl = (frame[offset] & 0x0F) * 4
+            if frame[offset + 9] != 17:  # UDP
+                continue
+            src_ip = '.'.join(str(b) for b in frame[offset + 12:offset + 16])
+            udp = offset + ihl
+            dport, length = struct.unpack_from('!HH', frame, udp + 2)
+            if dport != port:
+                continue
+            payload = frame[udp + 8:udp + length]
+            if payload[:1] == bytes([BINARY_MAGIC]):
+                # Binary batch frames are handed over undecoded
+                yield ts_sec + ts_frac / ts_divisor, payload, src_ip
+                continue
+            try:
+                message = payload.decode('ascii')
+            except UnicodeDecodeError:
+                continue
+            yield ts_sec + ts_frac / ts_divisor, message, src_ip
+
+
+def open_recording(path, port=UDP_PORT):
+    """Pick a reader from the file's magic bytes"""
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    if head == MAGIC:
+        return read_binary_log(path)
+    if head[:4] in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+        return read_pcap(path, port)
+    return read_text_log(path)
+
+
+class ReplayEngine:
+    """Feeds recorded packets into a LightSwarm driven by a VirtualClock"""
+
+    def __init__(self, swarm, clock, speed=1.0):
+        self.swarm = swarm
+        self.clock = clock
+        self.speed = speed
+        self.events = 0
+        self.ticks = 0
+        self.resets = 0
+
+    def run(self, events):
+        swarm = self.swarm
+        interval = swarm.refresh_interval
+        next_tick = None
+        wall_start = time.perf_counter()
+        first_ts = None
+
+        for ts, message, ip_addr in events:
+            if first_ts is None:
+                first_ts = ts
+                next_tick = ts + interval
+                self.clock.advance_to(ts)
+
+            # GUI refreshes that fall before this packet
+            while next_tick <= ts:
+                self._advance(next_tick, first_ts, wall_start)
+                swarm.tick(next_tick)
+                self.ticks += 1
+                next_tick += interval
+
+            self._advance(ts, first_ts, wall_start)
+            if isinstance(message, bytes):
+                swarm.handle_datagram(message, (ip_addr, UDP_PORT))
+                self.events += 1
+                continue
+            if message == 'RESET':
+                # What the reset button does, minus the broadcast itself
+                swarm.handle_control(Reset(ts))
+                self.clock.call_later(RESET_INDICATOR_SECONDS, swarm.finish_reset)
+                self.resets += 1
+                continue
+            if message == 'ACTIVATE':
+                swarm.finish_reset()
+                swarm.handle_control(Activate(ts))
+                continue
+            swarm.handle_message(message, (ip_addr, UDP_PORT))
+            self.events += 1
+
+        if next_tick is not None:
+            # One last refresh so the final master's run is accounted for
+            self._advance(next_tick, first_ts, wall_start)
+            swarm.tick(next_tick)
+            self.ticks += 1
+        return time.perf_counter() - wall_start
+
+    def _advance(self, ts, first_ts, wall_start):
+        if self.speed > 0:
+            due = (ts - first_ts) / self.speed
+            delay = due - (time.perf_counter() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        self.clock.advance_to(ts)
+
+
+def replay(path, speed=1.0, display='none', log_dir=None, refresh=1.0, port=UDP_PORT, ttl=0,
+           db_path=None):
+    """Replay a recording and return a summary of what the pipeline produced.
+
+    Device eviction is off by default (ttl=0) so the summary covers every
+    master in the recording. With db_path the replayed session is added to
+    that session database, which is how old logs are imported.
+    """
+    from RaspberryPi import LightSwarm
+
+    events = open_recording(path, port)
+    # Start the virtual clock at the first packet so log names match the session
+    events = iter(events)
+    first = next(events, None)
+    if first is None:
+        raise ValueError(f"{path}: no packets to replay")
+    clock = VirtualClock(first[0])
+    log_dir = log_dir or tempfile.mkdtemp(prefix='lightswarm_replay_')
+
+    swarm = LightSwarm(gpio=SimulatedGPIO(), display=create_display(display, clock),
+                       clock=clock, refresh_interval=refresh, log_dir=log_dir, listen=False,
+                       device_ttl=ttl, db_path=db_path)
+    engine = ReplayEngine(swarm, clock, speed)
+
+    def all_events():
+        yield first
+        yield from events
+
+    try:
+        wall = engine.run(all_events())
+        swarm.log_writer.flush()
+        end = clock.time()
+        result = {
+            'recording': os.path.abspath(path),
+            'packets': engine.events,
+            'resets': engine.resets,
+            'ticks': engine.ticks,
+            'virtual_seconds': end - first[0],
+            'wall_seconds': wall,
+            'packets_per_second': engine.events / wall if wall else 0.0,
+            'master_durations': {f"{swarm.graph_data.label(device_id)} ({device_id})": round(seconds, 3)
+                                 for device_id, seconds in
+                                 master_durations(swarm.state.snapshot, end).items()},
+            'frames': swarm.display.frame_stats(),
+            'logfile': swarm.current_logfile,
+        }
+    finally:
+        swarm.running = False
+        clock.stop()
+        swarm.cleanup()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replay a LightSwarm recording',
+        epilog='RESET/ACTIVATE broadcasts in a pcap are applied, so master durations '
+               'cover the session after the last reset; text and binary logs hold '
+               'no control messages.')
+    parser.add_argument('recording', help='text log, binary .lsb log or pcap capture')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='1 = real time, N = N x faster, 0 = as fast as possible')
+    parser.add_argument('--display', choices=['none', 'agg', 'tk'], default='none')
+    parser.add_argument('--refresh', type=float, default=1.0)
+    parser.add_argument('--port', type=int, default=UDP_PORT, help='UDP port to pick from pcaps')
+    parser.add_argument('--log-dir', help='where the replayed session log goes')
+    parser.add_argument('--ttl', type=float, default=0,
+                        help='drop devices silent this many seconds (0 = never)')
+    parser.add_argument('--db', help='add the replayed session to this SQLite database')
+    parser.add_argument('--json', help='also write the summary to this file')
+    args = parser.parse_args(argv)
+
+    result = replay(args.recording, args.speed, args.display, args.log_dir,
+                    args.refresh, args.port, args.ttl, args.db)
+    print(f"\nReplayed {result['packets']} packets "
+          f"({result['virtual_seconds']:.1f} s of session) in {result['wall_seconds']:.2f} s, "
+          f"{result['packets_per_second']:.0f} packets/s")
+    if result['resets']:
+        print(f"{result['resets']} resets replayed; durations cover the last session")
+    print("Master durations:")
+    for ip, seconds in result['master_durations'].items():
+        print(f"  {ip}: {seconds:.2f} s")
+    print(f"Log written to {result['logfile']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Incremental multi-resolution rollups of readings and master time"""
+import threading
+
+import numpy as np
+
+# (bucket seconds, number of buckets): 1 hour of 1s, 1 day of 1min, 30 days of 1h
+DEFAULT_RESOLUTIONS = ((1, 3600), (60, 1440), (3600, 720))
+# Master time between two MASTER packets is only credited up to this gap;
+# a longer silence means the master went away (ESP MASTER_TIMEOUT is 3s)
+MAX_MASTER_GAP = 3.0
+INITIAL_DEVICES = 8
+
+
+class _Level:
+    """Ring of buckets at one resolution, one row per device"""
+
+    def __init__(self, seconds, slots, n_rows):
+        self.seconds = seconds
+        self.slots = slots
+        self._allocate(n_rows)
+
+    def _allocate(self, n_rows):
+        shape = (n_rows, self.slots)
+        self.epoch = np.full(shape, -1, dtype=np.int64)   # absolute bucket number
+        self.min = np.zeros(shape, dtype=np.int16)
+        self.max = np.zeros(shape, dtype=np.int16)
+        self.sum = np.zeros(shape, dtype=np.float64)
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.master = np.zeros(shape, dtype=np.float64)
+
+    def grow(self, n_rows):
+        old = (self.epoch, self.min, self.max, self.sum, self.count, self.master)
+        self._allocate(n_rows)
+        for new, prev in zip((self.epoch, self.min, self.max, self.sum, self.count, self.master), old):
+            new[:len(prev)] = prev
+
+    def _slot(self, row, bucket):
+        slot = bucket % self.slots
+        if self.epoch[row, slot] != bucket:
+            # Slot still holds an older bucket: recycle it
+            self.epoch[row, slot] = bucket
+            self.min[row, slot] = 0
+            self.max[row, slot] = 0
+            self.sum[row, slot] = 0.0
+            self.count[row, slot] = 0
+            self.master[row, slot] = 0.0
+        return slot
+
+    def add_reading(self, row, timestamp, reading):
+        slot = self._slot(row, int(timestamp // self.seconds))
+        if self.count[row, slot] == 0:
+            self.min[row, slot] = reading
+            self.max[row, slot] = reading
+        else:
+            if reading < self.min[row, slot]:
+                self.min[row, slot] = reading
+            if reading > self.max[row, slot]:
+                self.max[row, slot] = reading
+        self.sum[row, slot] += reading
+        self.count[row, slot] += 1
+
+    def add_master(self, row, start, end):
+        # Split the interval at bucket boundaries
+        while start < end:
+            bucket = int(start // self.seconds)
+            stop = min(end, (bucket + 1) * self.seconds)
+            slot = self._slot(row, bucket)
+            self.master[row, slot] += stop - start
+            start = stop
+
+    def clear(self, row):
+        self.epoch[row] = -1
+        for arr in (self.min, self.max, self.sum, self.count, self.master):
+            arr[row] = 0
+
+    def span(self):
+        return self.seconds * self.slots
+
+
+class RollupEngine:
+    """Per-device reading min/max/mean/count and master seconds at several
+    resolutions.
+
+    Every packet updates one bucket per resolution in O(1); each resolution is
+    a fixed ring, so memory is devices x sum(slots) however long the monitor
+    runs. Master time is the interval between consecutive MASTER packets,
+    credited to the device that sent the earlier one.
+
+    A departed device (release()) keeps its row, and so its history, until
+    the longest ring has rotated past its last bucket; a new device then
+    takes the row over. Memory follows the devices seen within that span
+    (30 days by default) rather than every device ever seen.
+    """
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS, max_master_gap=MAX_MASTER_GAP):
+        self.max_master_gap = max_master_gap
+        self.rows = {}
+        self._lock = threading.Lock()
+        self._n_rows = INITIAL_DEVICES
+        self.levels = [_Level(seconds, slots, self._n_rows) for seconds, slots in resolutions]
+        self.retention = max(level.span() for level in self.levels)
+        # device_id -> departure time, oldest departure first
+        self._departed = {}
+        self._master = None
+        self._master_since = None
+
+    def _row_for(self, device_id, timestamp):
+        row = self.rows.get(device_id)
+        if row is None:
+            with self._lock:
+                row = self._reclaim(timestamp)
+                if row is None:
+                    if len(self.rows) >= self._n_rows:
+                        self._n_rows *= 2
+                        for level in self.levels:
+                            level.grow(self._n_rows)
+                    row = len(self.rows)
+                self.rows[device_id] = row
+        elif self._departed:
+            # Back before its row was reclaimed
+            self._departed.pop(device_id, None)
+        return row
+
+    def _reclaim(self, timestamp):
+        """Row of the longest-departed device once its history has aged out, or None"""
+        if not self._departed:
+            return None
+        device_id, departed_at = next(iter(self._departed.items()))
+        if timestamp - departed_at < self.retention:
+            return None
+        del self._departed[device_id]
+        row = self.rows.pop(device_id)
+        for level in self.levels:
+            level.clear(row)
+        if self._master == device_id:
+            self._master = None
+            self._master_since = None
+        return row
+
+    def release(self, device_id, timestamp):
+        """A device departed; its row can be reused once its history is out of range"""
+        if device_id in self.rows:
+            self._departed.pop(device_id, None)
+            self._departed[device_id] = timestamp
+
+    def add(self, device_id, reading, timestamp, is_master=False):
+        """Fold one packet into every resolution"""
+        row = self._row_for(device_id, timestamp)
+        for level in self.levels:
+            level.add_reading(row, timestamp, reading)
+        if is_master:
+            self._credit_master(timestamp)
+            self._master = device_id
+            if self._master_since is None or timestamp > self._master_since:
+                # Never back: time before _master_since is already credited
+                self._master_since = timestamp
+
+    def _credit_master(self, timestamp):
+        if self._master is None or timestamp <= self._master_since:
+            return
+        end = min(timestamp, self._master_since + self.max_master_gap)
+        row = self.rows[self._master]
+        for level in self.levels:
+            level.add_master(row, self._master_since, end)
+
+    def end_master(self, timestamp):
+        """Credit the current master up to timestamp and stop (e.g. on reset)"""
+        self._credit_master(timestamp)
+        self._master = None
+        self._master_since = None
+
+    def _level_for(self, seconds_back, resolution=None):
+        if resolution is not None:
+            for level in self.levels:
+                if level.seconds == resolution:
+                    return level
+            raise ValueError(f"no {resolution}s resolution configured")
+        # Finest resolution that still covers the requested range
+        for level in self.levels:
+            if level.span() >= seconds_back:
+                return level
+        return self.levels[-1]
+
+    def _range_mask(self, level, start, end):
+        starts = level.epoch * level.seconds
+        return (level.epoch >= 0) & (starts + level.seconds > start) & (starts < end), starts
+
+    def master_time(self, start, end, resolution=None):
+        """Seconds spent as master per device between start and end.
+
+        Buckets that only partly overlap the range are counted whole, so the
+        answer is accurate to one bucket of the chosen resolution.
+        """
+        level = self._level_for(end - start, resolution)
+        mask, _ = self._range_mask(level, start, end)
+        rows = len(self.rows)
+        totals = np.where(mask, level.master, 0.0)[:rows].sum(axis=1)
+        return {device_id: float(totals[row]) for device_id, row in self.rows.items()
+                if totals[row] > 0}
+
+    def series(self, device_id, start, end, resolution=None):
+        """Bucketed history of one device, oldest first.
+
+        Returns a dict of arrays: 'start', 'min', 'max', 'mean', 'count' and
+        'master_seconds', one entry per non-empty bucket.
+        """
+        level = self._level_for(end - start, resolution)
+        row = self.rows.get(device_id)
+        if row is None:
+            empty = np.empty(0)
+            return {'start': empty, 'min': empty, 'max': empty, 'mean': empty,
+                    'count': empty, 'master_seconds': empty, 'resolution': level.seconds}
+        mask, starts = self._range_mask(level, start, end)
+        mask = mask[row] & ((level.count[row] > 0) | (level.master[row] > 0))
+        order = np.argsort(starts[row][mask])
+        count = level.count[row][mask][order]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = level.sum[row][mask][order] / count
+        return {
+            'start': starts[row][mask][order],
+            'min': level.min[row][mask][order],
+            'max': level.max[row][mask][order],
+            'mean': mean,
+            'count': count,
+            'master_seconds': level.master[row][mask][order],
+            'resolution': level.seconds,
+        }
+
+    def memory_bytes(self):
+        return sum(arr.nbytes for level in self.levels
+                   for arr in (level.epoch, level.min, level.max, level.sum,
+                               level.count, level.master))
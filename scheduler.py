@@ -0,0 +1,88 @@
+"""Single-threaded timer scheduler for LED blinking and other timed work"""
+import heapq
+import threading
+import time
+
+
+class Timer:
+    """Handle for a scheduled callback"""
+
+    __slots__ = ('due', 'callback', 'cancelled')
+
+    def __init__(self, due, callback):
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """Runs timed callbacks from one thread, earliest first.
+
+    Timers live in a heap keyed on their due time; the thread sleeps on a
+    condition until the earliest one is due or an earlier one is added, so
+    any number of timers costs one thread and no polling. Cancelled timers
+    are dropped lazily when they reach the top of the heap. Callbacks run
+    on the scheduler thread and must not block.
+    """
+
+    def __init__(self, name='scheduler', timefunc=time.monotonic):
+        self.name = name
+        self.timefunc = timefunc
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def call_at(self, due, callback):
+        """Run callback at timefunc() == due; returns a Timer"""
+        timer = Timer(due, callback)
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (due, self._seq, timer))
+            if self._heap[0][2] is timer:
+                # New earliest timer: wake the thread to shorten its wait
+                self._cond.notify()
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self._thread.start()
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(self.timefunc() + delay, callback)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, _, timer = self._heap[0]
+                    if timer.cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    delay = due - self.timefunc()
+                    if delay <= 0:
+                        heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(delay)
+                else:
+                    return
+            try:
+                timer.callback()
+            except Exception as e:
+                print(f"Error in scheduled callback: {e}")
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._heap.clear()
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
@@ -0,0 +1,336 @@
+"""SQLite session store: every session's readings and master changes in one file.
+
+Written from the LogWriter thread (see logwriter.py): each batch of queued
+readings goes in as one transaction, so the monitor pays one commit per
+flush rather than per packet. The database runs in WAL mode, so queries
+from another process read a consistent view while the monitor writes.
+
+Besides the raw rows, each batch updates two small rollup tables - per
+device per hour (count, sum, sum of squares, min, max) and a per device per
+day histogram of readings - so aggregate questions over months of data
+read thousands of rows, not hundreds of millions:
+
+    python3 sessiondb.py lightswarm.db sessions
+    python3 sessiondb.py lightswarm.db master-time --since 7d
+    python3 sessiondb.py lightswarm.db readings --since 2024-01-01 --device 1042
+"""
+import argparse
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+HOUR = 3600
+DAY = 86400
+HIST_BUCKET = 32      # reading range per histogram bucket
+HIST_BUCKETS = 32     # 0..1023
+# Open-ended ranges stop here (year 36812)
+MAX_TIME = 2.0 ** 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    log_file TEXT,
+    started REAL,
+    ended REAL,
+    readings INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS readings (
+    session INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    device_id INTEGER NOT NULL,
+    addr TEXT,
+    reading INTEGER NOT NULL,
+    master INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS readings_device_ts ON readings (device_id, ts);
+CREATE INDEX IF NOT EXISTS readings_session ON readings (session);
+-- One row each time the master changes; device_id is NULL when the swarm
+-- is left without one (master departed, reset, activate)
+CREATE TABLE IF NOT EXISTS master_changes (
+    session INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    device_id INTEGER,
+    addr TEXT
+);
+CREATE INDEX IF NOT EXISTS master_changes_session_ts ON master_changes (session, ts);
+CREATE TABLE IF NOT EXISTS device_hours (
+    device_id INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    total_sq INTEGER NOT NULL,
+    lo INTEGER NOT NULL,
+    hi INTEGER NOT NULL,
+    master_n INTEGER NOT NULL,
+    PRIMARY KEY (device_id, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reading_hist (
+    device_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (device_id, day, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_ended ON sessions (ended);
+"""
+
+_UPSERT_HOURS = """
+INSERT INTO device_hours VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (device_id, hour) DO UPDATE SET
+    n = n + excluded.n, total = total + excluded.total,
+    total_sq = total_sq + excluded.total_sq,
+    lo = MIN(lo, excluded.lo), hi = MAX(hi, excluded.hi),
+    master_n = master_n + excluded.master_n
+"""
+
+_UPSERT_HIST = """
+INSERT INTO reading_hist VALUES (?, ?, ?, ?)
+ON CONFLICT (device_id, day, bucket) DO UPDATE SET n = n + excluded.n
+"""
+
+# Master runs: from each change to the next one in the same session, or to
+# the end of the session; clipped to [since, until)
+_MASTER_TIME = """
+WITH runs AS (
+    SELECT c.device_id, c.addr, c.ts AS start,
+           COALESCE(LEAD(c.ts) OVER (PARTITION BY c.session ORDER BY c.ts), s.ended) AS stop
+    FROM master_changes c JOIN sessions s ON s.id = c.session
+    WHERE c.session IN (SELECT id FROM sessions WHERE ended >= :since AND started < :until)
+)
+SELECT addr, device_id, SUM(MIN(stop, :until) - MAX(start, :since)) AS seconds, COUNT(*) AS runs
+FROM runs
+WHERE device_id IS NOT NULL AND stop > :since AND start < :until
+GROUP BY addr, device_id
+ORDER BY seconds DESC
+"""
+
+
+class SessionDB:
+    """One SQLite database of sessions; a connection belongs to the thread that opened it"""
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            # WAL with NORMAL sync loses at most the last commits on power loss,
+            # never consistency
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript(SCHEMA)
+        self.session = None
+        self._started = None
+        self._ended = None
+
+    # ------------------------------------------------------------ writing
+
+    def start_session(self, log_file=None):
+        with self.conn:
+            self.session = self.conn.execute(
+                'INSERT INTO sessions (log_file) VALUES (?)', (log_file,)).lastrowid
+        self._started = None
+        self._ended = None
+        return self.session
+
+    def write(self, records, changes=()):
+        """Insert LogWriter record tuples and (ts, device_id, addr) master changes.
+
+        Everything, rollups and the session's time span included, commits
+        as one transaction.
+        """
+        if not records and not changes:
+            return
+        if self.session is None:
+            self.start_session()
+        session = self.session
+
+        hours = {}
+        hist = {}
+        first = self._started
+        last = self._ended
+        rows = []
+        for ts, device_id, addr, reading, _, is_master in records:
+            rows.append((session, ts, device_id, addr, reading, 1 if is_master else 0))
+            key = (device_id, int(ts // HOUR))
+            agg = hours.get(key)
+            if agg is None:
+                hours[key] = [1, reading, reading * reading, reading, reading, int(is_master)]
+            else:
+                agg[0] += 1
+                agg[1] += reading
+                agg[2] += reading * reading
+                if reading < agg[3]:
+                    agg[3] = reading
+                if reading > agg[4]:
+                    agg[4] = reading
+                agg[5] += is_master
+            key = (device_id, int(ts // DAY), min(HIST_BUCKETS - 1, max(0, reading // HIST_BUCKET)))
+            hist[key] = hist.get(key, 0) + 1
+            if first is None or ts < first:
+                first = ts
+            if last is None or ts > last:
+                last = ts
+        for ts, _, _ in changes:
+            if first is None or ts < first:
+                first = ts
+            if last is None or ts > last:
+                last = ts
+
+        with self.conn:
+            self.conn.executemany('INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.conn.executemany('INSERT INTO master_changes VALUES (?, ?, ?, ?)',
+                                  [(session, ts, device_id, addr)
+                                   for ts, device_id, addr in changes])
+            self.conn.executemany(_UPSERT_HOURS, [key + tuple(agg) for key, agg in hours.items()])
+            self.conn.executemany(_UPSERT_HIST, [key + (n,) for key, n in hist.items()])
+            self.conn.execute('UPDATE sessions SET started = ?, ended = ?, '
+                              'readings = readings + ? WHERE id = ?',
+                              (first, last, len(rows), session))
+        self._started = first
+        self._ended = last
+
+    def close(self):
+        self.conn.close()
+
+    # ------------------------------------------------------------ queries
+
+    def sessions(self, since=None, until=None):
+        """(id, log_file, started, ended, readings) for sessions overlapping the range"""
+        since, until = _range(since, until)
+        return self.conn.execute(
+            'SELECT id, log_file, started, ended, readings FROM sessions '
+            'WHERE ended >= ? AND started < ? ORDER BY started, id',
+            (since, until)).fetchall()
+
+    def master_time(self, since=None, until=None):
+        """(addr, device_id, seconds, runs) as master within the range, most first"""
+        since, until = _range(since, until)
+        return self.conn.execute(_MASTER_TIME, {'since': since, 'until': until}).fetchall()
+
+    def reading_stats(self, since=None, until=None, device_id=None):
+        """{device_id: (count, mean, std, min, max, master count)}, hour resolution"""
+        since, until = _range(since, until)
+        sql = ('SELECT device_id, SUM(n), SUM(total), SUM(total_sq), MIN(lo), MAX(hi), '
+               'SUM(master_n) FROM device_hours WHERE hour >= ? AND hour < ?')
+        args = [int(since // HOUR), int(-(-until // HOUR))]
+        if device_id is not None:
+            sql += ' AND device_id = ?'
+            args.append(device_id)
+        stats = {}
+        for device, n, total, total_sq, lo, hi, master_n in self.conn.execute(
+                sql + ' GROUP BY device_id ORDER BY device_id', args):
+            mean = total / n
+            std = max(0.0, total_sq / n - mean * mean) ** 0.5
+            stats[device] = (n, mean, std, lo, hi, master_n)
+        return stats
+
+    def reading_histogram(self, since=None, until=None, device_id=None):
+        """{device_id: [count per HIST_BUCKET-wide bucket]}, day resolution"""
+        since, until = _range(since, until)
+        sql = ('SELECT device_id, bucket, SUM(n) FROM reading_hist '
+               'WHERE day >= ? AND day < ?')
+        args = [int(since // DAY), int(-(-until // DAY))]
+        if device_id is not None:
+            sql += ' AND device_id = ?'
+            args.append(device_id)
+        hist = {}
+        for device, bucket, n in self.conn.execute(sql + ' GROUP BY device_id, bucket', args):
+            hist.setdefault(device, [0] * HIST_BUCKETS)[bucket] = n
+        return hist
+
+
+def _range(since, until):
+    return (since if since is not None else 0.0,
+            until if until is not None else MAX_TIME)
+
+
+def histogram_percentile(counts, fraction, lo=None, hi=None):
+    """Reading at which the cumulative count passes fraction.
+
+    Readings are taken as spread evenly across the bucket the fraction
+    falls in; lo and hi, the recorded min and max, bound the answer.
+    """
+    target = fraction * sum(counts)
+    cumulative = 0
+    for bucket, n in enumerate(counts):
+        if n and cumulative + n >= target:
+            value = bucket * HIST_BUCKET + (target - cumulative) / n * HIST_BUCKET
+            if lo is not None:
+                value = max(value, lo)
+            if hi is not None:
+                value = min(value, hi)
+            return int(round(value))
+        cumulative += n
+    return None
+
+
+def parse_time(text, now=None):
+    """Epoch seconds, 'YYYY-mm-dd[ HH:MM:SS]' or a span back from now ('90m', '24h', '7d')"""
+    if text is None:
+        return None
+    units = {'s': 1, 'm': 60, 'h': HOUR, 'd': DAY, 'w': 7 * DAY}
+    if text[-1:] in units and text[:-1].replace('.', '', 1).isdigit():
+        return (now if now is not None else time.time()) - float(text[:-1]) * units[text[-1]]
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"cannot parse time {text!r}")
+
+
+def _stamp(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S') if ts is not None else '-'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query the LightSwarm session database')
+    parser.add_argument('database')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, text in [('sessions', 'list sessions'),
+                       ('master-time', 'total master time per IP'),
+                       ('readings', 'reading distribution per device')]:
+        p = sub.add_parser(name, help=text)
+        p.add_argument('--since', help="epoch seconds, 'YYYY-mm-dd[ HH:MM:SS]' or e.g. 7d, 24h")
+        p.add_argument('--until')
+        if name == 'readings':
+            p.add_argument('--device', type=int)
+    args = parser.parse_args(argv)
+
+    db = SessionDB(args.database, readonly=True)
+    since, until = parse_time(args.since), parse_time(args.until)
+    start = time.perf_counter()
+    if args.command == 'sessions':
+        rows = db.sessions(since, until)
+        elapsed = time.perf_counter() - start
+        for session, log_file, started, ended, readings in rows:
+            print(f"{session:5d}  {_stamp(started)} .. {_stamp(ended)}  "
+                  f"{readings:9d} readings  {log_file or ''}")
+    elif args.command == 'master-time':
+        rows = db.master_time(since, until)
+        elapsed = time.perf_counter() - start
+        for addr, device_id, seconds, runs in rows:
+            print(f"IP: {addr}, Device: {device_id}, Total Time: {seconds:.2f} seconds "
+                  f"({runs} runs)")
+    else:
+        stats = db.reading_stats(since, until, args.device)
+        hist = db.reading_histogram(since, until, args.device)
+        elapsed = time.perf_counter() - start
+        for device_id, (n, mean, std, lo, hi, master_n) in stats.items():
+            counts = hist.get(device_id, [])
+            p10, p50, p90 = (histogram_percentile(counts, f, lo, hi) for f in (0.1, 0.5, 0.9))
+            print(f"Device {device_id}: {n} readings ({master_n} as master), mean {mean:.1f}, "
+                  f"std {std:.1f}, min {lo}, max {hi}, p10/p50/p90 ~{p10}/{p50}/{p90}")
+    print(f"({elapsed * 1000:.1f} ms)")
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""Run several independent swarms from one host, one worker process per swarm.
+
+Each swarm (a lab, a floor) has its own UDP port and broadcast address.
+Every worker process runs a complete headless LightSwarm for its swarm, so
+master tracking, LED assignments and logs stay separate and each swarm's
+ingest gets its own interpreter and GIL, on its own core when there are
+enough. The parent process only aggregates: it prints a status line per
+swarm, serves every worker's metrics on one /metrics endpoint with a
+swarm="<name>" label, and lists each swarm's dashboard.
+
+    python3 sharded.py --swarm lab1:2910:192.168.1.255 \\
+                       --swarm lab2:2911:192.168.2.255:leds=5,6,13:button=19 \\
+                       --metrics-port 9100 --dashboard-base 8080
+
+A swarm is name:port[:broadcast][:key=value...] with keys leds (pins in
+assignment order, the last one doubling as the reset indicator), button,
+command_port and ttl. The first swarm gets the default pins and reset
+button unless given its own; the others get no LEDs and no button unless
+configured, so no two processes drive the same pin.
+
+Sockets are per port rather than SO_REUSEPORT on a shared one: the kernel
+would spread one swarm's packets across processes, and master tracking
+needs every packet of a swarm in one place.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from queue import Empty, Full
+
+from metrics import MetricsServer, merge_families, render_families
+
+SwarmConfig = namedtuple('SwarmConfig', ['name', 'port', 'broadcast_ip', 'command_port',
+                                         'led_pins', 'reset_pin', 'ttl'])
+
+# Worker -> parent status, sent once per refresh
+SwarmStatus = namedtuple('SwarmStatus', ['name', 'pid', 'time', 'active', 'devices', 'master',
+                                         'master_addr', 'master_reading', 'totals',
+                                         'readings', 'dropped', 'metrics', 'dashboard_port'])
+
+STATUS_QUEUE_SIZE = 1000
+
+
+def parse_swarm(text, first=False):
+    """Parse a name:port[:broadcast][:key=value...] swarm spec into a SwarmConfig"""
+    from RaspberryPi import BROADCAST_IP, LED_PINS, RESET_BUTTON
+    from state import DEFAULT_TTL
+
+    parts = text.split(':')
+    if len(parts) < 2 or not parts[0]:
+        raise ValueError(f"swarm {text!r}: expected name:port[:broadcast][:key=value...]")
+    positional = [p for p in parts if '=' not in p]
+    options = dict(p.split('=', 1) for p in parts if '=' in p)
+    unknown = set(options) - {'leds', 'button', 'command_port', 'ttl'}
+    if unknown:
+        raise ValueError(f"swarm {text!r}: unknown option(s) {', '.join(sorted(unknown))}")
+
+    if 'leds' in options:
+        led_pins = tuple(int(pin) for pin in options['leds'].split(',') if pin)
+    else:
+        led_pins = LED_PINS if first else ()
+    if 'button' in options:
+        reset_pin = int(options['button']) if options['button'] else None
+    else:
+        reset_pin = RESET_BUTTON if first else None
+    return SwarmConfig(name=positional[0],
+                       port=int(positional[1]),
+                       broadcast_ip=positional[2] if len(positional) > 2 else BROADCAST_IP,
+                       command_port=int(options['command_port']) if 'command_port' in options else None,
+                       led_pins=led_pins,
+                       reset_pin=reset_pin,
+                       ttl=float(options.get('ttl', DEFAULT_TTL)))
+
+
+def worker_options(options, index):
+    """The options for swarm index: its dashboard port is dashboard_base + index"""
+    options = dict(options)
+    if options['dashboard_base'] is not None:
+        options['dashboard_port'] = options['dashboard_base'] + index
+    return options
+
+
+def worker_main(config, status_queue, stop_event, options):
+    """Worker process entry point: one headless LightSwarm for one swarm"""
+    from backends import SystemClock, create_display, create_gpio
+    from RaspberryPi import LightSwarm
+
+    swarm = None
+    try:
+        clock = SystemClock()
+        log_dir = options['log_dir']
+        db_path = options['db']
+        if db_path:
+            # SQLite allows one writer at a time: each swarm gets its own file
+            root, ext = os.path.splitext(db_path)
+            db_path = f"{root}_{config.name}{ext or '.db'}"
+        swarm = LightSwarm(gpio=create_gpio(options['gpio']),
+                           display=create_display('none', clock),
+                           clock=clock,
+                           refresh_interval=options['refresh'],
+                           port=config.port,
+                           broadcast_ip=config.broadcast_ip,
+                           command_port=config.command_port,
+                           log_dir=log_dir,
+                           log_formats=options['log_formats'],
+                           device_ttl=config.ttl,
+                           dashboard_port=options['dashboard_port'],
+                           dashboard_host=options['dashboard_host'],
+                           db_path=db_path,
+                           led_pins=config.led_pins,
+                           reset_pin=config.reset_pin,
+                           log_prefix=f'lightswarm_{config.name}')
+
+        while not stop_event.is_set():
+            now = clock.time()
+            swarm.tick(now)
+            try:
+                status_queue.put_nowait(swarm_status(config.name, swarm, now))
+            except Full:
+                # The parent is behind; it only needs the latest status anyway
+                pass
+            stop_event.wait(options['refresh'])
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[{config.name}] Worker error: {e}")
+    finally:
+        if swarm is not None:
+            swarm.cleanup()
+
+
+def swarm_status(name, swarm, now):
+    snap = swarm.state.snapshot
+    master = snap.devices.get(snap.master)
+    stats = swarm.ingest.stats if swarm.ingest is not None else None
+    return SwarmStatus(
+        name=name,
+        pid=os.getpid(),
+        time=now,
+        active=snap.active,
+        devices=len(snap.devices),
+        master=snap.master,
+        master_addr=master.addr if master is not None else None,
+        master_reading=snap.master_reading,
+        totals=[(device_id, swarm.graph_data.label(device_id), seconds)
+                for device_id, seconds in swarm.graph_data.get_master_durations(now).items()],
+        readings=stats.readings if stats is not None else 0,
+        dropped=stats.dropped if stats is not None else 0,
+        metrics=swarm.metrics.collect(),
+        dashboard_port=swarm.dashboard.port if swarm.dashboard is not None else None,
+    )
+
+
+class ShardedMonitor:
+    """Starts one worker per swarm and aggregates their status"""
+
+    def __init__(self, configs, options, status_interval=5.0):
+        self.configs = configs
+        self.options = options
+        self.status_interval = status_interval
+        self.context = multiprocessing.get_context('spawn')
+        self.status_queue = self.context.Queue(STATUS_QUEUE_SIZE)
+        self.stop_event = self.context.Event()
+        self.latest = {}
+        self.workers = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i, config in enumerate(self.configs):
+            options = worker_options(self.options, i)
+            process = self.context.Process(target=worker_main, name=f'swarm-{config.name}',
+                                           args=(config, self.status_queue, self.stop_event,
+                                                 options))
+            process.start()
+            self.workers[config.name] = process
+            print(f"Swarm {config.name}: port {config.port}, broadcast {config.broadcast_ip}, "
+                  f"LEDs {list(config.led_pins) or 'none'}, button {config.reset_pin}, "
+                  f"pid {process.pid}")
+        return self
+
+    def collect_status(self, timeout):
+        """Drain worker status messages, keeping the latest per swarm"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                status = self.status_queue.get(timeout=remaining)
+            except Empty:
+                return
+            with self._lock:
+                self.latest[status.name] = status
+
+    def render(self):
+        """Every worker's metrics, labelled by swarm (MetricsServer calls this)"""
+        with self._lock:
+            statuses = list(self.latest.values())
+        families = merge_families([(s.metrics, {'swarm': s.name}) for s in statuses])
+        return render_families(families)
+
+    def print_status(self):
+        with self._lock:
+            statuses = [self.latest.get(config.name) for config in self.configs]
+        print(f"\n=== {time.strftime('%H:%M:%S')} ===")
+        for config, status in zip(self.configs, statuses):
+            process = self.workers.get(config.name)
+            alive = process is not None and process.is_alive()
+            if status is None:
+                print(f"{config.name:<10} {'starting' if alive else 'stopped'}")
+                continue
+            master = (f"{status.master_addr} ({status.master}) reading {status.master_reading}"
+                      if status.master is not None else 'none')
+            top = max(status.totals, key=lambda t: t[2], default=None)
+            print(f"{status.name:<10} {'active' if status.active else 'reset':<6} "
+                  f"{status.devices:3d} devices, {status.readings} readings "
+                  f"({status.dropped} dropped), master {master}"
+                  + (f", longest {top[1]} {top[2]:.1f} s" if top else "")
+                  + ("" if alive else " [worker exited]"))
+
+    def run(self):
+        next_status = time.monotonic() + self.status_interval
+        while any(p.is_alive() for p in self.workers.values()):
+            self.collect_status(max(0.0, next_status - time.monotonic()))
+            if time.monotonic() >= next_status:
+                self.print_status()
+                next_status += self.status_interval
+
+    def stop(self):
+        self.stop_event.set()
+        for name, process in self.workers.items():
+            process.join(timeout=10)
+            if process.is_alive():
+                print(f"Swarm {name} did not stop; terminating")
+                process.terminate()
+                process.join(timeout=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Several LightSwarm swarms, one process each')
+    parser.add_argument('--swarm', action='append', required=True, metavar='SPEC',
+                        help='name:port[:broadcast][:leds=P,P,P][:button=P]'
+                             '[:command_port=N][:ttl=S]; repeat per swarm')
+    parser.add_argument('--gpio', choices=['auto', 'rpi', 'sim'], default='auto')
+    parser.add_argument('--refresh', type=float, default=1.0,
+                        help='seconds between worker status updates')
+    parser.add_argument('--status-interval', type=float, default=5.0,
+                        help='seconds between status lines')
+    parser.add_argument('--log-dir', default='.')
+    parser.add_argument('--log-format', choices=['text', 'binary', 'both'], default='text')
+    parser.add_argument('--db', metavar='PATH',
+                        help='session databases, one per swarm: PATH_<name>.db')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve every swarm\'s metrics on 127.0.0.1:PORT')
+    parser.add_argument('--dashboard-base', type=int, metavar='PORT',
+                        help='serve swarm i\'s dashboard on PORT + i')
+    parser.add_argument('--dashboard-host', default='127.0.0.1',
+                        help='address the dashboards listen on; they have no authentication')
+    args = parser.parse_args(argv)
+
+    try:
+        configs = [parse_swarm(spec, first=(i == 0)) for i, spec in enumerate(args.swarm)]
+    except ValueError as e:
+        parser.error(str(e))
+    names = [c.name for c in configs]
+    ports = [c.port for c in configs]
+    if len(set(names)) != len(names) or len(set(ports)) != len(ports):
+        parser.error('swarm names and ports must be unique')
+    if (args.dashboard_base is not None and args.metrics_port is not None
+            and 0 <= args.metrics_port - args.dashboard_base < len(configs)):
+        parser.error(f'--metrics-port {args.metrics_port} is one of the dashboard ports '
+                     f'{args.dashboard_base}-{args.dashboard_base + len(configs) - 1}')
+
+    options = {
+        'gpio': args.gpio,
+        'refresh': args.refresh,
+        'log_dir': args.log_dir,
+        'log_formats': ('text', 'binary') if args.log_format == 'both' else (args.log_format,),
+        'db': args.db,
+        'dashboard_base': args.dashboard_base,
+        'dashboard_port': None,
+        'dashboard_host': args.dashboard_host,
+    }
+    monitor = ShardedMonitor(configs, options, args.status_interval)
+    server = None
+    try:
+        monitor.start()
+        if args.metrics_port is not None:
+            server = MetricsServer(monitor, args.metrics_port).start()
+            print(f"Metrics for all swarms on http://127.0.0.1:{server.port}/metrics")
+        if args.dashboard_base is not None:
+            for i, config in enumerate(configs):
+                print(f"Dashboard for {config.name} on port {args.dashboard_base + i}")
+        print(f"Running {len(configs)} swarms on {os.cpu_count()} cores. Press Ctrl+C to exit.")
+        monitor.run()
+    except KeyboardInterrupt:
+        print("\nShutdown requested...")
+    finally:
+        monitor.stop()
+        if server is not None:
+            server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""Single-owner swarm state published as immutable snapshots.
+
+One thread - the one consuming the ingest queue - applies every event
+(readings, reset, activate) to SwarmState. After each change it publishes
+a new Snapshot by swapping a single attribute, so any other thread reads a
+consistent view with one attribute load and no lock:
+
+    snap = swarm.state.snapshot
+    durations = master_durations(snap, now)
+
+Snapshots and the dicts inside them are never modified once published.
+Updates are O(1) per packet: a reading from the current master replaces
+one namedtuple, and the devices and master_totals dicts are only copied
+when a device joins, leaves or the master changes.
+"""
+import heapq
+from collections import namedtuple
+
+DeviceInfo = namedtuple('DeviceInfo', ['device_id', 'addr', 'joined', 'led'])
+
+Snapshot = namedtuple('Snapshot', [
+    'version',         # bumped on every change
+    'active',          # False between RESET and ACTIVATE
+    'devices',         # {device_id: DeviceInfo}
+    'master',          # device_id of the current master, or None
+    'master_reading',  # its latest reading
+    'master_since',    # when its current run as master started
+    'master_totals',   # {device_id: seconds} of finished runs, in order of first mastership
+    'session_start',
+    'departed',        # {device_id: DeviceInfo} of masters that left, for their labels
+    'folded',          # (masters, seconds) of departed masters beyond max_departed, summed
+])
+
+# Control events, queued behind the readings that arrived before them
+Reset = namedtuple('Reset', ['timestamp'])
+Activate = namedtuple('Activate', ['timestamp'])
+
+# Returned by SwarmState.apply_reading when the master changes
+MasterChange = namedtuple('MasterChange', ['timestamp', 'old', 'new'])
+
+# Returned by SwarmState.expire for each device that went silent
+Departure = namedtuple('Departure', ['timestamp', 'device_id', 'addr', 'last_seen', 'led',
+                                     'was_master'])
+
+# Seconds without a packet before a device counts as gone
+DEFAULT_TTL = 10.0
+# Departed masters kept by name per session; older ones are summed
+MAX_DEPARTED = 256
+
+
+def master_durations(snapshot, now):
+    """Seconds as master per device, including the current master's run"""
+    durations = dict(snapshot.master_totals)
+    if snapshot.master is not None:
+        durations[snapshot.master] = (durations.get(snapshot.master, 0.0)
+                                      + max(0.0, now - snapshot.master_since))
+    return durations
+
+
+def master_duration(snapshot, device_id, now):
+    duration = snapshot.master_totals.get(device_id, 0.0)
+    if device_id == snapshot.master:
+        duration += max(0.0, now - snapshot.master_since)
+    return duration
+
+
+class SwarmState:
+    """Devices, LED assignments and master tracking, keyed by device ID.
+
+    Only the owning thread may call apply_reading, expire, reset and activate;
+    everyone else reads `snapshot`. A MASTER packet makes its sender the
+    master; the previous master's run is credited up to that packet's
+    timestamp. Devices get one of led_pins the first time they are master,
+    while pins last.
+
+    A device that sends nothing for ttl seconds is evicted by expire(): it
+    leaves `devices` and its LED pin is freed. Master time it earned this
+    session stays in `master_totals` (a departing master is credited up to
+    its last packet) and its DeviceInfo moves to `departed`. Only the
+    max_departed most recent departed masters are kept by name: beyond that
+    the oldest is dropped from both dicts and its time added to `folded`, so
+    a session with heavy churn does not grow them, or the copy made on every
+    master change, without bound. Every
+    live device has exactly one entry in an expiry heap, keyed on the
+    deadline it was last checked against; an entry that comes due for a
+    device heard from since is pushed back with its new deadline, so a
+    check costs O(log n) per due entry instead of a scan of every device.
+    """
+
+    def __init__(self, led_pins=(), start=0.0, ttl=DEFAULT_TTL, max_departed=MAX_DEPARTED):
+        self.led_pins = tuple(led_pins)
+        self.ttl = ttl
+        self.max_departed = max_departed
+        self._free_leds = list(self.led_pins)
+        self._last_seen = {}
+        self._expiry = []
+        self.snapshot = self._fresh(True, start, 0)
+
+    def _fresh(self, active, timestamp, version):
+        return Snapshot(version, active, {}, None, None, None, {}, timestamp, {}, (0, 0.0))
+
+    def apply_reading(self, record):
+        """Apply a LIGHT or MASTER Reading; returns a MasterChange or None"""
+        snap = self.snapshot
+        if not snap.active:
+            return None
+        device_id = record.device_id
+        devices = snap.devices
+        info = devices.get(device_id)
+        is_master = record.kind == 'MASTER'
+
+        self._last_seen[device_id] = record.timestamp
+        if info is None and self.ttl:
+            heapq.heappush(self._expiry, (record.timestamp + self.ttl, device_id))
+
+        if info is None or (is_master and info.led is None and self._free_leds):
+            # Join, or first mastership while a pin is free: copy on write
+            led = info.led if info is not None else None
+            if is_master and led is None and self._free_leds:
+                led = self._free_leds.pop(0)
+                print(f"Assigned LED {led} to Device {device_id}")
+            devices = dict(devices)
+            devices[device_id] = DeviceInfo(device_id, record.addr,
+                                            info.joined if info else record.timestamp, led)
+            if info is None and device_id in snap.departed:
+                # Back again
+                departed = dict(snap.departed)
+                del departed[device_id]
+                snap = snap._replace(departed=departed)
+        elif info.addr != record.addr:
+            devices = dict(devices)
+            devices[device_id] = info._replace(addr=record.addr)
+
+        if not is_master:
+            if devices is not snap.devices:
+                self.snapshot = snap._replace(version=snap.version + 1, devices=devices)
+            return None
+
+        change = None
+        totals = snap.master_totals
+        if snap.master != device_id:
+            totals = dict(totals)
+            if snap.master is not None:
+                totals[snap.master] = (totals.get(snap.master, 0.0)
+                                       + max(0.0, record.timestamp - snap.master_since))
+            totals.setdefault(device_id, 0.0)
+            change = MasterChange(record.timestamp, snap.master, device_id)
+            since = record.timestamp
+        else:
+            since = snap.master_since
+
+        self.snapshot = snap._replace(version=snap.version + 1, devices=devices,
+                                      master=device_id, master_reading=record.reading,
+                                      master_since=since, master_totals=totals)
+        return change
+
+    def expire(self, now):
+        """Evict devices silent for more than ttl seconds; returns Departures"""
+        expiry = self._expiry
+        departures = []
+        while expiry and expiry[0][0] <= now:
+            _, device_id = heapq.heappop(expiry)
+            last_seen = self._last_seen.get(device_id)
+            if last_seen is None:
+                continue
+            if last_seen + self.ttl > now:
+                # Heard from since this entry was pushed: check again later
+                heapq.heappush(expiry, (last_seen + self.ttl, device_id))
+                continue
+            departures.append(self._evict(device_id, last_seen, now))
+        return departures
+
+    def _evict(self, device_id, last_seen, now):
+        del self._last_seen[device_id]
+        snap = self.snapshot
+        info = snap.devices.get(device_id)
+        devices = dict(snap.devices)
+        devices.pop(device_id, None)
+        totals = snap.master_totals
+        departed = snap.departed
+        folded = snap.folded
+        was_master = snap.master == device_id
+        led = info.led if info is not None else None
+        if led is not None:
+            self._free_leds.append(led)
+        if was_master:
+            # Its run ends with the last packet heard from it
+            totals = dict(totals)
+            totals[device_id] = totals[device_id] + max(0.0, last_seen - snap.master_since)
+        if device_id in totals and info is not None:
+            departed = dict(departed)
+            departed[device_id] = info._replace(led=None)
+            if len(departed) > self.max_departed:
+                # Departed in order: the first is the one gone longest
+                oldest = next(iter(departed))
+                del departed[oldest]
+                if totals is snap.master_totals:
+                    totals = dict(totals)
+                folded = (folded[0] + 1, folded[1] + totals.pop(oldest))
+        if was_master:
+            self.snapshot = snap._replace(version=snap.version + 1, devices=devices,
+                                          master=None, master_reading=None, master_since=None,
+                                          master_totals=totals, departed=departed, folded=folded)
+        else:
+            self.snapshot = snap._replace(version=snap.version + 1, devices=devices,
+                                          master_totals=totals, departed=departed, folded=folded)
+        return Departure(now, device_id, info.addr if info is not None else None,
+                         last_seen, led, was_master)
+
+    def reset(self, timestamp):
+        """Stop tracking; returns the last snapshot before the reset"""
+        final = self.snapshot
+        self._free_leds = list(self.led_pins)
+        self._last_seen.clear()
+        self._expiry.clear()
+        self.snapshot = self._fresh(False, timestamp, final.version + 1)
+        return final
+
+    def activate(self, timestamp):
+        """Start a fresh session"""
+        self._free_leds = list(self.led_pins)
+        self._last_seen.clear()
+        self._expiry.clear()
+        self.snapshot = self._fresh(True, timestamp, self.snapshot.version + 1)
@@ -0,0 +1,259 @@
+"""Per-device time-series store for LightSwarm readings"""
+import threading
+import warnings
+
+import numpy as np
+
+DEFAULT_WINDOW = 30.0        # seconds of history kept per device
+DEFAULT_RATE_HINT = 25.0     # expected packets/s per device (ESPs send ~10-20)
+INITIAL_DEVICES = 8
+# Samples per device a ring may grow to (~5.5 MB); beyond it the window is
+# shortened for that device
+MAX_CAPACITY = 1 << 19
+
+
+class _Tier:
+    """Rings of one capacity, one row per device"""
+
+    def __init__(self, capacity, n_rows):
+        self.capacity = capacity
+        self._allocate(n_rows)
+
+    def _allocate(self, n_rows):
+        self.ts = np.full((n_rows, self.capacity), -np.inf)
+        self.readings = np.zeros((n_rows, self.capacity), dtype=np.int16)
+        self.master = np.zeros((n_rows, self.capacity), dtype=bool)
+        self.head = np.zeros(n_rows, dtype=np.int64)
+        self.device_ids = np.full(n_rows, -1, dtype=np.int64)
+        self._publish()
+        self.free_rows = list(range(n_rows - 1, -1, -1))
+
+    def _publish(self):
+        # Readers take the arrays from this one tuple, so a resize in between
+        # cannot hand them a mix of old and new shapes
+        self.arrays = (self.ts, self.readings, self.master, self.device_ids)
+
+    def _grow(self):
+        old_rows = len(self.head)
+        new_rows = old_rows * 2
+        ts = np.full((new_rows, self.capacity), -np.inf)
+        ts[:old_rows] = self.ts
+        readings = np.zeros((new_rows, self.capacity), dtype=np.int16)
+        readings[:old_rows] = self.readings
+        master = np.zeros((new_rows, self.capacity), dtype=bool)
+        master[:old_rows] = self.master
+        head = np.zeros(new_rows, dtype=np.int64)
+        head[:old_rows] = self.head
+        device_ids = np.full(new_rows, -1, dtype=np.int64)
+        device_ids[:old_rows] = self.device_ids
+        # Readers hold references to the old arrays until they finish
+        self.ts, self.readings, self.master = ts, readings, master
+        self.head, self.device_ids = head, device_ids
+        self._publish()
+        self.free_rows = list(range(new_rows - 1, old_rows - 1, -1))
+
+    def take_row(self):
+        if not self.free_rows:
+            self._grow()
+        return self.free_rows.pop()
+
+    def free_row(self, row):
+        self.device_ids[row] = -1
+        self.ts[row] = -np.inf
+        self.master[row] = False
+        self.head[row] = 0
+        self.free_rows.append(row)
+
+    def ordered(self, row):
+        """(ts, readings, master) of one row, oldest sample first"""
+        head = int(self.head[row])
+        n = min(head, self.capacity)
+        order = (np.arange(n) + (head - n)) % self.capacity
+        return self.ts[row, order], self.readings[row, order], self.master[row, order]
+
+    def memory_bytes(self):
+        return (self.ts.nbytes + self.readings.nbytes + self.master.nbytes
+                + self.head.nbytes + self.device_ids.nbytes)
+
+
+class DeviceStore:
+    """Ring buffer of (timestamp, reading, master flag) per device.
+
+    Devices live in tiers of preallocated NumPy arrays: one tier per ring
+    capacity, one row per device. Every device starts in the tier sized from
+    the history window times rate_hint. A device about to overwrite a sample
+    that is still inside the window is sending faster than that; it alone
+    moves to the tier of twice the capacity, up to max_capacity, beyond
+    which its window is shortened. Memory follows each device's own rate,
+    so one chatty node does not grow every other ring. A fixed capacity
+    disables the growth. Writes are O(1); window queries are vectorized over
+    all rows of a tier at once.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, rate_hint=DEFAULT_RATE_HINT,
+                 capacity=None, initial_devices=INITIAL_DEVICES, max_capacity=MAX_CAPACITY):
+        self.window = window
+        self.capacity = capacity or int(window * rate_hint) + 1
+        self.max_capacity = self.capacity if capacity else max(self.capacity, max_capacity)
+        self.initial_devices = initial_devices
+        self.rows = {}           # device_id -> (tier, row index)
+        self._capped = set()     # devices already warned about
+        self._lock = threading.Lock()
+        self._reset_tiers()
+
+    def _reset_tiers(self):
+        self._tiers = {self.capacity: _Tier(self.capacity, self.initial_devices)}
+        # What readers iterate, smallest capacity first
+        self._tier_list = (self._tiers[self.capacity],)
+
+    def _tier(self, capacity):
+        tier = self._tiers.get(capacity)
+        if tier is None:
+            # Fast devices are few: larger tiers start with one row
+            tier = self._tiers[capacity] = _Tier(capacity, 1)
+            self._tier_list = tuple(self._tiers[c] for c in sorted(self._tiers))
+        return tier
+
+    def _row_for(self, device_id):
+        location = self.rows.get(device_id)
+        if location is None:
+            with self._lock:
+                tier = self._tiers[self.capacity]
+                row = tier.take_row()
+                tier.device_ids[row] = device_id
+                location = self.rows[device_id] = (tier, row)
+        return location
+
+    def _promote(self, device_id, tier, row):
+        """Move one device to the tier of twice its capacity, oldest sample first"""
+        with self._lock:
+            bigger = self._tier(min(tier.capacity * 2, self.max_capacity))
+            new_row = bigger.take_row()
+            ts, readings, master = tier.ordered(row)
+            n = len(ts)
+            bigger.ts[new_row, :n] = ts
+            bigger.readings[new_row, :n] = readings
+            bigger.master[new_row, :n] = master
+            bigger.head[new_row] = n
+            # Readers may miss the device for a moment, but never see it twice
+            tier.free_row(row)
+            bigger.device_ids[new_row] = device_id
+            location = self.rows[device_id] = (bigger, new_row)
+        return location
+
+    def add(self, device_id, reading, timestamp, is_master=False):
+        """Append one reading to the device's ring buffer"""
+        tier, row = self._row_for(device_id)
+        head = tier.head[row]
+        if head >= tier.capacity and tier.ts[row, head % tier.capacity] >= timestamp - self.window:
+            # About to drop a sample still inside the window
+            if tier.capacity < self.max_capacity:
+                tier, row = self._promote(device_id, tier, row)
+                head = tier.head[row]
+            elif device_id not in self._capped:
+                self._capped.add(device_id)
+                print(f"DeviceStore: {tier.capacity} samples cannot hold {self.window:.0f} s "
+                      f"for device {device_id}; its window is shorter")
+        idx = head % tier.capacity
+        tier.ts[row, idx] = timestamp
+        tier.readings[row, idx] = reading
+        tier.master[row, idx] = is_master
+        tier.head[row] = head + 1
+
+    def remove(self, device_id):
+        """Drop a device and free its row for reuse"""
+        with self._lock:
+            location = self.rows.pop(device_id, None)
+            self._capped.discard(device_id)
+            if location is not None:
+                tier, row = location
+                tier.free_row(row)
+
+    def clear(self):
+        with self._lock:
+            self.rows = {}
+            self._capped = set()
+            self._reset_tiers()
+
+    def __contains__(self, device_id):
+        return device_id in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def device_capacity(self, device_id):
+        """Samples the device's ring holds, or None if it is not stored"""
+        location = self.rows.get(device_id)
+        return location[0].capacity if location is not None else None
+
+    def _windows(self, now, window):
+        """(ts, readings, master, device_ids) of the live rows in each tier, and the cutoff"""
+        cutoff = now - (self.window if window is None else window)
+        parts = []
+        for tier in self._tier_list:
+            ts, readings, master, device_ids = tier.arrays
+            live = device_ids >= 0
+            if live.any():
+                parts.append((ts[live], readings[live], master[live], device_ids[live]))
+        return parts, cutoff
+
+    def master_trace(self, now, window=None):
+        """Master samples within the window across all devices, oldest first.
+
+        Returns (timestamps, readings, device_ids) arrays.
+        """
+        parts, cutoff = self._windows(now, window)
+        times = [np.empty(0)]
+        values = [np.empty(0, dtype=np.int16)]
+        ids = [np.empty(0, dtype=np.int64)]
+        for ts, readings, master, device_ids in parts:
+            rows, cols = np.nonzero(master & (ts >= cutoff))
+            times.append(ts[rows, cols])
+            values.append(readings[rows, cols])
+            ids.append(device_ids[rows])
+        times, values, ids = np.concatenate(times), np.concatenate(values), np.concatenate(ids)
+        order = np.argsort(times, kind='stable')
+        return times[order], values[order], ids[order]
+
+    def window_stats(self, now, window=None, percentiles=(5, 50, 95)):
+        """Vectorized per-device and swarm-wide statistics over a time window.
+
+        Returns a dict with 'device_ids', 'count', 'min', 'max', 'mean' and
+        'percentiles' (devices x len(percentiles)) arrays, plus an 'all'
+        entry with the same statistics across every device.
+        """
+        parts, cutoff = self._windows(now, window)
+        columns = [[np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)],
+                   [np.empty(0)], [np.empty(0)], [np.empty((0, len(percentiles)))]]
+        flat = [np.empty(0, dtype=np.int16)]
+        with warnings.catch_warnings():
+            # Devices with no samples in the window produce NaN, not errors
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            for ts, readings, _, device_ids in parts:
+                mask = ts >= cutoff
+                values = np.where(mask, readings, np.nan)
+                for column, value in zip(columns, (
+                        device_ids, mask.sum(axis=1), np.nanmin(values, axis=1),
+                        np.nanmax(values, axis=1), np.nanmean(values, axis=1),
+                        np.nanpercentile(values, percentiles, axis=1).T)):
+                    column.append(value)
+                flat.append(readings[mask])
+        stats = {name: np.concatenate(column) for name, column in
+                 zip(('device_ids', 'count', 'min', 'max', 'mean', 'percentiles'), columns)}
+
+        flat = np.concatenate(flat)
+        if flat.size:
+            stats['all'] = {
+                'count': int(flat.size),
+                'min': int(flat.min()),
+                'max': int(flat.max()),
+                'mean': float(flat.mean()),
+                'percentiles': np.percentile(flat, percentiles),
+            }
+        else:
+            stats['all'] = {'count': 0, 'min': None, 'max': None, 'mean': None,
+                            'percentiles': np.full(len(percentiles), np.nan)}
+        return stats
+
+    def memory_bytes(self):
+        return sum(tier.memory_bytes() for tier in self._tier_list)
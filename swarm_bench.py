@@ -0,0 +1,478 @@
+"""Load benchmark: drive a headless LightSwarm monitor with the simulator.
+
+Reports ingest throughput, send-to-logged latency of MASTER frames, drop
+rate, per-thread CPU and RSS, so runs can be compared release to release.
+Send-to-plotted latency is not measured: frames are drawn from the store on
+each refresh, so a reading reaches the screen up to one refresh interval
+plus the frame time (both reported) after it was handled:
+
+    python3 swarm_bench.py --nodes 50 --rate 20 --duration 30 --json run.json
+    python3 swarm_bench.py --nodes 50 --rate 100 --binary --batch 16
+    python3 swarm_bench.py --parsers 200000
+    python3 swarm_bench.py --nodes 200 --rate 20 --faults 1
+    python3 swarm_bench.py --detector 1000000
+
+--parsers skips the monitor and times receiving and parsing alone: text
+frames against binary frames of 1, 8 and 32 readings, received into a
+reused buffer the way IngestEngine.drain does.
+
+--detector times the anomaly detector alone over a synthetic swarm with
+injected level jumps, stuck sensors and spikes, one reading at a time and
+in batches, and checks what it found against what was injected.
+
+The simulator runs in the same process (it shows up as the 'simulator'
+thread), so its CPU use competes with the monitor for the GIL; numbers are
+therefore a conservative lower bound for what a separate swarm would reach.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from backends import SimulatedGPIO, SystemClock, create_display
+from detector import AnomalyDetector
+from logwriter import LogWriter
+from procstats import cpu_delta, process_cpu_time, rss_bytes, thread_cpu_times
+from protocol import Reading, encode_binary_frame, parse_binary_frame, parse_frame
+from swarm_sim import SwarmSimulator, batch_size
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LatencyProbe:
+    """Matches logged MASTER records against the simulator's send times.
+
+    Records are also stamped when the monitor starts handling them, so the
+    send->handled part (socket, ingest queue and the receive thread) can be
+    told apart from the time spent waiting for the log writer.
+    """
+
+    def __init__(self):
+        self.sim = None
+        self.latencies = []
+        self.handle_latencies = []
+        self.logged = 0
+        self.recording = False
+        self._handled = {}
+        self._handled_lock = threading.Lock()
+
+    def on_handle(self, record):
+        if record.kind != 'MASTER':
+            return
+        with self._handled_lock:
+            times = self._handled.get((record.device_id, record.reading))
+            if times is None:
+                times = self._handled[(record.device_id, record.reading)] = deque()
+            times.append(time.time())
+
+    def on_write(self, records):
+        now = time.time()
+        self.logged += len(records)
+        for _, device_id, _, reading, _, is_master in records:
+            if not is_master:
+                continue
+            with self._handled_lock:
+                times = self._handled.get((device_id, reading))
+                handled_at = times.popleft() if times else None
+            if self.sim is None:
+                continue
+            # Always pop, so sends from the warmup cannot pair with later records
+            sent_at = self.sim.match_sent(device_id, reading)
+            if self.recording and sent_at is not None:
+                self.latencies.append(now - sent_at)
+                if handled_at is not None:
+                    self.handle_latencies.append(handled_at - sent_at)
+
+
+def run_benchmark(nodes=10, rate=10.0, churn=0.2, duration=10.0, warmup=2.0,
+                  display='none', refresh=1.0, log_formats=('text',), render_cost=0.0,
+                  presses=0, binary=False, batch=1, db=False, faults=0.0):
+    # Imported here so the monitor module is only loaded when benchmarking it
+    from RaspberryPi import RESET_BUTTON, LightSwarm
+
+    log_dir = tempfile.mkdtemp(prefix='lightswarm_bench_')
+    probe = LatencyProbe()
+    clock = SystemClock()
+    sim = SwarmSimulator(target=None, nodes=nodes, rate=rate, churn=churn, seed=1,
+                         binary=binary, batch=batch, faults=faults)
+    swarm = LightSwarm(gpio=SimulatedGPIO(), display=create_display(display, clock, render_cost),
+                       clock=clock, refresh_interval=refresh, port=0,
+                       broadcast_ip='127.0.0.1', command_port=sim.control_port,
+                       log_dir=log_dir, log_writer=LogWriter(
+                           on_write=probe.on_write, formats=log_formats,
+                           db_path=os.path.join(log_dir, 'lightswarm.db') if db else None))
+    sim.target = ('127.0.0.1', swarm.sock.getsockname()[1])
+    handle_record = swarm.handle_record
+
+    def probed_handle_record(record):
+        probe.on_handle(record)
+        handle_record(record)
+    swarm.handle_record = probed_handle_record
+    probe.sim = sim
+    window = {}
+
+    def control():
+        time.sleep(warmup)
+        window['start'] = time.perf_counter()
+        window['cpu'] = thread_cpu_times()
+        window['process_cpu'] = process_cpu_time()
+        window['received'] = swarm.ingest.stats.received
+        window['readings'] = swarm.ingest.stats.readings
+        window['logged'] = probe.logged
+        window['detect'] = (swarm.detect_seconds.sum, swarm.detect_seconds.count)
+        probe.recording = True
+        if presses:
+            # Reset/activate pairs spread over the window, under load
+            for _ in range(presses):
+                time.sleep(duration / presses)
+                swarm.gpio.press(RESET_BUTTON)
+                swarm.gpio.release(RESET_BUTTON)
+        else:
+            time.sleep(duration)
+        probe.recording = False
+        window['elapsed'] = time.perf_counter() - window['start']
+        window['cpu'] = cpu_delta(window['cpu'], thread_cpu_times())
+        window['process_cpu'] = process_cpu_time() - window['process_cpu']
+        window['received'] = swarm.ingest.stats.received - window['received']
+        window['readings'] = swarm.ingest.stats.readings - window['readings']
+        window['detect'] = (swarm.detect_seconds.sum - window['detect'][0],
+                            swarm.detect_seconds.count - window['detect'][1])
+        window['rss'] = rss_bytes()
+
+        # Let the monitor drain whatever is still in flight, then stop it
+        sim.stop()
+        time.sleep(0.5)
+        swarm.log_writer.flush(timeout=5)
+        window['logged'] = probe.logged - window['logged']
+        swarm.running = False
+
+    sim.start()
+    controller = threading.Thread(target=control, name='bench-control', daemon=True)
+    controller.start()
+    swarm.update_gui()
+    controller.join()
+
+    stats = swarm.ingest.stats
+    sent = sim.total_sent()
+    frames = swarm.display.frame_stats()
+    button = swarm.controller.latency_stats()
+    leds = swarm.leds.jitter_stats()
+    anomalies = dict(swarm.detector.counts)
+    swarm.cleanup()
+    shutil.rmtree(log_dir, ignore_errors=True)
+
+    latencies = sorted(probe.latencies)
+    handle_latencies = sorted(probe.handle_latencies)
+    elapsed = window['elapsed']
+    lost_in_kernel = max(0, sent - stats.received)
+    return {
+        'config': {'nodes': nodes, 'rate': rate, 'churn': churn, 'duration': duration,
+                   'display': display, 'refresh': refresh, 'log_formats': list(log_formats),
+                   'render_cost_ms': render_cost * 1000, 'presses': presses,
+                   'binary': binary, 'batch': batch if binary else 1, 'db': db,
+                   'faults': faults},
+        'offered_pps': nodes * rate,
+        'sent': sent,
+        'received': stats.received,
+        'received_pps': window['received'] / elapsed,
+        'readings_sent': sim.readings_sent,
+        'readings_per_s': window['readings'] / elapsed,
+        'detector': {
+            'us_per_reading': (window['detect'][0] / window['readings'] * 1e6
+                               if window['readings'] else 0.0),
+            'mean_batch': (window['readings'] / window['detect'][1]
+                           if window['detect'][1] else 0.0),
+            'anomalies': anomalies,
+            'injected': dict(sim.faults),
+        },
+        'logged_pps': window['logged'] / elapsed,
+        'malformed': stats.malformed,
+        'dropped_queue': stats.dropped,
+        'dropped_kernel': lost_in_kernel,
+        'drop_rate': (stats.dropped + lost_in_kernel) / sent if sent else 0.0,
+        'sim_late_ticks': sim.late_ticks,
+        'latency_ms': {
+            'samples': len(latencies),
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000,
+        },
+        'handle_latency_ms': {
+            'samples': len(handle_latencies),
+            'p50': percentile(handle_latencies, 0.50) * 1000,
+            'p95': percentile(handle_latencies, 0.95) * 1000,
+            'p99': percentile(handle_latencies, 0.99) * 1000,
+            'max': (handle_latencies[-1] if handle_latencies else 0.0) * 1000,
+        },
+        'button_latency_ms': {k: v * 1000 for k, v in button.items() if k != 'presses'},
+        'led_jitter_ms': {k: v * 1000 for k, v in leds.items() if k != 'toggles'},
+        'led_toggles': leds['toggles'],
+        'frame_ms': {k: v * 1000 for k, v in frames.items() if k != 'frames'},
+        'frames': frames['frames'],
+        'cpu_percent': {name: 100.0 * seconds / elapsed
+                        for name, seconds in sorted(window['cpu'].items())},
+        'process_cpu_percent': 100.0 * window['process_cpu'] / elapsed,
+        'rss_mb': window['rss'] / (1024 * 1024),
+    }
+
+
+def print_report(result):
+    cfg = result['config']
+    print(f"\n=== LightSwarm benchmark: {cfg['nodes']} nodes x {cfg['rate']}/s, "
+          f"display={cfg['display']} (+{cfg['render_cost_ms']:.0f} ms/frame) ===")
+    print(f"Offered:    {result['offered_pps']:.0f} pkt/s (sim late ticks: {result['sim_late_ticks']})")
+    print(f"Received:   {result['received_pps']:.0f} pkt/s, "
+          f"{result['readings_per_s']:.0f} readings/s"
+          + (f" (binary, {cfg['batch']} per frame)" if cfg['binary'] else ""))
+    print(f"Logged:     {result['logged_pps']:.0f} rec/s")
+    det = result['detector']
+    print(f"Detector:   {det['us_per_reading']:.2f} us/reading, mean batch {det['mean_batch']:.1f}, "
+          f"anomalies {det['anomalies']}"
+          + (f", injected {det['injected']}" if det['injected'] else ""))
+    print(f"Dropped:    queue={result['dropped_queue']} kernel={result['dropped_kernel']} "
+          f"({result['drop_rate'] * 100:.2f}%), malformed={result['malformed']}")
+    lat = result['latency_ms']
+    print(f"Latency:    send->logged p50={lat['p50']:.1f} ms p95={lat['p95']:.1f} ms "
+          f"p99={lat['p99']:.1f} ms max={lat['max']:.1f} ms ({lat['samples']} samples)")
+    lat = result['handle_latency_ms']
+    print(f"            send->handled p50={lat['p50']:.1f} ms p95={lat['p95']:.1f} ms "
+          f"p99={lat['p99']:.1f} ms max={lat['max']:.1f} ms")
+    print(f"            send->plotted not measured: a handled reading is drawn on the next "
+          f"refresh (every {cfg['refresh']:g} s) plus the frame time")
+    if cfg['presses']:
+        lat = result['button_latency_ms']
+        print(f"Button:     press->broadcast mean={lat['mean']:.2f} ms max={lat['max']:.2f} ms "
+              f"({cfg['presses']} presses)")
+    if result['led_toggles']:
+        jit = result['led_jitter_ms']
+        print(f"LEDs:       {result['led_toggles']} toggles, jitter mean={jit['mean']:.2f} ms "
+              f"p99={jit['p99']:.2f} ms max={jit['max']:.2f} ms")
+    if result['frames']:
+        fr = result['frame_ms']
+        print(f"Frames:     {result['frames']} mean={fr['mean']:.1f} ms max={fr['max']:.1f} ms")
+    print(f"CPU:        process {result['process_cpu_percent']:.1f}%")
+    for name, percent in result['cpu_percent'].items():
+        print(f"            {name:<14} {percent:6.1f}%")
+    print(f"RSS:        {result['rss_mb']:.1f} MB")
+
+
+def parser_benchmark(iterations=100000, batches=(1, 8, 32), chunk=256):
+    """Time receiving and parsing text and binary frames over loopback.
+
+    Frames are sent in chunks and only the receive side is timed:
+    recvfrom_into a reused buffer plus the parse, as in IngestEngine.drain.
+    Returns {name: stats}.
+    """
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    rx.bind(('127.0.0.1', 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = rx.getsockname()
+    buf = bytearray(2048)
+    results = {}
+
+    def run(name, frame, parse, readings):
+        elapsed = 0.0
+        for _ in range(0, iterations, chunk):
+            for _ in range(chunk):
+                tx.sendto(frame, target)
+            start = time.perf_counter()
+            for _ in range(chunk):
+                nbytes, addr = rx.recvfrom_into(buf)
+                parse(buf, nbytes, addr[0])
+            elapsed += time.perf_counter() - start
+        frames = (iterations + chunk - 1) // chunk * chunk
+        results[name] = {
+            'bytes': len(frame),
+            'readings': readings,
+            'frames_per_s': frames / elapsed,
+            'readings_per_s': frames * readings / elapsed,
+            'ns_per_reading': elapsed / (frames * readings) * 1e9,
+        }
+
+    try:
+        # The text path has to copy the datagram out of the buffer first
+        run('text', b'MASTER:1042:873',
+            lambda b, n, addr: parse_frame(bytes(b[:n]), addr, 0.0), 1)
+        for batch in batches:
+            frame = encode_binary_frame(1042, [(1000 + i * 10, 873, i % 2 == 0)
+                                               for i in range(batch)])
+            run(f'binary x{batch}', frame,
+                lambda b, n, addr: parse_binary_frame(b, n, addr, 0.0), batch)
+    finally:
+        rx.close()
+        tx.close()
+    return results
+
+
+def synthetic_swarm(devices, steps, seed=1, step_rate=0.0005, stuck_rate=0.0002,
+                    spike_rate=0.0003, stuck_length=100):
+    """Readings of a random-walk swarm with injected faults, one per device per tick.
+
+    Returns (records, injected) where injected maps each fault kind to its
+    (tick, device index) positions.
+    """
+    rng = np.random.default_rng(seed)
+    levels = rng.integers(200, 800, devices) + np.cumsum(
+        rng.integers(-3, 4, (steps, devices)), axis=0)
+    injected = {'step': [], 'stuck': [], 'spike': []}
+    for tick, device in zip(*np.nonzero(rng.random((steps, devices)) < step_rate)):
+        levels[tick:, device] += 250 if levels[tick, device] < 512 else -250
+        injected['step'].append((int(tick), int(device)))
+    readings = np.clip(levels, 0, 1023)
+    stuck_until = {}
+    for tick, device in zip(*np.nonzero(rng.random((steps, devices)) < stuck_rate)):
+        if stuck_until.get(device, -1) >= tick:
+            continue
+        stuck_until[device] = tick + stuck_length
+        readings[tick:tick + stuck_length, device] = rng.choice((0, 1023))
+        injected['stuck'].append((int(tick), int(device)))
+    for tick, device in zip(*np.nonzero(rng.random((steps, devices)) < spike_rate)):
+        if readings[tick, device] not in (0, 1023):
+            readings[tick, device] = min(1023, readings[tick, device] + 200)
+            injected['spike'].append((int(tick), int(device)))
+    records = [Reading('LIGHT', 1000 + device, reading, '127.0.0.1', tick * 0.1)
+               for tick, row in enumerate(readings.tolist())
+               for device, reading in enumerate(row)]
+    return records, injected
+
+
+def detector_benchmark(readings=1000000, devices=(100, 1000), batches=(1, 64, 1024)):
+    """Time AnomalyDetector.observe over synthetic swarms, by batch size.
+
+    Every run sees the same stream, so the anomalies found must not depend
+    on the batch size; recall is the share of injected faults reported
+    within 10 ticks (stuck sensors: by the time stuck_count readings have
+    arrived). Returns {name: stats}.
+    """
+    results = {}
+    for n_devices in devices:
+        records, injected = synthetic_swarm(n_devices, max(1, readings // n_devices))
+        found = None
+        for batch in batches:
+            detector = AnomalyDetector()
+            observe = detector.observe
+            anomalies = []
+            start = time.perf_counter()
+            for i in range(0, len(records), batch):
+                anomalies.extend(observe(records[i:i + batch]))
+            elapsed = time.perf_counter() - start
+            if found is None:
+                found = anomalies
+            elif anomalies != found:
+                raise AssertionError(f"batch {batch} found different anomalies")
+            results[f'{n_devices} devices, batch {batch}'] = {
+                'readings': len(records),
+                'readings_per_s': len(records) / elapsed,
+                'ns_per_reading': elapsed / len(records) * 1e9,
+                'anomalies': dict(detector.counts),
+                'recall': detector_recall(anomalies, injected, detector.stuck_count),
+            }
+    return results
+
+
+def detector_recall(anomalies, injected, stuck_count):
+    reported = {}
+    for a in anomalies:
+        reported.setdefault((a.kind, a.device_id - 1000), []).append(round(a.timestamp * 10))
+    expect = {'step': ('change', 10), 'stuck': ('stuck', stuck_count), 'spike': ('outlier', 0)}
+    recall = {}
+    for fault, positions in injected.items():
+        kind, within = expect[fault]
+        hits = sum(any(tick <= t <= tick + within for t in reported.get((kind, device), ()))
+                   for tick, device in positions)
+        recall[fault] = f'{hits}/{len(positions)}'
+    return recall
+
+
+def print_detector_report(results):
+    print("\n=== Anomaly detector ===")
+    for name, r in results.items():
+        print(f"{name:<26} {r['readings_per_s'] / 1000:8.0f} kreadings/s  "
+              f"{r['ns_per_reading']:6.0f} ns/reading  found {r['anomalies']}  "
+              f"recall {r['recall']}")
+
+
+def print_parser_report(results, iterations):
+    print(f"\n=== Receive + parse over loopback: {iterations} frames each ===")
+    for name, r in results.items():
+        print(f"{name:<11} {r['bytes']:4d} B  {r['frames_per_s'] / 1000:8.0f} kframes/s  "
+              f"{r['readings_per_s'] / 1000:8.0f} kreadings/s  {r['ns_per_reading']:6.0f} ns/reading")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='LightSwarm load benchmark')
+    parser.add_argument('--nodes', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=10.0, help='packets/s per node')
+    parser.add_argument('--churn', type=float, default=0.2, help='master elections/s')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--display', choices=['none', 'agg', 'tk', 'process-agg', 'process'],
+                        default='none',
+                        help="'agg' renders plots off-screen to include update_plots cost, "
+                             "'process-agg' does the same in a separate renderer process")
+    parser.add_argument('--render-cost', type=float, default=0.0,
+                        help='extra ms of busy work per frame, to emulate a slow display')
+    parser.add_argument('--refresh', type=float, default=1.0)
+    parser.add_argument('--presses', type=int, default=0,
+                        help='press the simulated reset button this many times during the run')
+    parser.add_argument('--log-format', choices=['text', 'binary', 'both'], default='text')
+    parser.add_argument('--binary', action='store_true',
+                        help='simulated nodes send binary batch frames')
+    parser.add_argument('--batch', type=batch_size, default=1,
+                        help='readings per binary frame (1..255)')
+    parser.add_argument('--parsers', type=int, metavar='N', default=0,
+                        help='only time receive + parse, N frames per format')
+    parser.add_argument('--db', action='store_true',
+                        help='also record every reading in a SQLite session database')
+    parser.add_argument('--faults', type=float, default=0.0,
+                        help='sensor faults injected per second by the simulator')
+    parser.add_argument('--detector', type=int, metavar='N', default=0,
+                        help='only time the anomaly detector, N synthetic readings per swarm size')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    if args.detector:
+        result = detector_benchmark(args.detector)
+        print_detector_report(result)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(result, f, indent=2)
+        return 0
+
+    if args.parsers:
+        result = parser_benchmark(args.parsers)
+        print_parser_report(result, args.parsers)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(result, f, indent=2)
+        return 0
+
+    result = run_benchmark(args.nodes, args.rate, args.churn, args.duration,
+                           args.warmup, args.display, args.refresh,
+                           ('text', 'binary') if args.log_format == 'both' else (args.log_format,),
+                           args.render_cost / 1000, args.presses, args.binary, args.batch, args.db,
+                           args.faults)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
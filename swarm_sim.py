@@ -0,0 +1,325 @@
+"""Synthetic ESP8266 swarm that speaks the Swarm.ino protocol over UDP.
+
+Every node broadcasts LIGHT:<id>:<reading> at the configured rate; the node
+with the highest reading (ties broken by the higher ID, as on the ESPs)
+sends MASTER:<id>:<reading> twice per tick instead, like sendMasterUpdate().
+RESET stops all traffic until ACTIVATE arrives on the control socket.
+
+With --binary each node instead sends binary frames (see protocol.py) of
+--batch readings each, one reading per tick flagged as master or not.
+
+--faults injects sensor faults for the anomaly detector to find: a random
+node either jumps by STEP_SIZE or sticks at 0 or 1023 for STUCK_SECONDS.
+
+    python3 swarm_sim.py --nodes 30 --rate 10 --churn 0.5 --target 127.0.0.1:2910
+    python3 swarm_sim.py --nodes 30 --rate 100 --binary --batch 16
+    python3 swarm_sim.py --nodes 30 --rate 10 --faults 0.2
+"""
+import argparse
+import random
+import select
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+from protocol import MAX_BATCH, encode_binary_frame
+
+# Master updates are sent twice per tick for reliability (see Swarm.ino)
+MASTER_REPEAT = 2
+# Send times older than this are forgotten if the monitor never logged them
+SENT_TIME_RETENTION = 10.0
+# Injected faults: light level jumps, and sensors pinned at a rail
+STEP_SIZE = 250
+STUCK_SECONDS = 10.0
+
+
+class SimNode:
+    def __init__(self, device_id, reading, sock):
+        self.device_id = device_id
+        self.reading = reading
+        self.sock = sock
+        # Binary mode: (millis, reading, is_master) waiting for a full batch
+        self.pending = []
+        # Injected stuck fault: (reading to restore, perf_counter deadline)
+        self.stuck = None
+
+
+class SwarmSimulator:
+    """Drive a set of fake nodes from one thread.
+
+    rate is packets per second per node, churn is forced master elections
+    per second (a random node jumps above the current master). With
+    distinct_addrs each node sends from its own 127.0.0.x address so the
+    monitor sees one IP per device, as on a real network.
+
+    With binary, readings go out as binary frames of batch readings each
+    (one reading per node per tick, master readings sent once), and
+    sent['BINARY'] counts frames.
+
+    faults is injected sensor faults per second, counted by kind in
+    self.faults.
+    """
+
+    def __init__(self, target=('127.0.0.1', 2910), nodes=3, rate=10.0, churn=0.1,
+                 distinct_addrs=True, control_port=0, seed=None, binary=False, batch=1,
+                 faults=0.0):
+        self.target = target
+        self.binary = binary
+        if not 1 <= batch <= MAX_BATCH:
+            raise ValueError(f"batch must be 1..{MAX_BATCH}, got {batch}")
+        self.batch = batch
+        self.rate = rate
+        self.churn = churn
+        self.fault_rate = faults
+        self.faults = defaultdict(int)
+        self.random = random.Random(seed)
+        self.active = True
+        self.running = False
+        self._thread = None
+        self._control_thread = None
+
+        self.sent = defaultdict(int)
+        self.readings_sent = 0
+        self.ticks = 0
+        self.late_ticks = 0
+        self.started_at = None
+        self.stopped_at = None
+        # (device_id, reading) -> send times of MASTER frames not yet matched
+        self._sent_times = {}
+        self._sent_lock = threading.Lock()
+
+        self.nodes = []
+        for i in range(nodes):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if distinct_addrs:
+                sock.bind((f'127.0.{1 + i // 250}.{1 + i % 250}', 0))
+            device_id = 1000 + i
+            self.nodes.append(SimNode(device_id, self.random.randint(100, 900), sock))
+
+        # RESET / ACTIVATE from the monitor arrive here
+        self.control_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.control_sock.bind(('127.0.0.1', control_port))
+        self.control_port = self.control_sock.getsockname()[1]
+
+    def master(self):
+        return max(self.nodes, key=lambda n: (n.reading, n.device_id))
+
+    def start(self):
+        self.running = True
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self.run, name='simulator', daemon=True)
+        self._thread.start()
+        self._control_thread = threading.Thread(target=self.listen_control,
+                                                name='sim-control', daemon=True)
+        self._control_thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join(2.0)
+        if self._control_thread is not None:
+            self._control_thread.join(2.0)
+        self.stopped_at = time.time()
+        for node in self.nodes:
+            node.sock.close()
+        self.control_sock.close()
+
+    def listen_control(self):
+        while self.running:
+            readable, _, _ = select.select([self.control_sock], [], [], 0.2)
+            if not readable:
+                continue
+            data, _ = self.control_sock.recvfrom(64)
+            if data.startswith(b'RESET'):
+                self.active = False
+            elif data.startswith(b'ACTIVATE'):
+                self.active = True
+
+    def step_readings(self, now):
+        for node in self.nodes:
+            if node.stuck is not None:
+                if now < node.stuck[1]:
+                    continue
+                node.reading = node.stuck[0]
+                node.stuck = None
+            node.reading = min(1023, max(0, node.reading + self.random.randint(-3, 3)))
+
+    def inject_fault(self, now):
+        node = self.random.choice(self.nodes)
+        if node.stuck is not None:
+            return
+        if self.random.random() < 0.5:
+            node.stuck = (node.reading, now + STUCK_SECONDS)
+            node.reading = self.random.choice((0, 1023))
+            self.faults['stuck'] += 1
+        else:
+            step = STEP_SIZE if node.reading < 512 else -STEP_SIZE
+            node.reading += step
+            self.faults['step'] += 1
+
+    def force_election(self):
+        master = self.master()
+        challengers = [n for n in self.nodes if n is not master]
+        if challengers:
+            node = self.random.choice(challengers)
+            node.reading = min(1023, master.reading + self.random.randint(1, 20))
+            if node.reading == master.reading and node.device_id < master.device_id:
+                # Saturated at 1023: drop the old master so the election happens
+                master.reading -= 50
+
+    def _record_sent(self, device_id, reading, now, count=1):
+        with self._sent_lock:
+            times = self._sent_times.get((device_id, reading))
+            if times is None:
+                times = self._sent_times[(device_id, reading)] = deque()
+            for _ in range(count):
+                times.append(now)
+
+    def send_tick(self):
+        if self.binary:
+            self.send_binary_tick()
+            return
+        master = self.master()
+        target = self.target
+        for node in self.nodes:
+            if node is master:
+                message = b'MASTER:%d:%d' % (node.device_id, node.reading)
+                self._record_sent(node.device_id, node.reading, time.time(), MASTER_REPEAT)
+                for _ in range(MASTER_REPEAT):
+                    node.sock.sendto(message, target)
+                self.sent['MASTER'] += MASTER_REPEAT
+                self.readings_sent += MASTER_REPEAT
+            else:
+                node.sock.sendto(b'LIGHT:%d:%d' % (node.device_id, node.reading), target)
+                self.sent['LIGHT'] += 1
+                self.readings_sent += 1
+
+    def send_binary_tick(self):
+        master = self.master()
+        millis = int(time.perf_counter() * 1000)
+        for node in self.nodes:
+            node.pending.append((millis, node.reading, node is master))
+            # Nodes flush out of step, as unsynchronized ESPs would
+            if (self.ticks + node.device_id) % self.batch:
+                continue
+            now = time.time()
+            for _, reading, is_master in node.pending:
+                if is_master:
+                    self._record_sent(node.device_id, reading, now)
+            node.sock.sendto(encode_binary_frame(node.device_id, node.pending), self.target)
+            self.sent['BINARY'] += 1
+            self.readings_sent += len(node.pending)
+            node.pending = []
+
+    def run(self):
+        interval = 1.0 / self.rate
+        next_tick = time.perf_counter()
+        next_churn = next_tick + (1.0 / self.churn if self.churn > 0 else float('inf'))
+        next_fault = next_tick + (1.0 / self.fault_rate if self.fault_rate > 0 else float('inf'))
+        next_prune = next_tick + 1.0
+
+        while self.running:
+            now = time.perf_counter()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                continue
+            if now - next_tick > interval:
+                # Fell more than a tick behind: count it and catch up
+                self.late_ticks += 1
+                next_tick = now
+            next_tick += interval
+
+            if not self.active:
+                continue
+            self.ticks += 1
+            self.step_readings(now)
+            if now >= next_churn:
+                self.force_election()
+                next_churn = now + 1.0 / self.churn
+            if now >= next_fault:
+                self.inject_fault(now)
+                next_fault = now + 1.0 / self.fault_rate
+            try:
+                self.send_tick()
+            except OSError as e:
+                print(f"Simulator send error: {e}")
+            if now >= next_prune:
+                self.prune_sent_times()
+                next_prune = now + 1.0
+
+    def prune_sent_times(self):
+        cutoff = time.time() - SENT_TIME_RETENTION
+        with self._sent_lock:
+            for key in [k for k, v in self._sent_times.items() if not v or v[-1] < cutoff]:
+                del self._sent_times[key]
+
+    def match_sent(self, device_id, reading):
+        """Pop the earliest send time of a MASTER frame, or None if unknown"""
+        with self._sent_lock:
+            times = self._sent_times.get((device_id, reading))
+            if times:
+                return times.popleft()
+        return None
+
+    def total_sent(self):
+        return sum(self.sent.values())
+
+
+def parse_target(text):
+    host, _, port = text.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+def batch_size(text):
+    """argparse type for --batch: readings per binary frame"""
+    batch = int(text)
+    if not 1 <= batch <= MAX_BATCH:
+        raise argparse.ArgumentTypeError(f"must be 1..{MAX_BATCH}, got {batch}")
+    return batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated LightSwarm ESP8266 nodes')
+    parser.add_argument('--target', default='127.0.0.1:2910', help='monitor host:port')
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--rate', type=float, default=10.0, help='packets/s per node')
+    parser.add_argument('--churn', type=float, default=0.1, help='master elections/s')
+    parser.add_argument('--duration', type=float, default=0, help='seconds (0 = forever)')
+    parser.add_argument('--shared-addr', action='store_true',
+                        help='send every node from the same address')
+    parser.add_argument('--control-port', type=int, default=0,
+                        help='port to receive RESET/ACTIVATE on')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--binary', action='store_true', help='send binary batch frames')
+    parser.add_argument('--batch', type=batch_size, default=1,
+                        help=f'readings per binary frame (1..{MAX_BATCH})')
+    parser.add_argument('--faults', type=float, default=0.0,
+                        help='sensor faults (level jumps, stuck sensors) injected per second')
+    args = parser.parse_args(argv)
+
+    sim = SwarmSimulator(parse_target(args.target), args.nodes, args.rate, args.churn,
+                         distinct_addrs=not args.shared_addr,
+                         control_port=args.control_port, seed=args.seed,
+                         binary=args.binary, batch=args.batch, faults=args.faults)
+    print(f"Simulating {args.nodes} nodes at {args.rate}/s -> {args.target} "
+          f"(control port {sim.control_port})")
+    sim.start()
+    try:
+        deadline = time.time() + args.duration if args.duration else None
+        while deadline is None or time.time() < deadline:
+            time.sleep(1)
+            print(f"sent={dict(sim.sent)} late_ticks={sim.late_ticks} "
+                  f"master={sim.master().device_id} active={sim.active}"
+                  + (f" faults={dict(sim.faults)}" if sim.faults else ""))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
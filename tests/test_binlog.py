@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from binlog import (HEADER, MAGIC, RECORD_DTYPE, BinaryLog, BinaryLogWriter, binary_to_text,
+                    text_to_binary)
+
+
+def write_log(path, ts, index_every=16, chunk=7):
+    """Write records with the given timestamps; device = position % 5, master on even devices"""
+    writer = BinaryLogWriter(str(path), index_every=index_every, created=1000.0)
+    records = [(t, i % 5, f'10.0.0.{i % 5 + 1}', i % 1024, i % 5 % 2 == 0)
+               for i, t in enumerate(ts.tolist())]
+    for i in range(0, len(records), chunk):
+        writer.write_records(records[i:i + chunk])
+    writer.close()
+    return BinaryLog(str(path))
+
+
+def expected(ts, start, end):
+    mask = np.ones(len(ts), dtype=bool)
+    if start is not None:
+        mask &= ts >= start
+    if end is not None:
+        mask &= ts < end
+    return np.flatnonzero(mask)
+
+
+def check_ranges(log, ts, rng):
+    ranges = [(None, None), (None, ts.min() + 1), (ts.max() - 1, None), (ts.max() + 1, None),
+              (None, ts.min()), (ts.min(), ts.max() + 1)]
+    ranges += [tuple(sorted(rng.uniform(ts.min() - 1, ts.max() + 1, 2))) for _ in range(200)]
+    for start, end in ranges:
+        data = log.query(start, end)
+        want = expected(ts, start, end)
+        assert np.array_equal(data['ts'], ts[want]), (start, end)
+        assert np.array_equal(data['device_id'], want % 5)
+
+
+def test_round_trip_in_order(tmp_path):
+    ts = 1000.0 + np.arange(1000) * 0.05
+    log = write_log(tmp_path / 's.lsb', ts)
+    assert len(log) == 1000
+    assert len(log.index) == 1000 // 16
+    check_ranges(log, ts, np.random.default_rng(1))
+
+
+def test_round_trip_out_of_order(tmp_path):
+    # Arrival order with batch entries backdated by up to 0.6 s
+    rng = np.random.default_rng(2)
+    ts = 1000.0 + np.arange(2000) * 0.05 - rng.uniform(0, 0.6, 2000) * (rng.random(2000) < 0.3)
+    assert (np.diff(ts) < 0).any()
+    log = write_log(tmp_path / 's.lsb', ts, chunk=13)
+    check_ranges(log, ts, rng)
+
+    mid = float(ts[1000])
+    data = log.query(mid, mid + 5.0, device_id=3, master_only=False)
+    want = expected(ts, mid, mid + 5.0)
+    assert np.array_equal(data['ts'], ts[want[want % 5 == 3]])
+    data = log.query(mid, None, master_only=True)
+    assert data['master'].all()
+    assert len(data['ts']) == sum(1 for i in expected(ts, mid, None) if i % 5 % 2 == 0)
+
+
+def test_far_backdated_record(tmp_path):
+    ts = 1000.0 + np.arange(200, dtype=float)
+    ts[150] = 1010.5
+    log = write_log(tmp_path / 's.lsb', ts)
+    data = log.query(1010.0, 1011.0)
+    assert data['ts'].tolist() == [1010.0, 1010.5]
+
+
+def test_tail_still_being_written(tmp_path):
+    ts = 1000.0 + np.arange(40) * 0.1
+    path = tmp_path / 's.lsb'
+    write_log(path, ts)
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 5)
+    log = BinaryLog(str(path))
+    assert len(log) == 40
+    check_ranges(log, ts, np.random.default_rng(3))
+
+
+def test_version_1_file_is_read_without_index(tmp_path):
+    path = tmp_path / 'old.lsb'
+    ts = 1000.0 + np.array([0.0, 1.0, 0.5, 2.0])
+    block = np.zeros(len(ts), dtype=RECORD_DTYPE)
+    block['ts'] = ts
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 1, RECORD_DTYPE.itemsize, 2, 1000.0))
+        f.write(block.tobytes())
+    with open(str(path) + '.idx', 'wb') as f:
+        f.write(b'\xff' * 32)
+    log = BinaryLog(str(path))
+    assert log.query(1000.4, 1001.5)['ts'].tolist() == [1001.0, 1000.5]
+
+
+def test_text_conversion_round_trip(tmp_path):
+    text = tmp_path / 's.log'
+    text.write_text("=== New Session Started at 20240118_123456 ===\n"
+                    "Format: timestamp, device_id, ip_address, reading, master_duration\n"
+                    "===========================================\n\n"
+                    "2024-01-18 12:35:00, 7, 192.168.1.101, 500, 0.00\n"
+                    "2024-01-18 12:35:01, 7, 192.168.1.101, 510, 1.00\n"
+                    "2024-01-18 12:35:02, 9, 192.168.1.103, 923, 0.00\n")
+    binary = tmp_path / 's.lsb'
+    assert text_to_binary(str(text), str(binary), index_every=2) == 3
+    back = tmp_path / 'back.log'
+    assert binary_to_text(str(binary), str(back)) == 3
+    lines = back.read_text().splitlines()[4:]
+    assert lines == ["2024-01-18 12:35:00, 7, 192.168.1.101, 500, 0.00",
+                     "2024-01-18 12:35:01, 7, 192.168.1.101, 510, 1.00",
+                     "2024-01-18 12:35:02, 9, 192.168.1.103, 923, 0.00"]
+
+
+@pytest.mark.parametrize('every', [1, 3, 4096])
+def test_index_intervals(tmp_path, every):
+    rng = np.random.default_rng(every)
+    ts = 1000.0 + np.arange(300) * 0.1 - rng.uniform(0, 2.0, 300)
+    log = write_log(tmp_path / 's.lsb', ts, index_every=every, chunk=50)
+    check_ranges(log, ts, rng)
@@ -0,0 +1,106 @@
+import threading
+
+from backends import HIGH, LOW, SimulatedGPIO, VirtualClock, create_display
+from controller import ACTIVE, INACTIVE, RESETTING, ResetController
+from RaspberryPi import LightSwarm, YELLOW_LED
+
+
+class FakeSwarm:
+    def __init__(self):
+        self.sent = []
+
+    def send_reset(self):
+        self.sent.append('RESET')
+        return None
+
+    def send_activate(self):
+        self.sent.append('ACTIVATE')
+        return None
+
+    def finish_reset(self):
+        self.sent.append('finish')
+
+
+def test_debounce_follows_the_injected_clock():
+    clock = VirtualClock(start=100.0)
+    swarm = FakeSwarm()
+    controller = ResetController(swarm, SimulatedGPIO(), 15, clock, debounce=0.5,
+                                 indicator_seconds=3.0)
+    controller.on_edge()
+    controller.on_edge()                  # same virtual instant: a bounce
+    assert controller.bounces == 1
+    assert controller.state == RESETTING
+    clock.advance_to(101.0)               # a second press, however fast in wall time
+    controller.on_edge()
+    assert controller.state == ACTIVE
+    assert swarm.sent == ['RESET', 'ACTIVATE', 'finish']
+
+
+def test_indicator_timer_ends_the_reset():
+    clock = VirtualClock(start=0.0)
+    swarm = FakeSwarm()
+    controller = ResetController(swarm, SimulatedGPIO(), 15, clock)
+    controller.on_edge()
+    clock.advance_to(5.0)
+    assert controller.state == INACTIVE
+    assert swarm.sent == ['RESET', 'finish']
+
+
+def test_late_reset_leaves_the_indicator_off(tmp_path):
+    clock = VirtualClock(start=1000.0)
+    gpio = SimulatedGPIO()
+    swarm = LightSwarm(gpio=gpio, display=create_display('none', clock), clock=clock,
+                       log_dir=str(tmp_path), listen=False, reset_pin=None)
+    try:
+        # Hold control events back as a backlogged receive queue would
+        queued = []
+        swarm.post = queued.append
+        swarm.send_reset()
+        swarm.finish_reset()              # ACTIVATE pressed before RESET was applied
+        swarm.send_activate()
+        for event in queued:
+            swarm.handle_control(event)
+        assert gpio.input(YELLOW_LED) == LOW
+
+        # The next reset still lights it until its own finish
+        queued.clear()
+        swarm.send_reset()
+        swarm.handle_control(queued.pop(0))
+        assert gpio.input(YELLOW_LED) == HIGH
+        swarm.finish_reset()
+        assert gpio.input(YELLOW_LED) == LOW
+    finally:
+        swarm.running = False
+        clock.stop()
+        swarm.cleanup()
+
+
+def test_a_blocked_broadcast_does_not_hold_the_controller_lock():
+    clock = VirtualClock(start=0.0)
+    swarm = FakeSwarm()
+    release = threading.Event()
+    entered = threading.Event()
+    send_reset = swarm.send_reset
+
+    def blocking_reset():
+        # As post() would on a full receive queue
+        entered.set()
+        release.wait(5.0)
+        return send_reset()
+    swarm.send_reset = blocking_reset
+    controller = ResetController(swarm, SimulatedGPIO(), 15, clock)
+    press = threading.Thread(target=controller.on_edge)
+    press.start()
+    try:
+        assert entered.wait(5.0)
+        assert controller._lock.acquire(timeout=1.0)
+        controller._lock.release()
+        assert controller.state == RESETTING
+    finally:
+        release.set()
+        press.join(5.0)
+    # The indicator timer starts once the broadcast went out
+    clock.advance_to(5.0)
+    assert controller.state == INACTIVE
+    assert swarm.sent == ['RESET', 'finish']
+    clock.stop()
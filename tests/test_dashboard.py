@@ -0,0 +1,127 @@
+import http.client
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from dashboard import DashboardServer
+from rollup import RollupEngine
+from state import Snapshot
+
+
+def get(server, path):
+    with urllib.request.urlopen(f'http://127.0.0.1:{server.port}{path}', timeout=5) as response:
+        return response.status, response.read()
+
+
+class FakeGraphData:
+    """What DashboardHub.publish reads from GraphData"""
+
+    def __init__(self, master, durations):
+        self.snapshot = Snapshot(1, True, {}, master, 500, 0.0, durations, 0.0, {}, (0, 0.0))
+        self.durations = durations
+        self.master_colors = {master: 'red'}
+        self.anomalies = []
+        self.stuck = ()
+
+    def get_master_durations(self, now):
+        return self.durations
+
+    def label(self, device_id):
+        return f'10.0.0.{device_id}'
+
+
+def events(response):
+    """Yield (event, data) from an SSE response, skipping comments"""
+    event = None
+    for line in response:
+        line = line.decode('utf-8').rstrip('\n')
+        if line.startswith('event: '):
+            event = line[7:]
+        elif line.startswith('data: '):
+            yield event, json.loads(line[6:])
+
+
+@pytest.fixture
+def rollups():
+    rollups = RollupEngine()
+    for i in range(120):
+        rollups.add(7, 100 + i % 60, 1000.0 + i, is_master=True)
+    rollups.end_master(1120.0)
+    return rollups
+
+
+def test_history_serves_the_rollup_series(rollups):
+    server = DashboardServer(0, '127.0.0.1', clock=lambda: 1200.0, history=rollups.series).start()
+    try:
+        status, body = get(server, '/history?device=7&seconds=7200')
+        history = json.loads(body)
+        assert status == 200
+        assert history['resolution'] == 60
+        assert history['start'] == [960, 1020, 1080]
+        assert history['count'] == [20, 60, 40]
+        assert history['min'] == [100, 100, 120] and history['max'] == [119, 159, 159]
+        assert sum(history['master_seconds']) == pytest.approx(120.0)
+
+        assert json.loads(get(server, '/history?device=8')[1])['count'] == []
+        with pytest.raises(urllib.error.HTTPError) as error:
+            get(server, '/history?device=x')
+        assert error.value.code == 400
+    finally:
+        server.stop()
+
+
+def test_history_is_absent_without_a_source():
+    server = DashboardServer(0, '127.0.0.1', clock=lambda: 1200.0).start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            get(server, '/history?device=7')
+        assert error.value.code == 404
+    finally:
+        server.stop()
+
+
+def test_events_stream_recent_samples_then_updates():
+    server = DashboardServer(0, clock=lambda: 100.0, history_seconds=30,
+                             frame_interval=0.01).start()
+    hub = server.hub
+    hub.add_sample(50.0, 100, 1, '10.0.0.1')         # outside the history window
+    hub.add_sample(90.0, 200, 1, '10.0.0.1')
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    try:
+        connection.request('GET', '/events')
+        response = connection.getresponse()
+        assert response.status == 200
+        assert response.headers['Content-Type'] == 'text/event-stream'
+        stream = events(response)
+        assert next(stream) == ('reset', {'samples': [[90.0, 200, 1]]})
+
+        hub.add_sample(95.0, 300, 2, '10.0.0.2')
+        hub.publish(FakeGraphData(2, {1: 3.5, 2: 1.0}), 95.0)
+        event, data = next(stream)
+        while not data['state']:
+            # The sample and the state may arrive in separate frames
+            event, more = next(stream)
+            data['samples'] += more['samples']
+            data['state'] = more['state']
+        assert event == 'update'
+        assert [95.0, 300, 2] in data['samples']
+        assert data['state']['master'] == 2
+        assert data['state']['totals'] == [[1, '10.0.0.1', 3.5, 'gray'],
+                                           [2, '10.0.0.2', 1.0, 'red']]
+
+        hub.reset()
+        assert next(stream) == ('reset', {'samples': []})
+        assert hub.clients == 1
+    finally:
+        connection.close()
+        server.stop()
+
+
+def test_listens_on_localhost_by_default():
+    server = DashboardServer(0)
+    try:
+        assert server.httpd.server_address[0] == '127.0.0.1'
+    finally:
+        server.stop()
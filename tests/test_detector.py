@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from detector import AnomalyDetector
+from protocol import Reading
+
+
+def readings(device_id, values, start=0.0, step=0.05):
+    return [Reading('LIGHT', device_id, int(v), '10.0.0.1', start + i * step)
+            for i, v in enumerate(values)]
+
+
+def noisy(rng, level, n, sigma=4.0):
+    return np.clip(np.round(level + rng.normal(0, sigma, n)), 0, 1023)
+
+
+def kinds(anomalies):
+    return [a.kind for a in anomalies]
+
+
+def test_quiet_signal_raises_nothing():
+    rng = np.random.default_rng(1)
+    detector = AnomalyDetector()
+    assert detector.observe(readings(1, noisy(rng, 500, 2000))) == []
+
+
+def test_step_is_a_change_found_within_a_few_readings():
+    rng = np.random.default_rng(2)
+    detector = AnomalyDetector()
+    values = np.concatenate([noisy(rng, 500, 200), noisy(rng, 620, 200)])
+    found = detector.observe(readings(1, values))
+    assert kinds(found)[-1] == 'change' and 'change' in kinds(found)
+    change = next(a for a in found if a.kind == 'change')
+    position = int(round(change.timestamp / 0.05))
+    assert 200 <= position < 210
+    assert change.mean == pytest.approx(500, abs=5)
+    assert change.score > detector.cusum_h
+    # The mean restarts at the new level: nothing more after the step
+    assert [a for a in found if a.timestamp > change.timestamp] == []
+
+
+def test_downward_step_has_negative_score():
+    rng = np.random.default_rng(3)
+    detector = AnomalyDetector()
+    values = np.concatenate([noisy(rng, 700, 100), noisy(rng, 550, 100)])
+    changes = [a for a in detector.observe(readings(1, values)) if a.kind == 'change']
+    assert len(changes) == 1 and changes[0].score < -detector.cusum_h
+
+
+def test_single_spike_is_an_outlier_not_a_change():
+    rng = np.random.default_rng(4)
+    detector = AnomalyDetector()
+    values = noisy(rng, 400, 300)
+    values[150] = 900
+    found = detector.observe(readings(1, values))
+    assert kinds(found) == ['outlier']
+    assert found[0].reading == 900 and found[0].score > detector.outlier_z
+
+
+def test_no_events_during_warmup():
+    detector = AnomalyDetector(warmup=20)
+    values = [500] * 10 + [900] * 5
+    assert detector.observe(readings(1, values)) == []
+
+
+def test_stuck_at_rail_and_recovered():
+    rng = np.random.default_rng(5)
+    detector = AnomalyDetector(stuck_count=50)
+    values = np.concatenate([noisy(rng, 300, 100), [1023] * 80, noisy(rng, 300, 50)])
+    found = detector.observe(readings(7, values))
+    stuck = [a for a in found if a.kind == 'stuck']
+    recovered = [a for a in found if a.kind == 'recovered']
+    assert len(stuck) == 1 and len(recovered) == 1
+    assert int(round(stuck[0].timestamp / 0.05)) == 100 + 49
+    assert int(round(recovered[0].timestamp / 0.05)) == 180
+    assert detector.stuck_ids() == []
+
+
+def test_stuck_ids_and_remove():
+    detector = AnomalyDetector(stuck_count=10)
+    detector.observe(readings(3, [0] * 12))
+    assert detector.stuck_ids() == [3]
+    detector.remove(3)
+    assert detector.stuck_ids() == []
+    detector.observe(readings(4, [0] * 12))
+    detector.clear()
+    assert detector.stuck_ids() == [] and detector.rows == {}
+
+
+def test_same_reading_away_from_a_rail_is_not_stuck():
+    detector = AnomalyDetector(stuck_count=10)
+    assert detector.observe(readings(3, [512] * 100)) == []
+
+
+def test_scalar_and_vector_paths_agree():
+    rng = np.random.default_rng(6)
+    n_devices, per_device = 40, 300
+    records = []
+    for d in range(n_devices):
+        level = rng.uniform(100, 900)
+        values = noisy(rng, level, per_device)
+        values[rng.integers(50, per_device, 2)] = rng.uniform(0, 1023, 2)
+        step = rng.integers(60, per_device - 20)
+        values[step:] = np.clip(values[step:] + rng.choice([-150, 150]), 0, 1023)
+        if d % 7 == 0:
+            values[100:170] = 0
+        records.extend(readings(d, values, start=d * 0.001))
+    records.sort(key=lambda r: r.timestamp)
+
+    scalar = AnomalyDetector(vector_threshold=10**9)
+    expected = scalar.observe(records)
+    assert {'change', 'outlier', 'stuck', 'recovered'} <= set(kinds(expected))
+    for batch in (33, 64, 1024, len(records)):
+        vector = AnomalyDetector(vector_threshold=1)
+        found = []
+        for i in range(0, len(records), batch):
+            found.extend(vector.observe(records[i:i + batch]))
+        assert found == expected, batch
+        assert vector.counts == scalar.counts
+
+
+def test_rows_grow_and_are_reused():
+    detector = AnomalyDetector(initial_devices=2)
+    detector.observe([Reading('LIGHT', d, 500, 'a', 0.0) for d in range(10)])
+    assert len(detector.rows) == 10 and len(detector.n) >= 10
+    detector.remove(4)
+    rows = len(detector.n)
+    detector.observe([Reading('LIGHT', 99, 500, 'a', 1.0)])
+    assert detector.rows[99] == 4 and len(detector.n) == rows
@@ -0,0 +1,115 @@
+import select
+import socket
+import time
+
+import pytest
+
+from ingest import IngestEngine
+from protocol import encode_binary_frame
+
+
+@pytest.fixture
+def link():
+    """A bound receive socket and a sender aimed at it"""
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(('127.0.0.1', 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = rx.getsockname()
+
+    def send(*datagrams):
+        for data in datagrams:
+            tx.sendto(data, target)
+        # Loopback delivery is immediate, but wait until the last one is readable
+        select.select([rx], [], [], 1.0)
+    yield rx, send
+    tx.close()
+    rx.close()
+
+
+def queued(engine):
+    records = []
+    while not engine.queue.empty():
+        records.append(engine.queue.get_nowait())
+    return records
+
+
+def test_drain_reads_at_most_a_batch_and_stops_on_eagain(link):
+    rx, send = link
+    engine = IngestEngine(rx, batch_size=3, clock=lambda: 100.0)
+    send(*[f'LIGHT:{i}:{i}'.encode() for i in range(5)])
+    assert engine.drain() == 3
+    assert engine.drain() == 2
+    started = time.perf_counter()
+    assert engine.drain() == 0                       # nothing pending: returns at once
+    assert time.perf_counter() - started < 0.1
+    assert [r.device_id for r in queued(engine)] == [0, 1, 2, 3, 4]
+    stats = engine.stats
+    assert (stats.received, stats.readings, stats.batches) == (5, 5, 2)
+    assert stats.last_error is None
+
+
+def test_malformed_frames_are_counted_and_skipped(link):
+    rx, send = link
+    engine = IngestEngine(rx, clock=lambda: 100.0)
+    send(b'MASTER:1:500', b'garbage', b'LIGHT:2:40000', b'RESET',
+         encode_binary_frame(3, [(0, 10, False), (100, 20, True)]), b'LIGHT:4:1')
+    assert engine.drain() == 6
+    records = queued(engine)
+    # The batch frame's older entry is dated back and queued first
+    assert [(r.device_id, r.reading) for r in records] == [(3, 10), (1, 500), (3, 20), (4, 1)]
+    assert [r.timestamp for r in records] == pytest.approx([99.9, 100.0, 100.0, 100.0])
+    assert engine.stats.malformed == 2
+    assert engine.stats.readings == 4
+
+
+def test_a_full_queue_drops_instead_of_blocking(link):
+    rx, send = link
+    engine = IngestEngine(rx, queue_size=2, clock=lambda: 100.0)
+    send(*[f'LIGHT:{i}:{i}'.encode() for i in range(5)])
+    assert engine.drain() == 5
+    assert engine.stats.dropped == 3 and engine.stats.readings == 2
+    assert [r.device_id for r in queued(engine)] == [0, 1]
+
+
+def test_socket_errors_end_the_pass():
+    class BrokenSocket:
+        def setsockopt(self, *args):
+            pass
+
+        def getsockopt(self, *args):
+            return 0
+
+        def setblocking(self, flag):
+            pass
+
+        def recvfrom_into(self, buf):
+            raise ConnectionRefusedError(111, 'refused')
+
+    engine = IngestEngine(BrokenSocket())
+    assert engine.drain() == 0
+    assert isinstance(engine.stats.last_error, ConnectionRefusedError)
+    assert engine.stats.batches == 0
+
+
+def test_thread_queues_readings_and_stops(link):
+    rx, send = link
+    engine = IngestEngine(rx).start()
+    try:
+        send(b'MASTER:1:500')
+        record = engine.queue.get(timeout=5.0)
+        assert (record.kind, record.device_id, record.reading) == ('MASTER', 1, 500)
+    finally:
+        started = time.perf_counter()
+        engine.stop(timeout=5.0)
+    # The select timeout bounds how long shutdown waits
+    assert not engine._thread.is_alive()
+    assert time.perf_counter() - started < 1.5
+
+
+def test_thread_exits_when_the_socket_is_closed(link):
+    rx, _ = link
+    engine = IngestEngine(rx).start()
+    rx.close()
+    engine._thread.join(5.0)
+    assert not engine._thread.is_alive()
+    engine.running = False
@@ -0,0 +1,120 @@
+import pytest
+
+from backends import HIGH, LOW, SimulatedGPIO, VirtualClock
+from leds import LedBlinker
+
+PIN, OTHER = 27, 23
+
+
+class ManualClock:
+    """Clock whose timers only run when fire() is called, as late as asked"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.timers = []
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        timer = VirtualTimer(self.now + delay, callback)
+        self.timers.append(timer)
+        return timer
+
+    def fire(self, lateness):
+        """Run the earliest live timer lateness seconds after it was due"""
+        timer = min((t for t in self.timers if not t.cancelled), key=lambda t: t.due)
+        self.timers.remove(timer)
+        self.now = timer.due + lateness
+        timer.callback()
+
+
+class VirtualTimer:
+    def __init__(self, due, callback):
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def leds():
+    clock = VirtualClock(start=0.0)
+    gpio = SimulatedGPIO()
+    yield LedBlinker(gpio, clock), gpio, clock
+    clock.stop()
+
+
+def levels(gpio, clock, times, pin=PIN):
+    out = []
+    for t in times:
+        clock.advance_to(t)
+        out.append(gpio.input(pin))
+    return out
+
+
+def test_blink_lights_at_once_and_toggles_every_half_period(leds):
+    blinker, gpio, clock = leds
+    blinker.blink(PIN, 0.5)
+    assert gpio.input(PIN) == HIGH
+    assert levels(gpio, clock, [0.4, 0.5, 0.9, 1.0, 1.5]) == [HIGH, LOW, LOW, HIGH, LOW]
+    assert blinker.toggles == 3
+
+
+def test_rate_change_retimes_the_phase_in_progress(leds):
+    blinker, gpio, clock = leds
+    blinker.blink(PIN, 1.0)
+    clock.advance_to(0.3)
+    blinker.blink(PIN, 0.5)                  # off at 0.5, not at 1.0
+    assert levels(gpio, clock, [0.49, 0.5, 1.0]) == [HIGH, LOW, HIGH]
+    clock.advance_to(1.2)
+    blinker.blink(PIN, 0.1)                  # phase already longer than 0.1: toggle now
+    clock.advance_to(1.2)
+    assert gpio.input(PIN) == LOW
+    assert levels(gpio, clock, [1.29, 1.3]) == [LOW, HIGH]
+
+
+def test_same_rate_keeps_the_phase(leds):
+    blinker, gpio, clock = leds
+    blinker.blink(PIN, 0.5)
+    clock.advance_to(0.4)
+    blinker.blink(PIN, 0.5)
+    assert levels(gpio, clock, [0.5]) == [LOW]
+
+
+def test_pulse_is_extended_by_a_second_pulse(leds):
+    blinker, gpio, clock = leds
+    blinker.pulse(OTHER, 1.0)
+    clock.advance_to(0.5)
+    blinker.pulse(OTHER, 1.0)
+    assert levels(gpio, clock, [1.2, 1.49, 1.5], OTHER) == [HIGH, HIGH, LOW]
+    assert not blinker.pulses
+
+
+def test_show_only_leaves_pulses_alone(leds):
+    blinker, gpio, clock = leds
+    blinker.blink(PIN, 0.5)
+    blinker.pulse(OTHER, 1.0)
+    blinker.show_only(None, 0.5)
+    assert gpio.input(PIN) == LOW and gpio.input(OTHER) == HIGH
+    blinker.stop_all()
+    assert gpio.input(OTHER) == LOW
+    clock.advance_to(2.0)
+    assert blinker.toggles == 0
+
+
+def test_jitter_stats_measure_lateness_without_drift():
+    clock = ManualClock()
+    blinker = LedBlinker(SimulatedGPIO(), clock)
+    blinker.blink(PIN, 1.0)
+    for lateness in (0.01, 0.03, 0.0, 0.02):
+        clock.fire(lateness)
+    # Each toggle is scheduled from when the previous one was due
+    assert [t.due for t in clock.timers if not t.cancelled] == [5.0]
+    stats = blinker.jitter_stats()
+    assert stats['toggles'] == 4
+    assert stats['mean'] == pytest.approx(0.015)
+    assert stats['max'] == pytest.approx(0.03)
+    assert stats['p99'] == pytest.approx(0.03)
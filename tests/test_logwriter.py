@@ -0,0 +1,106 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from binlog import BinaryLog, binary_filename
+from logwriter import LogWriter
+
+T0 = datetime(2024, 1, 18, 12, 34, 56).timestamp()
+
+
+def line(ts, device_id, reading, duration):
+    stamp = datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+    return f"{stamp}, {device_id}, 10.0.0.{device_id}, {reading}, {duration:.2f}\n"
+
+
+def write(writer, ts, device_id, reading, duration=0.0, is_master=True):
+    writer.write_record(ts, device_id, f'10.0.0.{device_id}', reading, duration, is_master)
+
+
+@pytest.fixture
+def batches():
+    """on_write callback that records each batch and signals when one arrives"""
+    written = []
+    arrived = threading.Event()
+
+    def on_write(records):
+        written.append(list(records))
+        arrived.set()
+    on_write.written = written
+    on_write.arrived = arrived
+    return on_write
+
+
+def test_rotation_keeps_every_line_in_the_file_current_when_it_was_logged(tmp_path):
+    first, second = str(tmp_path / 'a.log'), str(tmp_path / 'b.log')
+    writer = LogWriter(flush_size=1000, flush_interval=60.0)
+    writer.rotate(first, 'header a\n')
+    write(writer, T0, 1, 100, 0.5)
+    write(writer, T0 + 1, 2, 200, is_master=False)     # LIGHT: not in the text log
+    writer.write_text('summary a\n')
+    writer.rotate(second, 'header b\n')
+    write(writer, T0 + 2, 3, 300, 1.25)
+    assert writer.flush(timeout=5.0)
+    assert open(first).read() == 'header a\n' + line(T0, 1, 100, 0.5) + 'summary a\n'
+    assert open(second).read() == 'header b\n' + line(T0 + 2, 3, 300, 1.25)
+    assert writer.filename == second
+    writer.close()
+
+
+def test_flush_writes_a_partial_batch(tmp_path):
+    path = str(tmp_path / 'a.log')
+    writer = LogWriter(flush_size=1000, flush_interval=60.0)
+    writer.rotate(path)
+    for i in range(10):
+        write(writer, T0 + i, 1, i)
+    assert writer.flush(timeout=5.0)
+    assert writer.pending() == 0
+    assert open(path).read() == ''.join(line(T0 + i, 1, i, 0.0) for i in range(10))
+    assert writer.lines_written == 10
+    writer.close()
+
+
+def test_close_drains_the_queue_and_ignores_later_writes(tmp_path):
+    path = str(tmp_path / 'a.log')
+    writer = LogWriter(flush_size=1000, flush_interval=60.0, formats=('text', 'binary'))
+    writer.rotate(path)
+    for i in range(100):
+        write(writer, T0 + i / 10, i % 4, i, is_master=i % 2 == 0)
+    writer.close()
+    assert not writer._thread.is_alive()
+    assert len(open(path).read().splitlines()) == 50
+    log = BinaryLog(binary_filename(path))
+    assert len(log) == 100
+    log.close()
+    write(writer, T0 + 20, 1, 1)
+    assert writer.pending() == 0
+
+
+def test_full_batch_is_written_without_waiting_for_the_interval(tmp_path, batches):
+    writer = LogWriter(flush_size=3, flush_interval=60.0, on_write=batches)
+    writer.rotate(str(tmp_path / 'a.log'))
+    # A rotation is written straight away; start the batch after it
+    assert writer.flush(timeout=5.0)
+    write(writer, T0, 1, 1)
+    write(writer, T0 + 1, 1, 2)
+    time.sleep(0.05)
+    assert batches.written == [] and writer.pending() == 2
+    write(writer, T0 + 2, 1, 3)
+    assert batches.arrived.wait(5.0)
+    assert [r[3] for r in batches.written[0]] == [1, 2, 3]
+    writer.close()
+
+
+def test_partial_batch_is_written_after_the_interval(tmp_path, batches):
+    path = str(tmp_path / 'a.log')
+    writer = LogWriter(flush_size=1000, flush_interval=0.05, on_write=batches)
+    writer.rotate(path)
+    assert writer.flush(timeout=5.0)
+    queued = time.monotonic()
+    write(writer, T0, 1, 7)
+    assert batches.arrived.wait(5.0)
+    assert time.monotonic() - queued >= 0.04
+    assert open(path).read() == line(T0, 1, 7, 0.0)
+    writer.close()
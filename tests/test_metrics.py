@@ -0,0 +1,74 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import MetricsServer, Registry, merge_families, render_families
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    handled = registry.counter('lightswarm_handled_total', 'Readings handled')
+    handled.inc(3)
+    latency = registry.histogram('lightswarm_handle_seconds', 'Time to "handle"',
+                                 buckets=(0.001, 0.01))
+    for value in (0.0005, 0.005, 0.005, 2.0):
+        latency.observe(value)
+    registry.gauge('lightswarm_queue_depth', 'Queued records', lambda: 7)
+    registry.gauge('lightswarm_memory_bytes', 'Memory by part',
+                   lambda: {'store': 1024, 'rollups': 0.5}, label='part')
+    return registry
+
+
+def test_exposition_text(registry):
+    assert registry.render() == '\n'.join([
+        '# HELP lightswarm_handled_total Readings handled',
+        '# TYPE lightswarm_handled_total counter',
+        'lightswarm_handled_total 3',
+        '# HELP lightswarm_handle_seconds Time to \\"handle\\"',
+        '# TYPE lightswarm_handle_seconds histogram',
+        'lightswarm_handle_seconds_bucket{le="0.001"} 1',
+        'lightswarm_handle_seconds_bucket{le="0.01"} 3',
+        'lightswarm_handle_seconds_bucket{le="+Inf"} 4',
+        'lightswarm_handle_seconds_sum 2.0105',
+        'lightswarm_handle_seconds_count 4',
+        '# HELP lightswarm_queue_depth Queued records',
+        '# TYPE lightswarm_queue_depth gauge',
+        'lightswarm_queue_depth 7',
+        '# HELP lightswarm_memory_bytes Memory by part',
+        '# TYPE lightswarm_memory_bytes gauge',
+        'lightswarm_memory_bytes{part="rollups"} 0.5',
+        'lightswarm_memory_bytes{part="store"} 1024',
+    ]) + '\n'
+
+
+def test_a_failing_callback_is_left_out(registry):
+    registry.gauge('lightswarm_broken', 'Raises', lambda: 1 / 0)
+    text = registry.render()
+    assert 'lightswarm_broken' not in text and 'lightswarm_queue_depth 7' in text
+
+
+def test_merged_families_keep_their_sources_apart(registry):
+    other = Registry()
+    other.gauge('lightswarm_memory_bytes', 'Memory by part', lambda: {'store': 2048}, label='part')
+    text = render_families(merge_families([(registry.collect(), {'swarm': 'lab'}),
+                                           (other.collect(), {'swarm': 'floor'})]))
+    assert text.count('# TYPE lightswarm_memory_bytes gauge') == 1
+    assert 'lightswarm_memory_bytes{swarm="lab",part="store"} 1024' in text
+    assert 'lightswarm_memory_bytes{swarm="floor",part="store"} 2048' in text
+    assert 'lightswarm_handled_total{swarm="lab"} 3' in text
+
+
+def test_server_serves_metrics(registry):
+    server = MetricsServer(registry, 0).start()
+    try:
+        url = f'http://127.0.0.1:{server.port}'
+        with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert response.read().decode('utf-8') == registry.render()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + '/profile', timeout=5)
+        assert error.value.code == 404
+    finally:
+        server.stop()
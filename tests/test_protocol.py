@@ -0,0 +1,108 @@
+import pytest
+
+from protocol import (BINARY_MAGIC, MalformedFrame, Reading, ReadingOrder, encode_binary_frame,
+                      parse_binary_frame, parse_datagram, parse_frame)
+
+
+def test_text_frames():
+    assert parse_frame(b'MASTER:1234:567', '10.0.0.1', 5.0) == \
+        Reading('MASTER', 1234, 567, '10.0.0.1', 5.0)
+    assert parse_frame(b'LIGHT:7:0', '10.0.0.2', 6.0) == Reading('LIGHT', 7, 0, '10.0.0.2', 6.0)
+    assert parse_frame(b'LIGHT:7:1023', '10.0.0.2', 6.0).reading == 1023
+    assert parse_frame(b'RESET', '10.0.0.1', 5.0) is None
+    assert parse_frame(b'ACTIVATE', '10.0.0.1', 5.0) is None
+
+
+@pytest.mark.parametrize('data', [b'MASTER:12', b'OTHER:1:2', b'MASTER:x:1', b'\xff\xfe',
+                                  b'LIGHT:1:40000', b'LIGHT:1:-5', b'MASTER:-1:500',
+                                  b'LIGHT:1:1024'])
+def test_malformed_text_frames(data):
+    with pytest.raises(MalformedFrame):
+        parse_frame(data, '10.0.0.1', 0.0)
+
+
+def test_binary_frame_dates_entries_back_from_arrival():
+    frame = encode_binary_frame(42, [(1000, 10, False), (1050, 11, True), (1250, 12, False)])
+    records = parse_binary_frame(bytearray(frame), len(frame), '10.0.0.3', 100.0)
+    assert [(r.kind, r.device_id, r.reading) for r in records] == \
+        [('LIGHT', 42, 10), ('MASTER', 42, 11), ('LIGHT', 42, 12)]
+    assert [r.timestamp for r in records] == pytest.approx([99.75, 99.8, 100.0])
+
+
+def test_binary_frame_across_millis_wrap():
+    # millis() wraps at 2**32 between the first and last entry
+    frame = encode_binary_frame(9, [(2**32 - 100, 1, False), (2**32 - 1, 2, False), (150, 3, True)])
+    records = parse_binary_frame(bytearray(frame), len(frame), '10.0.0.3', 50.0)
+    assert [r.timestamp for r in records] == pytest.approx([49.75, 49.849, 50.0])
+
+
+def test_binary_frame_in_reused_buffer():
+    buf = bytearray(2048)
+    frame = encode_binary_frame(5, [(10, 300, True)])
+    buf[:len(frame)] = frame
+    assert parse_datagram(buf, len(frame), '10.0.0.4', 1.0) == \
+        [Reading('MASTER', 5, 300, '10.0.0.4', 1.0)]
+    buf[:15] = b'LIGHT:6:200\0\0\0\0'
+    assert parse_datagram(buf, 11, '10.0.0.5', 2.0) == [Reading('LIGHT', 6, 200, '10.0.0.5', 2.0)]
+
+
+def test_malformed_binary_frames():
+    frame = encode_binary_frame(5, [(10, 300, True), (20, 301, True)])
+    with pytest.raises(MalformedFrame):
+        parse_binary_frame(bytearray(frame), len(frame) - 1, 'a', 0.0)
+    with pytest.raises(MalformedFrame):
+        parse_binary_frame(bytearray(frame[:4]), 4, 'a', 0.0)
+    bad = bytearray(frame)
+    bad[1] = 99
+    with pytest.raises(MalformedFrame):
+        parse_binary_frame(bad, len(bad), 'a', 0.0)
+    # u16 readings above the 10-bit ADC range
+    for entries in ([(10, 40000, True)], [(10, 300, True), (20, 1024, False)]):
+        frame = encode_binary_frame(5, entries)
+        with pytest.raises(MalformedFrame):
+            parse_binary_frame(bytearray(frame), len(frame), 'a', 0.0)
+    assert frame[0] == BINARY_MAGIC
+
+
+def test_interleaved_frames_come_out_in_time_order():
+    # Eight nodes at 20/s, each sending a batch of 8 every 0.4 s, out of step
+    # with each other; one socket pass every 0.1 s reads whatever arrived
+    order = ReadingOrder()
+    stream = []
+    nodes = range(8)
+    node_ms = {node: node * 47 for node in nodes}
+    pending = {node: [] for node in nodes}
+    now = 1000.0
+    for tick in range(40):
+        now += 0.1
+        frames = []
+        for node in nodes:
+            for _ in range(2):
+                node_ms[node] += 50
+                pending[node].append((node_ms[node], 500 + node, node == 0))
+            if (tick + node) % 4 == 0:
+                frames.append(encode_binary_frame(node, pending[node]))
+                pending[node] = []
+        # A text node in the same pass
+        frames.append(b'LIGHT:99:1')
+        parsed = []
+        for frame in frames:
+            parsed.extend(parse_datagram(bytearray(frame), len(frame), '10.0.0.9', now))
+        stream.extend(order.order(parsed))
+
+    times = [r.timestamp for r in stream]
+    assert all(b >= a for a, b in zip(times, times[1:]))
+    assert len(stream) == 40 * 17 - sum(len(p) for p in pending.values())
+    # Readings from one node keep their own order
+    for node in nodes:
+        ms = [r for r in stream if r.device_id == node]
+        assert [r.timestamp for r in ms] == sorted(r.timestamp for r in ms)
+
+
+def test_order_lifts_only_what_would_go_backwards():
+    order = ReadingOrder()
+    first = order.order([Reading('LIGHT', 1, 1, 'a', 10.0), Reading('LIGHT', 2, 1, 'b', 9.0)])
+    assert [r.timestamp for r in first] == [9.0, 10.0]
+    second = order.order([Reading('LIGHT', 1, 2, 'a', 9.5), Reading('LIGHT', 2, 2, 'b', 10.5)])
+    assert [(r.device_id, r.timestamp) for r in second] == [(1, 10.0), (2, 10.5)]
+    assert order.order([]) == []
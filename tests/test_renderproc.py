@@ -0,0 +1,89 @@
+import pytest
+
+from renderproc import MASTERS, MAX_MASTERS, NO_SLOT_COLOR, SharedGraphView, SharedPlotState
+
+
+@pytest.fixture
+def shared():
+    state = SharedPlotState(capacity=256)
+    yield state
+    state.close()
+
+
+def publish(shared, totals, current=None, start=0.0, now=100.0):
+    shared.publish(now, totals, current, start, 30.0, lambda key: f'10.0.{key // 256}.{key % 256}')
+
+
+def view_of(shared):
+    view = SharedGraphView(30.0)
+    view.update(shared.snapshot())
+    return view
+
+
+def test_departed_slots_are_reused_once_none_are_free(shared):
+    totals = {}
+    for key in range(MAX_MASTERS):
+        shared.append(90.0, 500, key, f'10.0.0.{key}')
+        totals[key] = 1.0
+    publish(shared, totals)
+    shared.remove(3)
+    shared.remove(7)
+
+    # Departed masters keep their bars while no new master needs a slot
+    assert view_of(shared).get_master_durations(100.0)['10.0.0.3'] == 1.0
+
+    shared.append(95.0, 600, 1000, '10.0.3.232')
+    totals[1000] = 0.0
+    publish(shared, totals, current=1000, start=95.0)
+    snap = shared.snapshot()
+    assert snap['current'] == 3
+    assert int(shared.control[MASTERS]) == MAX_MASTERS
+    view = view_of(shared)
+    durations = view.get_master_durations(100.0)
+    assert '10.0.0.3' not in durations
+    assert durations['10.0.3.232'] == 5.0
+    assert durations['10.0.0.7'] == 1.0
+
+    # The reclaimed master's old samples are no longer drawn in its color
+    colors = view.trace(100.0)[2]
+    assert colors[3] == NO_SLOT_COLOR
+    assert colors[-1] == view.master_colors['10.0.3.232']
+
+
+def test_new_master_without_a_slot_does_not_alias(shared):
+    totals = {}
+    for key in range(MAX_MASTERS):
+        shared.append(90.0, 500, key, f'10.0.0.{key}')
+        totals[key] = 1.0
+    shared.append(91.0, 500, 999, '10.0.3.231')
+    totals[999] = 0.5
+    publish(shared, totals, current=999, start=91.0)
+    view = view_of(shared)
+    durations = view.get_master_durations(100.0)
+    assert durations['10.0.0.63'] == 1.0
+    assert '10.0.3.231' not in durations
+    assert shared.snapshot()['current'] == -1
+    assert view.trace(100.0)[2][-1] == NO_SLOT_COLOR
+
+
+def test_a_returning_master_gets_a_slot_again(shared):
+    for key in range(MAX_MASTERS):
+        shared.append(90.0, 500, key, f'10.0.0.{key}')
+    shared.remove(0)
+    shared.append(92.0, 500, 500, '10.0.1.244')    # takes slot 0
+    shared.remove(1)
+    shared.append(93.0, 500, 0, '10.0.0.0')        # back: takes departed slot 1
+    publish(shared, {0: 2.0, 500: 1.0}, current=0, start=93.0)
+    durations = view_of(shared).get_master_durations(100.0)
+    assert durations['10.0.0.0'] == 9.0
+    assert durations['10.0.1.244'] == 1.0
+    assert shared.snapshot()['current'] == 1
+
+
+def test_reset_frees_every_slot(shared):
+    for key in range(MAX_MASTERS + 5):
+        shared.append(90.0, 500, key, f'10.0.0.{key}')
+    shared.reset()
+    shared.append(95.0, 500, 7, '10.0.0.7')
+    publish(shared, {7: 0.0}, current=7, start=95.0)
+    assert shared.snapshot()['current'] == 0
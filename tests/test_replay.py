@@ -0,0 +1,31 @@
+from backends import HIGH, LOW, SimulatedGPIO, VirtualClock, create_display
+from RaspberryPi import LightSwarm, YELLOW_LED
+from replay import ReplayEngine
+from state import master_durations
+
+
+def test_captured_reset_and_activate_are_applied(tmp_path):
+    clock = VirtualClock(start=1000.0)
+    gpio = SimulatedGPIO()
+    swarm = LightSwarm(gpio=gpio, display=create_display('none', clock), clock=clock,
+                       log_dir=str(tmp_path), listen=False, reset_pin=None, device_ttl=0)
+    engine = ReplayEngine(swarm, clock, speed=0)
+    events = [(1000.0 + i, 'MASTER:1:500', '10.0.0.1') for i in range(5)]
+    events.append((1005.0, 'RESET', '10.0.0.100'))
+    first_log = swarm.current_logfile
+    try:
+        engine.run(iter(events))
+        assert engine.resets == 1 and engine.events == 5
+        assert swarm.current_logfile != first_log
+        assert gpio.input(YELLOW_LED) == HIGH
+
+        later = [(1006.0, 'ACTIVATE', '10.0.0.100')]
+        later += [(1007.0 + i, 'MASTER:2:600', '10.0.0.2') for i in range(3)]
+        engine.run(iter(later))
+        assert gpio.input(YELLOW_LED) == LOW
+        durations = master_durations(swarm.state.snapshot, clock.time())
+        assert set(durations) == {2}
+    finally:
+        swarm.running = False
+        clock.stop()
+        swarm.cleanup()
@@ -0,0 +1,88 @@
+import pytest
+
+from rollup import RollupEngine
+
+# Small rings so recycling and retention are quick to reach
+RESOLUTIONS = ((1, 10), (10, 6))
+
+
+def test_buckets_hold_min_max_mean_and_count():
+    rollups = RollupEngine(RESOLUTIONS)
+    for ts, reading in [(100.2, 10), (100.7, 30), (101.5, 50), (105.0, 7)]:
+        rollups.add(1, reading, ts)
+    series = rollups.series(1, 100.0, 110.0, resolution=1)
+    assert series['start'].tolist() == [100, 101, 105]
+    assert series['min'].tolist() == [10, 50, 7]
+    assert series['max'].tolist() == [30, 50, 7]
+    assert series['mean'].tolist() == [20.0, 50.0, 7.0]
+    assert series['count'].tolist() == [2, 1, 1]
+    coarse = rollups.series(1, 100.0, 110.0, resolution=10)
+    assert coarse['count'].tolist() == [4] and coarse['mean'][0] == pytest.approx(24.25)
+
+
+def test_ring_slots_are_recycled_for_newer_buckets():
+    rollups = RollupEngine(RESOLUTIONS)
+    rollups.add(1, 100, 100.5)
+    rollups.add(1, 900, 110.5)          # same slot (100 % 10 == 110 % 10), ten seconds on
+    series = rollups.series(1, 100.0, 111.0, resolution=1)
+    assert series['start'].tolist() == [110]
+    assert series['min'].tolist() == [900] and series['count'].tolist() == [1]
+
+
+def test_master_time_is_split_at_bucket_edges_and_capped_at_the_gap():
+    rollups = RollupEngine(RESOLUTIONS, max_master_gap=3.0)
+    rollups.add(1, 500, 100.5, is_master=True)
+    rollups.add(1, 500, 102.0, is_master=True)
+    rollups.add(2, 500, 103.0, is_master=True)   # 1 is credited up to here
+    rollups.add(2, 500, 110.0, is_master=True)   # 7 s silence: only 3 s credited
+    rollups.end_master(111.0)
+    assert rollups.master_time(100.0, 120.0, resolution=1) == {1: 2.5, 2: 4.0}
+    series = rollups.series(1, 100.0, 110.0, resolution=1)
+    assert series['master_seconds'].tolist() == [0.5, 1.0, 1.0]
+    assert rollups.master_time(100.0, 120.0) == {1: 2.5, 2: 4.0}
+
+
+def test_master_time_never_runs_backwards():
+    rollups = RollupEngine(RESOLUTIONS)
+    rollups.add(1, 500, 100.0, is_master=True)
+    rollups.add(1, 500, 101.0, is_master=True)
+    rollups.add(1, 500, 100.5, is_master=True)   # late packet
+    rollups.add(1, 500, 102.0, is_master=True)
+    rollups.end_master(102.0)
+    assert rollups.master_time(90.0, 110.0, resolution=1) == {1: 2.0}
+
+
+def test_master_time_picks_the_finest_level_covering_the_range():
+    rollups = RollupEngine(RESOLUTIONS)
+    rollups.add(1, 500, 100.0, is_master=True)
+    rollups.end_master(102.0)
+    assert rollups.master_time(95.0, 105.0) == {1: 2.0}      # 1 s level covers 10 s
+    assert rollups.master_time(50.0, 105.0) == {1: 2.0}      # needs the 10 s level
+    with pytest.raises(ValueError):
+        rollups.master_time(95.0, 105.0, resolution=5)
+
+
+def test_departed_rows_are_reclaimed_after_retention():
+    rollups = RollupEngine(RESOLUTIONS)
+    assert rollups.retention == 60
+    rollups.add(1, 100, 100.0)
+    rollups.add(2, 200, 100.0)
+    rollups.release(1, 101.0)
+    rollups.add(3, 300, 120.0)                   # too soon: a new row
+    assert rollups.rows == {1: 0, 2: 1, 3: 2}
+    assert rollups.series(1, 90.0, 110.0, resolution=1)['count'].tolist() == [1]
+
+    rollups.add(4, 400, 161.0)                   # 60 s after 1 left: takes its row
+    assert rollups.rows == {2: 1, 3: 2, 4: 0}
+    assert rollups.series(1, 90.0, 170.0)['count'].size == 0
+    series = rollups.series(4, 90.0, 170.0, resolution=10)
+    assert series['start'].tolist() == [160] and series['min'].tolist() == [400]
+
+
+def test_a_device_back_before_retention_keeps_its_row():
+    rollups = RollupEngine(RESOLUTIONS)
+    rollups.add(1, 100, 100.0)
+    rollups.release(1, 101.0)
+    rollups.add(1, 110, 130.0)
+    rollups.add(2, 200, 500.0)
+    assert rollups.rows == {1: 0, 2: 1}
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from scheduler import Scheduler
+
+
+def collect(scheduler, delays, cancel=()):
+    """Schedule one callback per delay; returns (fired names, event set when all ran)"""
+    fired = []
+    done = threading.Event()
+    expected = len(delays) - len(cancel)
+
+    def make(name):
+        def callback():
+            fired.append(name)
+            if len(fired) == expected:
+                done.set()
+        return callback
+    timers = {name: scheduler.call_later(delay, make(name)) for name, delay in delays.items()}
+    for name in cancel:
+        timers[name].cancel()
+    return fired, done
+
+
+def test_callbacks_run_earliest_first():
+    scheduler = Scheduler()
+    try:
+        fired, done = collect(scheduler, {'a': 0.06, 'b': 0.02, 'c': 0.04, 'd': 0.0})
+        assert done.wait(5.0)
+        assert fired == ['d', 'b', 'c', 'a']
+    finally:
+        scheduler.stop()
+
+
+def test_cancelled_timers_do_not_run():
+    scheduler = Scheduler()
+    try:
+        fired, done = collect(scheduler, {'a': 0.01, 'b': 0.02, 'c': 0.03}, cancel=('b',))
+        assert done.wait(5.0)
+        time.sleep(0.05)
+        assert fired == ['a', 'c']
+    finally:
+        scheduler.stop()
+
+
+def test_an_earlier_timer_wakes_the_waiting_thread():
+    scheduler = Scheduler()
+    try:
+        late = threading.Event()
+        early = threading.Event()
+        scheduler.call_later(30.0, late.set)
+        time.sleep(0.02)                         # thread is now waiting ~30 s
+        started = time.monotonic()
+        scheduler.call_later(0.01, early.set)
+        assert early.wait(5.0)
+        assert time.monotonic() - started < 1.0
+        assert not late.is_set()
+    finally:
+        scheduler.stop()
+
+
+def test_a_failing_callback_does_not_stop_the_thread():
+    scheduler = Scheduler()
+    try:
+        ran = threading.Event()
+        scheduler.call_later(0.0, lambda: 1 / 0)
+        scheduler.call_later(0.01, ran.set)
+        assert ran.wait(5.0)
+    finally:
+        scheduler.stop()
+
+
+def test_stop_drops_pending_timers():
+    scheduler = Scheduler()
+    ran = threading.Event()
+    scheduler.call_later(0.05, ran.set)
+    scheduler.stop()
+    assert not ran.wait(0.1)
@@ -0,0 +1,74 @@
+import pytest
+
+from sessiondb import HIST_BUCKET, HIST_BUCKETS, SessionDB, histogram_percentile
+
+
+def test_percentile_interpolates_within_the_bucket():
+    counts = [0] * HIST_BUCKETS
+    counts[16] = 100           # every reading in 512..543
+    assert histogram_percentile(counts, 0.5) == 16 * HIST_BUCKET + HIST_BUCKET // 2
+    assert histogram_percentile(counts, 0.1) < histogram_percentile(counts, 0.9)
+
+
+def test_percentile_stays_within_recorded_min_and_max():
+    counts = [0] * HIST_BUCKETS
+    counts[15] = 10
+    counts[16] = 90            # max reading 516, low in its bucket
+    assert histogram_percentile(counts, 0.9, lo=490, hi=516) == 516
+    assert histogram_percentile(counts, 0.01, lo=490, hi=516) >= 490
+
+
+def test_percentile_of_empty_histogram():
+    assert histogram_percentile([0] * HIST_BUCKETS, 0.5) is None
+
+
+def record(ts, device_id, reading, is_master=True):
+    return (ts, device_id, f'10.0.0.{device_id}', reading, 0.0, is_master)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SessionDB(str(tmp_path / 'sessions.db'))
+    # Session 1: 1 -> 2 -> no master -> 1 again, written in two batches
+    db.start_session('a.log')
+    db.write([record(100.0 + i, 1 if i < 10 else 2, 500 + i) for i in range(20)],
+             [(100.0, 1, '10.0.0.1'), (110.0, 2, '10.0.0.2'), (120.0, None, None)])
+    db.write([record(125.0 + i, 1, 600) for i in range(6)] + [record(126.0, 3, 10, False)],
+             [(125.0, 1, '10.0.0.1')])
+    # Session 2, long after: 2 is master until its last reading
+    db.start_session('b.log')
+    db.write([record(1000.0 + i, 2, 700) for i in range(11)], [(1000.0, 2, '10.0.0.2')])
+    yield db
+    db.close()
+
+
+def test_sessions_listing(db):
+    assert db.sessions() == [(1, 'a.log', 100.0, 130.0, 27), (2, 'b.log', 1000.0, 1010.0, 11)]
+    assert [row[0] for row in db.sessions(since=500.0)] == [2]
+    assert [row[0] for row in db.sessions(until=500.0)] == [1]
+
+
+def test_master_time_runs_end_at_the_next_change_or_the_session_end(db):
+    # 1: 100..110 and 125..130 (last run ends with the session, not at 1000);
+    # 2: 110..120, then no master until 125, and 1000..1010 in session 2
+    # Most master time first
+    assert db.master_time() == [('10.0.0.2', 2, 20.0, 2), ('10.0.0.1', 1, 15.0, 2)]
+
+
+def test_master_time_is_clipped_to_the_range(db):
+    assert sorted(db.master_time(since=105.0, until=1005.0)) == \
+        [('10.0.0.1', 1, 10.0, 2), ('10.0.0.2', 2, 15.0, 2)]
+    # Only the gap with no master
+    assert db.master_time(since=121.0, until=124.0) == []
+
+
+def test_reading_stats(db):
+    stats = db.reading_stats()
+    n, mean, std, lo, hi, master_n = stats[1]
+    assert (n, lo, hi, master_n) == (16, 500, 600, 16)
+    assert mean == pytest.approx((sum(range(500, 510)) + 6 * 600) / 16)
+    n, mean, std, lo, hi, master_n = stats[3]
+    assert (n, mean, std, lo, hi, master_n) == (1, 10.0, 0.0, 10, 10, 0)
+    assert db.reading_stats(device_id=2)[2][0] == 21
+    # Hour resolution: every reading above falls in the first hour
+    assert set(db.reading_stats(since=3600.0)) == set()
@@ -0,0 +1,46 @@
+import pytest
+
+from RaspberryPi import BROADCAST_IP, LED_PINS, RESET_BUTTON
+from sharded import main, parse_swarm, worker_options
+from state import DEFAULT_TTL
+
+OPTIONS = {'dashboard_base': 8080, 'dashboard_port': None, 'dashboard_host': '127.0.0.1'}
+
+
+def test_each_worker_gets_the_next_dashboard_port():
+    ports = [worker_options(OPTIONS, i)['dashboard_port'] for i in range(3)]
+    assert ports == [8080, 8081, 8082]
+    assert OPTIONS['dashboard_port'] is None          # shared options untouched
+
+
+def test_no_dashboard_without_a_base():
+    options = dict(OPTIONS, dashboard_base=None)
+    assert worker_options(options, 2)['dashboard_port'] is None
+
+
+def test_only_the_first_swarm_gets_the_default_pins():
+    first = parse_swarm('lab1:2910', first=True)
+    assert (first.name, first.port, first.broadcast_ip) == ('lab1', 2910, BROADCAST_IP)
+    assert first.led_pins == LED_PINS and first.reset_pin == RESET_BUTTON
+    assert first.ttl == DEFAULT_TTL
+    second = parse_swarm('lab2:2911:192.168.2.255:leds=5,6:button=19:command_port=4000:ttl=3')
+    assert second.broadcast_ip == '192.168.2.255'
+    assert second.led_pins == (5, 6) and second.reset_pin == 19
+    assert second.command_port == 4000 and second.ttl == 3.0
+    assert parse_swarm('lab3:2912').led_pins == () and parse_swarm('lab3:2912').reset_pin is None
+
+
+@pytest.mark.parametrize('spec', ['lab', ':2910', 'lab:2910:colour=red'])
+def test_bad_swarm_specs(spec):
+    with pytest.raises(ValueError):
+        parse_swarm(spec)
+
+
+@pytest.mark.parametrize('argv', [
+    ['--swarm', 'a:2910', '--swarm', 'a:2911'],
+    ['--swarm', 'a:2910', '--swarm', 'b:2910'],
+    ['--swarm', 'a:2910', '--swarm', 'b:2911', '--dashboard-base', '8080', '--metrics-port', '8081'],
+])
+def test_clashing_names_and_ports_are_rejected_before_starting(argv):
+    with pytest.raises(SystemExit):
+        main(argv)
@@ -0,0 +1,139 @@
+import pytest
+
+from protocol import Reading
+from state import SwarmState, master_duration, master_durations
+
+
+def master(device_id, ts, reading=500):
+    return Reading('MASTER', device_id, reading, f'10.0.0.{device_id}', ts)
+
+
+def light(device_id, ts, reading=500):
+    return Reading('LIGHT', device_id, reading, f'10.0.0.{device_id}', ts)
+
+
+def test_master_changes_credit_the_previous_run():
+    state = SwarmState(led_pins=(27, 23), start=0.0, ttl=0)
+    assert state.apply_reading(master(1, 10.0)).new == 1
+    assert state.apply_reading(master(1, 11.0)) is None
+    change = state.apply_reading(master(2, 13.5))
+    assert (change.old, change.new) == (1, 2)
+    state.apply_reading(master(1, 14.0))
+    snap = state.snapshot
+    assert snap.master_totals == {1: 3.5, 2: 0.5}
+    assert master_durations(snap, 16.0) == {1: 5.5, 2: 0.5}
+    assert master_duration(snap, 2, 16.0) == 0.5
+    assert {d: info.led for d, info in snap.devices.items()} == {1: 27, 2: 23}
+
+
+def test_snapshots_are_not_modified():
+    state = SwarmState(start=0.0, ttl=0)
+    state.apply_reading(master(1, 1.0))
+    before = state.snapshot
+    totals = dict(before.master_totals)
+    state.apply_reading(master(2, 2.0))
+    state.apply_reading(light(3, 2.5))
+    assert before.master_totals == totals
+    assert set(before.devices) == {1}
+    assert state.snapshot.version > before.version
+
+
+def test_silent_devices_expire_and_free_their_led():
+    state = SwarmState(led_pins=(27,), start=0.0, ttl=10.0)
+    state.apply_reading(master(1, 0.0))
+    state.apply_reading(light(2, 0.0))
+    for t in range(1, 8):
+        state.apply_reading(light(2, float(t)))
+    assert state.expire(9.9) == []
+
+    departures = state.expire(10.0)
+    assert [(d.device_id, d.led, d.was_master, d.last_seen) for d in departures] == \
+        [(1, 27, True, 0.0)]
+    snap = state.snapshot
+    assert set(snap.devices) == {2}
+    assert snap.master is None
+    # The freed pin goes to the next master
+    state.apply_reading(master(2, 11.0))
+    assert state.snapshot.devices[2].led == 27
+    assert [d.device_id for d in state.expire(17.0)] == []
+    assert [d.device_id for d in state.expire(21.0)] == [2]
+
+
+def test_departed_master_keeps_its_session_time():
+    state = SwarmState(start=0.0, ttl=5.0)
+    state.apply_reading(master(1, 0.0))
+    state.apply_reading(master(1, 3.0))
+    state.apply_reading(light(2, 3.0))
+    state.apply_reading(master(2, 4.0))
+    for t in (5.0, 6.0, 7.0, 8.0):
+        state.apply_reading(master(2, t))
+    # Device 1 was master 0-4 s, then went silent
+    assert [d.device_id for d in state.expire(9.0)] == [1]
+    snap = state.snapshot
+    assert 1 not in snap.devices
+    assert snap.master_totals[1] == pytest.approx(4.0)
+    assert snap.departed[1].addr == '10.0.0.1'
+    assert master_durations(snap, 9.0) == pytest.approx({1: 4.0, 2: 5.0})
+
+    # The current master departing is credited up to its last packet
+    assert [d.device_id for d in state.expire(14.0)] == [2]
+    assert state.snapshot.master_totals == pytest.approx({1: 4.0, 2: 4.0})
+    assert state.snapshot.master is None
+
+    # Coming back removes it from departed and adds to its total
+    state.apply_reading(master(1, 20.0))
+    state.apply_reading(master(1, 22.0))
+    snap = state.snapshot
+    assert 1 in snap.devices and 1 not in snap.departed
+    assert master_durations(snap, 22.0)[1] == pytest.approx(6.0)
+
+
+def test_expiry_check_is_lazy():
+    state = SwarmState(start=0.0, ttl=10.0)
+    for device_id in range(100):
+        state.apply_reading(light(device_id, 0.0))
+    for device_id in range(50):
+        state.apply_reading(light(device_id, 8.0))
+    assert len(state.expire(10.0)) == 50
+    # One heap entry per live device
+    assert len(state._expiry) == 50
+    assert len(state.expire(18.0)) == 50
+    assert state.snapshot.devices == {}
+
+
+def test_reset_and_activate_start_fresh():
+    state = SwarmState(led_pins=(27,), start=0.0, ttl=5.0)
+    state.apply_reading(master(1, 1.0))
+    final = state.reset(2.0)
+    assert final.master == 1
+    assert not state.snapshot.active
+    assert state.apply_reading(master(2, 2.5)) is None
+    state.activate(3.0)
+    snap = state.snapshot
+    assert snap.active and snap.devices == {} and snap.master_totals == {}
+    assert snap.session_start == 3.0
+    state.apply_reading(master(2, 4.0))
+    assert state.snapshot.devices[2].led == 27
+    assert state.expire(100.0)[0].device_id == 2
+
+
+def test_no_ttl_never_expires():
+    state = SwarmState(start=0.0, ttl=0)
+    state.apply_reading(light(1, 0.0))
+    assert state.expire(1e9) == []
+
+
+def test_departed_masters_beyond_the_limit_are_summed():
+    state = SwarmState(start=0.0, ttl=5.0, max_departed=2)
+    for device_id in range(4):
+        # Each master for one second, then silent
+        state.apply_reading(master(device_id, float(device_id)))
+    state.apply_reading(light(9, 3.0))
+    state.apply_reading(light(9, 20.0))
+    departures = state.expire(20.0)
+    assert [d.device_id for d in departures] == [0, 1, 2, 3]
+    snap = state.snapshot
+    assert list(snap.departed) == [2, 3]
+    assert snap.master_totals == {2: 1.0, 3: 0.0}
+    assert snap.folded == (2, 2.0)
+    assert master_durations(snap, 20.0) == {2: 1.0, 3: 0.0}
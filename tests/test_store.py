@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from store import DeviceStore
+
+
+def test_capacity_grows_to_hold_the_window_of_a_fast_device():
+    store = DeviceStore(window=30.0, rate_hint=10.0)
+    for i in range(4000):
+        # 100 packets/s for 40 s
+        store.add(1, i % 1000, i / 100, is_master=True)
+    assert store.device_capacity(1) >= 3000
+    times, readings, device_ids = store.master_trace(39.99)
+    assert len(times) == 3000
+    assert times[0] == 10.0 and times[-1] == 39.99
+    assert np.all(np.diff(times) > 0)
+    assert readings[-1] == 3999 % 1000
+    assert set(device_ids.tolist()) == {1}
+
+
+def test_only_the_fast_device_grows():
+    store = DeviceStore(window=30.0, rate_hint=2.0)
+    for i in range(200):
+        t = i * 0.5
+        for device_id in range(2, 10):
+            store.add(device_id, device_id, t)        # 2 packets/s: fits
+        store.add(1, 5, t, is_master=True)           # 4 packets/s: outgrows 61 samples
+        store.add(1, 6, t + 0.25, is_master=True)
+    assert store.device_capacity(1) == 122
+    assert {store.device_capacity(d) for d in range(2, 10)} == {61}
+    # 16 rows of 61 samples (grown for the ninth device) and one of 122;
+    # 11 bytes per sample, 16 per row
+    assert store.memory_bytes() == 16 * (61 * 11 + 16) + (122 * 11 + 16)
+
+    stats = store.window_stats(99.75)
+    counts = dict(zip(stats['device_ids'].tolist(), stats['count'].tolist()))
+    assert counts == {**{d: 60 for d in range(2, 10)}, 1: 121}
+    times, readings, device_ids = store.master_trace(99.75)
+    assert len(times) == 121 and set(device_ids.tolist()) == {1}
+    assert np.all(np.diff(times) > 0)
+    assert readings[-1] == 6
+
+
+def test_window_stats_per_device_and_across_devices():
+    store = DeviceStore(window=10.0)
+    for i in range(20):
+        store.add(1, 100 + i, float(i))
+        store.add(2, 500, float(i), is_master=True)
+    store.add(3, 900, 0.0)                            # only outside the window
+    stats = store.window_stats(19.0)
+    by_device = {d: i for i, d in enumerate(stats['device_ids'].tolist())}
+    one, two, three = by_device[1], by_device[2], by_device[3]
+    assert stats['count'][one] == 11                  # t = 9..19
+    assert (stats['min'][one], stats['max'][one]) == (109, 119)
+    assert stats['mean'][one] == pytest.approx(114.0)
+    assert stats['percentiles'][two].tolist() == [500, 500, 500]
+    assert stats['count'][three] == 0 and np.isnan(stats['mean'][three])
+    assert stats['all']['count'] == 22
+    assert (stats['all']['min'], stats['all']['max']) == (109, 500)
+    assert store.window_stats(100.0)['all']['count'] == 0
+
+
+def test_fixed_capacity_shortens_the_window():
+    store = DeviceStore(window=30.0, capacity=100)
+    for i in range(1000):
+        store.add(1, 0, i / 10, is_master=True)
+    assert store.device_capacity(1) == 100
+    assert len(store.master_trace(99.9)[0]) == 100
+
+
+def test_removed_rows_are_reused_after_promotion():
+    store = DeviceStore(window=10.0, rate_hint=1.0, initial_devices=1)
+    for i in range(50):
+        store.add(1, 1, i * 0.1, is_master=True)
+    store.add(2, 2, 5.0, is_master=True)
+    store.remove(1)
+    assert 1 not in store and len(store) == 1
+    store.add(3, 3, 6.0, is_master=True)
+    times, readings, device_ids = store.master_trace(6.0)
+    assert device_ids.tolist() == [2, 3]
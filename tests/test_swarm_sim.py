@@ -0,0 +1,14 @@
+import pytest
+
+from swarm_sim import SwarmSimulator, main
+
+
+@pytest.mark.parametrize('batch', ['0', '256'])
+def test_batch_outside_a_frame_is_rejected_by_the_cli(batch):
+    with pytest.raises(SystemExit):
+        main(['--binary', '--batch', batch, '--duration', '0.01'])
+
+
+def test_batch_outside_a_frame_is_rejected_by_the_simulator():
+    with pytest.raises(ValueError):
+        SwarmSimulator(target=None, binary=True, batch=256)